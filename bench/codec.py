@@ -0,0 +1,184 @@
+# Codec benchmark and differential check against Scapy.
+# -----------------------------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Usage: python3 -m bench.codec [cases]
+#
+# Generates random OPEN, KEEPALIVE, NOTIFICATION and UPDATE messages, and
+# checks that protos.codec encodes them to exactly the bytes Scapy does and
+# decodes Scapy's output back to the field values it was built from. Exits
+# non-zero if anything mismatched, after reporting decode cost for both.
+
+from protos import codec
+from scapy.contrib.bgp import (
+    BGPHeader,
+    BGPKeepAlive,
+    BGPNLRI_IPv4,
+    BGPNotification,
+    BGPOpen,
+    BGPOptParam,
+    BGPPathAttr,
+    BGPUpdate,
+)
+from scapy.packet import Raw
+from socket import inet_ntoa
+import random
+import sys
+import time
+
+
+def random_ip(rng):
+    return inet_ntoa(bytes(rng.randrange(256) for _ in range(4)))
+
+
+def random_prefix(rng):
+    plen = rng.randrange(33)
+    addr = rng.getrandbits(32) & ((0xFFFFFFFF << (32 - plen)) & 0xFFFFFFFF)
+    return "{}/{}".format(inet_ntoa(addr.to_bytes(4, "big")), plen)
+
+
+def random_case(rng):
+    """
+    Generate one message both ways.
+
+    :return: (codec bytes, scapy bytes, expected field values)
+    :rtype: tuple
+    """
+    kind = rng.choice(["OPEN", "KEEPALIVE", "NOTIFICATION", "UPDATE"])
+    if kind == "OPEN":
+        my_as, hold_time = rng.randrange(1 << 16), rng.randrange(1 << 16)
+        bgp_id = random_ip(rng)
+        params = [
+            codec.OptParam(
+                2, bytes(rng.randrange(256) for _ in range(rng.randrange(8)))
+            )
+            for _ in range(rng.randrange(3))
+        ]
+        ours = codec.encode_open(my_as, hold_time, bgp_id, opt_params=params)
+        theirs = BGPHeader() / BGPOpen(
+            my_as=my_as,
+            hold_time=hold_time,
+            bgp_id=bgp_id,
+            opt_params=[
+                BGPOptParam(param_type=p.type, param_length=len(p.value)) / p.value
+                for p in params
+            ],
+        )
+        fields = {
+            "my_as": my_as,
+            "hold_time": hold_time,
+            "bgp_id": bgp_id,
+            "opt_params": params,
+        }
+    elif kind == "KEEPALIVE":
+        ours, theirs, fields = codec.encode_keepalive(), BGPKeepAlive(), {}
+    elif kind == "NOTIFICATION":
+        code, subcode = rng.randrange(256), rng.randrange(256)
+        data = bytes(rng.randrange(256) for _ in range(rng.randrange(16)))
+        ours = codec.encode_notification(code, subcode, data)
+        theirs = BGPHeader() / BGPNotification(
+            error_code=code, error_subcode=subcode, data=data
+        )
+        fields = {"error_code": code, "error_subcode": subcode, "data": data}
+    else:
+        withdrawn = [random_prefix(rng) for _ in range(rng.randrange(5))]
+        nlri = [random_prefix(rng) for _ in range(rng.randrange(5))]
+        attrs = [
+            codec.PathAttribute(
+                codec.ATTR_TRANSITIVE,
+                rng.randrange(1, 16),
+                bytes(rng.randrange(256) for _ in range(rng.randrange(12))),
+            )
+            for _ in range(rng.randrange(4))
+        ]
+        ours = codec.encode_update(withdrawn, attrs, nlri)
+        theirs = BGPHeader() / BGPUpdate(
+            withdrawn_routes=[BGPNLRI_IPv4(prefix=p) for p in withdrawn],
+            path_attr=[
+                BGPPathAttr(
+                    type_flags=a.flags,
+                    type_code=a.type_code,
+                    attribute=Raw(load=a.value) if a.value else None,
+                )
+                for a in attrs
+            ],
+            nlri=[BGPNLRI_IPv4(prefix=p) for p in nlri],
+        )
+        fields = {"withdrawn_routes": withdrawn, "path_attr": attrs, "nlri": nlri}
+    return ours, bytes(theirs), fields
+
+
+def check(cases, seed=0):
+    """
+    Run the differential check.
+
+    :return: list of (case number, description) for every mismatch
+    :rtype: list
+    """
+    rng = random.Random(seed)
+    failures = []
+    for i in range(cases):
+        ours, theirs, fields = random_case(rng)
+        if ours != theirs:
+            failures.append((i, "encode: {} != {}".format(ours.hex(), theirs.hex())))
+            continue
+        msg = codec.decode(memoryview(theirs))
+        for name, value in fields.items():
+            if getattr(msg, name) != value:
+                failures.append(
+                    (
+                        i,
+                        "decode {}: {!r} != {!r}".format(
+                            name, getattr(msg, name), value
+                        ),
+                    )
+                )
+    return failures
+
+
+def bench(cases=2000, seed=0):
+    """
+    Time full decoding of every message with the codec and with Scapy.
+
+    :return: (codec, scapy) microseconds per message
+    :rtype: tuple
+    """
+    rng = random.Random(seed)
+    msgs = [random_case(rng)[1] for _ in range(cases)]
+
+    start = time.perf_counter()
+    for m in msgs:
+        msg = codec.decode(memoryview(m))
+        msg.decode_body()
+    ours = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for m in msgs:
+        BGPHeader(m)
+    theirs = time.perf_counter() - start
+
+    return ours / cases * 1e6, theirs / cases * 1e6
+
+
+if __name__ == "__main__":
+    cases = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    failures = check(cases)
+    for i, what in failures[:10]:
+        print("case {}: {}".format(i, what))
+    print("differential: {} cases, {} mismatches".format(cases, len(failures)))
+    ours, theirs = bench()
+    print("decode: codec {:.1f}us/msg, scapy {:.1f}us/msg".format(ours, theirs))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,94 @@
+# Receive framing benchmark.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Usage: python3 -m bench.framing
+#
+# Segments a backlog of N queued BGP messages and reports the cost per
+# message. With the Framer this should stay flat as N grows; the old
+# BytesIO-based segmentation is included for comparison.
+
+from io import BytesIO
+from protos.framing import Framer
+import time
+
+HEADER_SIZE = 19
+MARKER = b"\xff" * 16
+KEEPALIVE = MARKER + b"\x00\x13\x04"
+NOTIFICATION = MARKER + b"\x00\x15\x03\x06\x00"
+
+BACKLOGS = [10, 100, 1000, 10000]
+
+
+def backlog(n):
+    return (KEEPALIVE + NOTIFICATION) * (n // 2)
+
+
+def legacy_drain(inbuf, handler):
+    """Segmentation as done by the original BytesIO receive path."""
+    count = 0
+    while inbuf.tell() >= HEADER_SIZE:
+        v = inbuf.getbuffer()
+        msglen = int.from_bytes(v[16:18], byteorder="big")
+        if inbuf.tell() < msglen:
+            break
+        inbuf.seek(0)
+        packet = inbuf.read(msglen)
+        rest = bytes(v[msglen:])
+        del v
+        inbuf = BytesIO(rest)
+        inbuf.seek(0, 2)
+        handler(packet)
+        count += 1
+    return count
+
+
+def bench_framer(data):
+    framer = Framer(HEADER_SIZE, 16, max_size=4096, marker=MARKER)
+    framer.write(data)
+    start = time.perf_counter()
+    count = framer.drain(len)
+    return time.perf_counter() - start, count
+
+
+def bench_legacy(data):
+    inbuf = BytesIO()
+    inbuf.write(data)
+    start = time.perf_counter()
+    count = legacy_drain(inbuf, len)
+    return time.perf_counter() - start, count
+
+
+def run(rounds=5):
+    """
+    Run the benchmark.
+
+    :return: mapping of backlog size to (framer, legacy) ns per message
+    :rtype: dict
+    """
+    results = {}
+    for n in BACKLOGS:
+        data = backlog(n)
+        framer = min(bench_framer(data)[0] for _ in range(rounds))
+        legacy = min(bench_legacy(data)[0] for _ in range(rounds))
+        results[n] = (framer / n * 1e9, legacy / n * 1e9)
+    return results
+
+
+if __name__ == "__main__":
+    print("{:>8} {:>14} {:>14}".format("backlog", "framer ns/msg", "legacy ns/msg"))
+    for n, (framer, legacy) in run().items():
+        print("{:>8} {:>14.0f} {:>14.0f}".format(n, framer, legacy))
@@ -0,0 +1,93 @@
+# Offline receive path benchmark.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Usage: python3 -m bench.replay [capture]
+#
+# Feeds the received side of a capture through BGP.handle_data_received with
+# no network involved, and reports how fast the receive path consumed it.
+# Without a capture, one is first recorded from a session exchanging
+# KEEPALIVEs with a loopback stand-in peer.
+
+from bench.sessions import start_peer
+from protos.bgp import BGP
+from protos.capture import Capture, Recorder, feed
+import logging
+import os
+import sys
+import tempfile
+import time
+
+
+def record(path, messages=100000):
+    """Record a session that sends ``messages`` KEEPALIVEs to the stand-in."""
+    from twisted.internet import reactor
+
+    child, port = start_peer()
+    session = BGP("127.0.0.1", 1, "10.0.0.1", port=port)
+    session.recorder = Recorder(path)
+    logging.getLogger("BGP").setLevel(logging.WARNING)
+
+    def done(sent):
+        reactor.callLater(1, stop)
+
+    def stop():
+        session._event("ManualStop")
+        session.recorder.close()
+        reactor.stop()
+
+    def check():
+        if session.state == "Established":
+            keepalive = session.make_bytes("KEEPALIVE")
+            session.send_messages((keepalive for _ in range(messages)), done=done)
+        else:
+            reactor.callLater(0.05, check)
+
+    reactor.callWhenRunning(session._event, "ManualStart")
+    reactor.callWhenRunning(check)
+    reactor.run()
+    child.terminate()
+
+
+def run(path, rounds=5):
+    """
+    Run the benchmark.
+
+    :return: bytes fed per round, and best seconds per round
+    :rtype: tuple
+    """
+    logging.getLogger("BGP").setLevel(logging.WARNING)
+    best = None
+    with Capture(path) as capture:
+        for _ in range(rounds):
+            session = BGP("127.0.0.1", 1, "10.0.0.1")
+            start = time.perf_counter()
+            total = feed(session, capture)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return total, best
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "session.cap")
+        record(path)
+    total, elapsed = run(path)
+    print("capture:  {}".format(path))
+    print("fed:      {} bytes in {:.3f}s".format(total, elapsed))
+    print("rate:     {:.1f} MB/s".format(total / elapsed / 1e6))
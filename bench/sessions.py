@@ -0,0 +1,119 @@
+# Concurrent session benchmark.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Usage: python3 -m bench.sessions [count] [twisted|asyncio|uvloop]
+#
+# Brings up <count> BGP sessions (default 5000) against a loopback stand-in
+# peer in a single event loop, and reports how long it took for all of them
+# to reach Established. The stand-in runs in a child process so that every
+# backend is measured under the same conditions.
+
+from protos.manager import SessionManager
+import logging
+import multiprocessing
+import sys
+import time
+
+BACKENDS = ["twisted", "asyncio", "uvloop"]
+
+
+def serve(queue):
+    """Run a stand-in peer, reporting its port through ``queue``."""
+    from twisted.internet import reactor
+    from protos import responder
+
+    port = responder.listen()
+    queue.put(port.getHost().port)
+    reactor.run()
+
+
+def start_peer():
+    """
+    Start a stand-in peer in a child process.
+
+    :return: the child process and the port the peer listens on
+    :rtype: tuple
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    child = ctx.Process(target=serve, args=(queue,), daemon=True)
+    child.start()
+    return child, queue.get()
+
+
+def run(count=5000, backend="twisted", rate=2000, timeout=60):
+    """
+    Run the benchmark.
+
+    :return: seconds to create all sessions, seconds until all were
+        Established (None on timeout), and the final state summary
+    :rtype: tuple
+    """
+    child, port = start_peer()
+    manager = SessionManager()
+
+    if backend == "twisted":
+        from twisted.internet import reactor
+        from protos.bgp import BGP
+
+        cls, kwargs = BGP, {}
+        call_later, stop, loop_run = reactor.callLater, reactor.stop, reactor.run
+    else:
+        from protos.aio import AsyncioBGP, new_event_loop
+
+        loop = new_event_loop(use_uvloop=backend == "uvloop")
+        cls, kwargs = AsyncioBGP, {"loop": loop}
+        call_later, stop, loop_run = loop.call_later, loop.stop, loop.run_forever
+
+    start = time.perf_counter()
+    manager.spawn(count, "127.0.0.1", cls=cls, port=port, **kwargs)
+    created = time.perf_counter() - start
+    logging.getLogger("BGP").setLevel(logging.WARNING)
+
+    result = {}
+
+    def check():
+        if manager.counts["Established"] == count:
+            result["established"] = time.perf_counter() - start
+            result["summary"] = manager.summary()
+            manager.stop()
+            call_later(0.5, stop)
+        elif time.perf_counter() - start > timeout:
+            result["summary"] = manager.summary()
+            stop()
+        else:
+            call_later(0.1, check)
+
+    start = time.perf_counter()
+    call_later(0, manager.start, rate)
+    call_later(0.1, check)
+    loop_run()
+    child.terminate()
+    return created, result.get("established"), result["summary"]
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    backend = sys.argv[2] if len(sys.argv) > 2 else "twisted"
+    created, established, summary = run(count, backend)
+    print("backend:     {}".format(backend))
+    print("sessions:    {}".format(count))
+    print("created in:  {:.2f}s".format(created))
+    if established is None:
+        print("established: timed out, {}".format(summary))
+    else:
+        print("established: {:.2f}s".format(established))
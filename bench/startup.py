@@ -0,0 +1,162 @@
+# Cold-start benchmark.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Usage: python3 -m bench.startup
+#
+# Times how long fresh interpreters take to import neph's packages, and how
+# long a fresh neph takes to answer a first statement at its prompt. Exits
+# non-zero if any of them is over budget, if Scapy, Twisted or NumPy are
+# loaded by the time the prompt answers, or if the exports of protos and
+# fuzzers can't be used from the prompt, so the lazy loading in protos and
+# fuzzers doesn't quietly regress.
+
+import ast
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (python source to run, budget in seconds)
+CASES = {
+    "interpreter": ("pass", None),
+    "import protos, fuzzers": ("import protos, fuzzers", 0.1),
+    "import fuzzers.campaign": ("import fuzzers.campaign", 0.5),
+    "import protos.bgp": ("import protos.bgp", 1.0),
+}
+
+# Budget for the neph prompt to answer a first statement
+PROMPT_BUDGET = 0.1
+
+# Modules that must not be loaded before something at the prompt uses them
+HEAVY = ["scapy", "twisted", "numpy"]
+
+# Statements sent to the prompt: the first is timed and reports which heavy
+# modules are loaded; the second checks that lazy exports resolve
+PROBE = 'print("ready", [m for m in {!r} if m in __import__("sys").modules])\n'
+RESOLVE = 'print("resolved", BGPFuzzer.__name__, SessionManager.__name__)\n'
+
+
+def measure(source, rounds=5):
+    """
+    Time a fresh interpreter running ``source``.
+
+    :return: best wall time over ``rounds`` runs, in seconds
+    :rtype: float
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", source],
+            cwd=ROOT,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def _answer(proc, tag):
+    """Read the console's output up to the line holding ``tag``."""
+    while True:
+        line = proc.stdout.readline()
+        if not line:
+            raise RuntimeError("neph exited before answering")
+        if tag in line:
+            return line[line.index(tag) :].split(" ", 1)[1].strip()
+
+
+def measure_prompt(rounds=5):
+    """
+    Time a fresh ``neph.py`` until its prompt answers a first statement.
+
+    :return: best wall time over ``rounds`` runs in seconds, the heavy
+        modules loaded when the prompt answered, and whether lazy exports
+        resolved from the prompt
+    :rtype: tuple
+    """
+    best = None
+    loaded = set()
+    resolved = True
+    for _ in range(rounds):
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "-u", "neph.py"],
+            cwd=ROOT,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+        try:
+            proc.stdin.write(PROBE.format(HEAVY))
+            proc.stdin.flush()
+            answer = _answer(proc, "ready")
+            elapsed = time.perf_counter() - start
+            loaded.update(ast.literal_eval(answer))
+            proc.stdin.write(RESOLVE)
+            proc.stdin.close()
+            resolved &= _answer(proc, "resolved") == "BGPFuzzer SessionManager"
+        finally:
+            proc.kill()
+            proc.wait()
+            proc.stdout.close()
+        best = elapsed if best is None else min(best, elapsed)
+    return best, sorted(loaded), resolved
+
+
+def run(rounds=5):
+    """
+    Run the benchmark.
+
+    Budgets apply to the time on top of a bare interpreter start.
+
+    :return: mapping of case name to (seconds, budget), the heavy modules
+        loaded at the neph prompt, and whether exports resolved there
+    :rtype: tuple
+    """
+    results = {}
+    base = measure(CASES["interpreter"][0], rounds)
+    for name, (source, budget) in CASES.items():
+        elapsed = base if source == "pass" else measure(source, rounds)
+        results[name] = (elapsed - base if budget else elapsed, budget)
+    elapsed, loaded, resolved = measure_prompt(rounds)
+    results["neph prompt"] = (elapsed - base, PROMPT_BUDGET)
+    return results, loaded, resolved
+
+
+if __name__ == "__main__":
+    results, loaded, resolved = run()
+    failed = bool(loaded) or not resolved
+    if loaded:
+        print("loaded before first use at the prompt: {}".format(", ".join(loaded)))
+    if not resolved:
+        print("protos and fuzzers exports don't resolve at the prompt")
+    for name, (elapsed, budget) in results.items():
+        over = budget is not None and elapsed > budget
+        failed |= over
+        print(
+            "{:<26} {:>7.3f}s {}".format(
+                name, elapsed, "" if budget is None else "(budget {}s)".format(budget)
+            )
+            + ("  OVER BUDGET" if over else "")
+        )
+    sys.exit(1 if failed else 0)
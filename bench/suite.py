@@ -0,0 +1,347 @@
+# Hot path benchmark suite.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Usage: python3 -m bench.suite [--json] [--baseline FILE] [--save FILE]
+#                               [--tolerance FRACTION] [--only NAME,...]
+#                               [--runs N]
+#
+# Measures the hot paths of neph:
+#
+#   recv      messages/s through BGP.handle_data_received, per backlog size
+#   make_pkt  cost of building each message type
+#   mutate    BGPFuzzer mutation throughput
+#   fsm       cost of dispatching FSM events through BGP._event
+#   session   time to bring sessions up against the loopback responder
+#
+# The whole suite is run several times, one benchmark after the other, so
+# that a slow spell of the machine hits one run of each benchmark rather than
+# every run of one. Each result is the best of its runs, with its spread: how
+# far the median run is from the best one, as a fraction of it.
+#
+# Results are compared against a stored baseline (bench/baseline.json by
+# default), and the exit status is non-zero if any of them is worse than the
+# baseline by more than the tolerance plus the larger of the two spreads, so
+# that noisy results need a larger change to count as regressions.
+# --save writes the results as a new baseline.
+
+from collections import OrderedDict
+from protos.capture import NullTransport
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import time
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+KEEPALIVE = b"\xff" * 16 + b"\x00\x13\x04"
+
+BACKLOGS = [1, 10, 100, 1000]
+
+MESSAGE_TYPES = ["OPEN", "KEEPALIVE", "NOTIFICATION", "UPDATE"]
+
+
+def result(value, unit, higher_is_better):
+    return {"value": value, "unit": unit, "higher_is_better": higher_is_better}
+
+
+def settle():
+    """
+    Let the reactor purge timed calls cancelled by the last round.
+
+    The reactor isn't running during the micro benchmarks, so without this
+    every timer restart would leave garbage in its heap for the next round.
+    """
+    from twisted.internet import reactor
+
+    reactor.runUntilCurrent()
+
+
+def best_of(fn, rounds):
+    """Run ``fn`` ``rounds`` times; return the shortest wall time."""
+    best = None
+    for _ in range(rounds):
+        settle()
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def new_session(cls=None):
+    from protos.bgp import BGP
+
+    session = (cls or BGP)("127.0.0.1", 1, "10.0.0.1")
+    session.transport = NullTransport()
+    return session
+
+
+# Benchmarks -------------------------------------------------------------------
+
+
+def bench_recv(rounds=7, total=20000):
+    """Messages per second through the receive path, per backlog size."""
+    results = OrderedDict()
+    session = new_session()
+    session.to_Established()
+    for backlog in BACKLOGS:
+        data = KEEPALIVE * backlog
+        batches = total // backlog
+
+        def run():
+            for _ in range(batches):
+                session.inbuf.write(data)
+                session.handle_data_received()
+
+        elapsed = best_of(run, rounds)
+        results["recv.backlog_{}".format(backlog)] = result(
+            batches * backlog / elapsed, "msg/s", True
+        )
+    return results
+
+
+def bench_make_pkt(rounds=5, count=200):
+    """Microseconds to build each message type with make_pkt and make_bytes."""
+    results = OrderedDict()
+    session = new_session()
+    kwargs = {"UPDATE": {"nlri": ["10.0.0.0/24"]}}
+    for msgtype in MESSAGE_TYPES:
+        args = kwargs.get(msgtype, {})
+        for method in ("make_pkt", "make_bytes"):
+            fn = getattr(session, method)
+            elapsed = best_of(
+                lambda: [fn(msgtype, **args) for _ in range(count)], rounds
+            )
+            results["{}.{}".format(method, msgtype)] = result(
+                elapsed / count * 1e6, "us", False
+            )
+    return results
+
+
+def bench_mutate(rounds=5, count=100000):
+    """Cases per second generated by BGPFuzzer, per fuzzed message."""
+    from fuzzers.bgp import BGPFuzzer
+
+    results = OrderedDict()
+    cases = {
+        "KEEPALIVE": ["BGPKeepalive.header"],
+        "OPEN": ["BGPOpen.my_as", "BGPOpen.hold_time", "BGPOpen.bgp_id"],
+    }
+    for msgtype, fields in cases.items():
+        fuzzer = new_session(BGPFuzzer)
+        fuzzer.fuzz(fields)
+        elapsed = best_of(lambda: fuzzer.mutate_batch(msgtype, count), rounds)
+        results["mutate.batch.{}".format(msgtype)] = result(
+            count / elapsed, "case/s", True
+        )
+
+        fuzzer.batch_size = 1024
+        elapsed = best_of(
+            lambda: [fuzzer.make_bytes(msgtype) for _ in range(count // 10)], rounds
+        )
+        results["mutate.make_bytes.{}".format(msgtype)] = result(
+            count // 10 / elapsed, "case/s", True
+        )
+    return results
+
+
+def bench_fsm(rounds=7, count=20000):
+    """Microseconds per event dispatched through BGP._event."""
+    from protos import codec
+
+    results = OrderedDict()
+    keepalive = codec.Keepalive(KEEPALIVE)
+    cases = [
+        ("KeepAliveMsg.Established", "Established", "KeepAliveMsg", (keepalive,)),
+        ("BGPHeaderErr.Established", "Established", "BGPHeaderErr", (b"",)),
+        ("KeepAliveMsg.Idle", "Idle", "KeepAliveMsg", (keepalive,)),
+    ]
+    for name, state, event, args in cases:
+        session = new_session()
+        getattr(session, "to_" + state)()
+        dispatch = session._event
+        elapsed = best_of(
+            lambda: [dispatch(event, *args) for _ in range(count)], rounds
+        )
+        results["fsm.{}".format(name)] = result(elapsed / count * 1e6, "us", False)
+    return results
+
+
+def setup_time(count, queue):
+    """Report the session setup time of ``count`` sessions through ``queue``."""
+    from bench.sessions import run
+
+    queue.put(run(count, "twisted", rate=None)[1])
+
+
+def bench_session(rounds=1, count=1000):
+    """Seconds until ``count`` sessions are Established on loopback."""
+    # the reactor can't be restarted, so every round gets a process of its own
+    ctx = multiprocessing.get_context("spawn")
+    best = None
+    for _ in range(rounds):
+        queue = ctx.Queue()
+        child = ctx.Process(target=setup_time, args=(count, queue))
+        child.start()
+        established = queue.get()
+        child.join()
+        if established is not None:
+            best = established if best is None else min(best, established)
+    return OrderedDict([("session.setup_{}".format(count), result(best, "s", False))])
+
+
+BENCHMARKS = OrderedDict(
+    [
+        ("recv", bench_recv),
+        ("make_pkt", bench_make_pkt),
+        ("mutate", bench_mutate),
+        ("fsm", bench_fsm),
+        ("session", bench_session),
+    ]
+)
+
+
+def summarize(samples):
+    """
+    Reduce the runs of one result to its best value and spread.
+
+    :param samples: the result of every run
+    :return: the best run, with its ``spread`` and the number of ``runs``
+    :rtype: dict
+    """
+    first = samples[0]
+    values = [s["value"] for s in samples if s["value"] is not None]
+    summary = result(None, first["unit"], first["higher_is_better"])
+    summary.update(spread=None, runs=len(values))
+    if values:
+        best = max(values) if first["higher_is_better"] else min(values)
+        summary["value"] = best
+        summary["spread"] = abs(statistics.median(values) - best) / best
+    return summary
+
+
+def run(only=None, runs=5):
+    """
+    Run the suite.
+
+    :param only: names of the benchmarks to run, or None for all of them
+    :param runs: times to run every benchmark
+    :return: mapping of result name to its best value, spread, unit and
+        direction
+    :rtype: OrderedDict
+    """
+    logging.getLogger("BGP").setLevel(logging.WARNING)
+    samples = OrderedDict()
+    for _ in range(runs):
+        for name, bench in BENCHMARKS.items():
+            if only is None or name in only:
+                for key, res in bench().items():
+                    samples.setdefault(key, []).append(res)
+    return OrderedDict((key, summarize(s)) for key, s in samples.items())
+
+
+def compare(results, baseline, tolerance=0.3):
+    """
+    Compare results against a baseline.
+
+    :param tolerance: fraction by which a result may be worse than baseline,
+        on top of the larger spread of the two
+    :return: mapping of result name to (baseline value, change as a fraction,
+        whether it regressed) for every result present in both
+    :rtype: OrderedDict
+    """
+    changes = OrderedDict()
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None or res["value"] is None or not base["value"]:
+            continue
+        change = (res["value"] - base["value"]) / base["value"]
+        worse = -change if res["higher_is_better"] else change
+        noise = max(res.get("spread") or 0, base.get("spread") or 0)
+        changes[name] = (base["value"], change, worse > tolerance + noise)
+    return changes
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--json", action="store_true", help="print JSON results")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline to compare")
+    parser.add_argument("--save", metavar="FILE", help="save results as baseline")
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    parser.add_argument("--only", help="comma separated benchmarks to run")
+    parser.add_argument("--runs", type=int, default=5, help="runs of the suite")
+    args = parser.parse_args(argv)
+
+    only = args.only.split(",") if args.only else None
+    results = run(only, args.runs)
+
+    baseline = {}
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    changes = compare(results, baseline, args.tolerance)
+    regressed = [name for name, (_, _, bad) in changes.items() if bad]
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"environment": environment(), "results": results}, f, indent=2)
+            f.write("\n")
+
+    if args.json:
+        report = {
+            "environment": environment(),
+            "results": results,
+            "changes": {
+                name: {"baseline": base, "change": change, "regressed": bad}
+                for name, (base, change, bad) in changes.items()
+            },
+            "regressed": regressed,
+        }
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        for name, res in results.items():
+            line = "{:<36} {:>14} {:<6} {:>7}".format(
+                name,
+                "-" if res["value"] is None else "{:.4g}".format(res["value"]),
+                res["unit"],
+                "" if res["spread"] is None else "±{:.0%}".format(res["spread"]),
+            )
+            if name in changes:
+                _, change, bad = changes[name]
+                line += " {:+7.1%}".format(change) + ("  REGRESSED" if bad else "")
+            print(line)
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
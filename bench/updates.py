@@ -0,0 +1,116 @@
+# UPDATE streaming benchmark.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Usage: python3 -m bench.updates [prefixes] [twisted|asyncio|uvloop]
+#
+# Brings up one session against a loopback stand-in peer and streams a table
+# of <prefixes> /24 routes (default 1000000) spread over a few attribute sets.
+# Reports throughput, how full the messages were, and peak memory, which
+# should stay flat no matter how large the table is.
+
+from bench.sessions import start_peer
+from protos import codec
+from protos.updates import prefix_range
+import logging
+import resource
+import sys
+import time
+
+# Number of distinct path attribute sets routes are spread over
+ATTR_SETS = 16
+
+
+def routes(count):
+    """Generate ``count`` routes, cycling through ``ATTR_SETS`` attribute sets."""
+    attrs = [
+        codec.encode_path_attrs(
+            [
+                codec.PathAttribute(codec.ATTR_TRANSITIVE, 1, b"\x00"),
+                codec.PathAttribute(
+                    codec.ATTR_TRANSITIVE, 2, b"\x02\x01" + i.to_bytes(2, "big")
+                ),
+                codec.PathAttribute(codec.ATTR_TRANSITIVE, 3, bytes((10, 0, 0, i))),
+            ]
+        )
+        for i in range(1, ATTR_SETS + 1)
+    ]
+    for i, prefix in enumerate(prefix_range("1.0.0.0/24", count, 24)):
+        yield attrs[i % ATTR_SETS], prefix
+
+
+def run(count=1000000, backend="twisted", timeout=300):
+    """
+    Run the benchmark.
+
+    :return: seconds to stream the table (None on timeout), messages sent,
+        and peak resident memory in KiB
+    :rtype: tuple
+    """
+    child, port = start_peer()
+
+    if backend == "twisted":
+        from twisted.internet import reactor
+        from protos.bgp import BGP
+
+        session = BGP("127.0.0.1", 1, "10.0.0.1", port=port)
+        call_later, stop, loop_run = reactor.callLater, reactor.stop, reactor.run
+    else:
+        from protos.aio import AsyncioBGP, new_event_loop
+
+        loop = new_event_loop(use_uvloop=backend == "uvloop")
+        session = AsyncioBGP("127.0.0.1", 1, "10.0.0.1", port=port, loop=loop)
+        call_later, stop, loop_run = loop.call_later, loop.stop, loop.run_forever
+    logging.getLogger("BGP").setLevel(logging.WARNING)
+
+    result = {}
+
+    def done(sent):
+        result["elapsed"] = time.perf_counter() - result["start"]
+        result["sent"] = sent
+        session._event("ManualStop")
+        call_later(0.1, stop)
+
+    def check():
+        if session.state == "Established":
+            result["start"] = time.perf_counter()
+            session.send_updates(routes(count), done=done)
+        elif time.perf_counter() - start > timeout:
+            stop()
+        else:
+            call_later(0.05, check)
+
+    start = time.perf_counter()
+    call_later(0, session._event, "ManualStart")
+    call_later(0.05, check)
+    loop_run()
+    child.terminate()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result.get("elapsed"), result.get("sent", 0), peak
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    backend = sys.argv[2] if len(sys.argv) > 2 else "twisted"
+    elapsed, sent, peak = run(count, backend)
+    print("backend:     {}".format(backend))
+    print("prefixes:    {}".format(count))
+    if elapsed is None:
+        print("streamed:    timed out")
+        sys.exit(1)
+    print("messages:    {} ({:.0f} prefixes each)".format(sent, count / max(sent, 1)))
+    print("streamed in: {:.2f}s ({:.0f} prefixes/s)".format(elapsed, count / elapsed))
+    print("peak rss:    {} KiB".format(peak))
@@ -1,6 +1,42 @@
-from fuzzers.fuzz import FuzzerMixin
-from fuzzers.bgp import BGPFuzzer
+# Package control for neph fuzzers.
+#
+# Exports are imported on first access, so that importing the package does
+# not pull in Scapy, NumPy and friends until a fuzzer is actually used.
 
-fuzzers = [BGPFuzzer.__name__]
+import importlib
 
-__all__ = fuzzers + []
+registry = {
+    "FuzzerMixin": "fuzzers.fuzz",
+    "BGPFuzzer": "fuzzers.bgp",
+    "AsyncioBGPFuzzer": "fuzzers.bgp",
+    "Campaign": "fuzzers.campaign",
+    "Corpus": "fuzzers.feedback",
+    "CorpusStore": "fuzzers.store",
+    "LivenessOracle": "fuzzers.oracle",
+    "Minimizer": "fuzzers.minimize",
+    "SeenFilter": "fuzzers.seen",
+}
+
+fuzzers = ["BGPFuzzer"]
+
+__all__ = fuzzers + [
+    "AsyncioBGPFuzzer",
+    "Campaign",
+    "Corpus",
+    "CorpusStore",
+    "LivenessOracle",
+    "Minimizer",
+    "SeenFilter",
+]
+
+
+def __getattr__(name):
+    if name not in registry:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module(registry[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(registry))
@@ -0,0 +1,311 @@
+# Structure-aware UPDATE path attribute mutation.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Byte-level strategies treat the path attributes of an UPDATE as an opaque
+# blob. The strategies here edit them as a run of TLVs, directly in the
+# serialized message: each case splices one attribute in, out or around,
+# and then patches only the length fields the edit affects:
+#
+#   attr    the length of the edited attribute
+#   total   Total Path Attribute Length
+#   header  the message length in the header
+#
+# Any of them can be named as inconsistent, in which case it is left as it
+# was (or, for a new attribute, set slightly off) so that the target has to
+# cope with lengths that disagree with each other.
+
+from protos import codec
+import numpy as np
+import struct
+
+# Strategy names, as used in the fuzzspec
+INSERT = "insert"
+DELETE = "delete"
+DUPLICATE = "duplicate"
+REORDER = "reorder"
+CORRUPT = "corrupt"
+RESIZE = "resize"
+FLAGS = "flags"
+
+ATTR_STRATEGIES = [INSERT, DELETE, DUPLICATE, REORDER, CORRUPT, RESIZE, FLAGS]
+
+# Length fields that can be left inconsistent
+LENGTHS = ["attr", "total", "header"]
+
+# (flags, type code) of attributes to insert; the last entry is replaced
+# by a random one
+TEMPLATES = [
+    (0x40, 1),  # ORIGIN
+    (0x40, 2),  # AS_PATH
+    (0x40, 3),  # NEXT_HOP
+    (0x80, 4),  # MULTI_EXIT_DISC
+    (0x40, 5),  # LOCAL_PREF
+    (0x40, 6),  # ATOMIC_AGGREGATE
+    (0xC0, 7),  # AGGREGATOR
+    (0xC0, 8),  # COMMUNITIES
+    (0x80, 14),  # MP_REACH_NLRI
+    (0x80, 15),  # MP_UNREACH_NLRI
+    (0xC0, 16),  # EXTENDED COMMUNITIES
+    (0xC0, 17),  # AS4_PATH
+    (0xC0, 18),  # AS4_AGGREGATOR
+    (0xC0, 32),  # LARGE_COMMUNITY
+    (0x00, 0),
+]
+
+# Value lengths of inserted attributes; 256 forces an extended length
+VALUE_LENGTHS = [0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 255, 256]
+
+# Largest change in value length made by the resize strategy
+RESIZE_MAX = 8
+
+LENGTH16 = struct.Struct("!H")
+
+
+class Layout(object):
+    """Where the parts of a serialized UPDATE are."""
+
+    __slots__ = ("total_offset", "start", "end", "attrs")
+
+    def __init__(self, msg):
+        """
+        Parse an UPDATE.
+
+        :param msg: serialized UPDATE
+        :raises ValueError: if the message is too short to hold the
+            attribute section it describes
+        """
+        pos = codec.HEADER_SIZE
+        if len(msg) < pos + 4:
+            raise ValueError("Message too short for an UPDATE")
+        pos += 2 + LENGTH16.unpack_from(msg, pos)[0]
+        if len(msg) < pos + 2:
+            raise ValueError("Withdrawn routes overrun the message")
+        self.total_offset = pos
+        self.start = pos + 2
+        self.end = min(self.start + LENGTH16.unpack_from(msg, pos)[0], len(msg))
+        # (start, header size, end) of each attribute
+        self.attrs = []
+        pos = self.start
+        while pos + 3 <= self.end:
+            hdr = 4 if msg[pos] & codec.ATTR_EXTENDED_LENGTH else 3
+            if pos + hdr > self.end:
+                break
+            if hdr == 4:
+                vlen = LENGTH16.unpack_from(msg, pos + 2)[0]
+            else:
+                vlen = msg[pos + 2]
+            end = min(pos + hdr + vlen, self.end)
+            self.attrs.append((pos, hdr, end))
+            pos = end
+
+
+def encode_attr(flags, code, value, length=None):
+    """
+    Encode one attribute, with the length field width its flags call for.
+
+    :param length: value of the length field, if not the real one
+    """
+    if length is None:
+        length = len(value)
+    if flags & codec.ATTR_EXTENDED_LENGTH:
+        return struct.pack("!BBH", flags, code, length & 0xFFFF) + value
+    return struct.pack("!BBB", flags, code, length & 0xFF) + value
+
+
+class AttrMutator(object):
+    """
+    Generates batches of UPDATEs with structurally mutated path attributes.
+
+    Each variant receives one edit by one of the given strategies. Random
+    choices for a whole batch are drawn at once; each variant is then a
+    splice of the base message and a patch of its length fields.
+    """
+
+    def __init__(self, rng=None, max_size=4096):
+        """
+        Create a new AttrMutator.
+
+        :param rng: numpy random generator; a new one if not given
+        :param max_size: largest message to generate while lengths are kept
+            consistent
+        """
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.max_size = max_size
+
+    def mutate(self, base, strategies, n, inconsistent=()):
+        """
+        Generate mutated variants of an UPDATE.
+
+        Strategies that need more attributes than the base message has fall
+        back to inserting one.
+
+        :param base: serialized UPDATE
+        :param strategies: names from ATTR_STRATEGIES
+        :param n: number of variants
+        :param inconsistent: names from LENGTHS to leave unpatched
+        :return: list of serialized variants
+        :rtype: list
+        """
+        layout = Layout(base)
+        base = bytes(base)
+        fix = {name: name not in inconsistent for name in LENGTHS}
+        unknown = set(strategies) - set(ATTR_STRATEGIES)
+        if unknown:
+            raise KeyError("Unknown attribute strategies: {}".format(sorted(unknown)))
+        unknown = set(inconsistent) - set(LENGTHS)
+        if unknown:
+            raise KeyError("Unknown length fields: {}".format(sorted(unknown)))
+
+        ops = [self.strategy_method(s) for s in strategies]
+        choice = self.rng.integers(len(ops), size=n)
+        draws = self.rng.integers(1 << 30, size=(n, 4)).tolist()
+        pool = self.rng.bytes(512)
+        out = []
+        for op, r in zip(choice.tolist(), draws):
+            out.append(ops[op](base, layout, r, pool, fix))
+        return out
+
+    def strategy_method(self, name):
+        return getattr(self, "_" + name)
+
+    # Strategies ---------------------------------------------------------------
+
+    def _insert(self, base, layout, r, pool, fix):
+        flags, code = TEMPLATES[r[0] % len(TEMPLATES)]
+        if code == 0:
+            flags, code = r[0] >> 8 & 0xE0, r[0] >> 16 & 0xFF
+        vlen = VALUE_LENGTHS[r[1] % len(VALUE_LENGTHS)]
+        room = self.max_size - len(base) - 4
+        vlen = max(0, min(vlen, room)) if fix["header"] else vlen
+        if vlen > 0xFF:
+            flags |= codec.ATTR_EXTENDED_LENGTH
+        value = (pool * (vlen // len(pool) + 1))[r[2] % 256 : r[2] % 256 + vlen]
+        length = None if fix["attr"] else vlen + _skew(r[3])
+        attr = encode_attr(flags, code, value, length)
+        attrs = layout.attrs
+        if attrs:
+            pos = (
+                attrs[r[3] % (len(attrs) + 1) - 1][2]
+                if r[3] % (len(attrs) + 1)
+                else layout.start
+            )
+        else:
+            pos = layout.start
+        return self._splice(base, layout, pos, pos, attr, fix)
+
+    def _delete(self, base, layout, r, pool, fix):
+        if not layout.attrs:
+            return self._insert(base, layout, r, pool, fix)
+        start, _, end = layout.attrs[r[0] % len(layout.attrs)]
+        return self._splice(base, layout, start, end, b"", fix)
+
+    def _duplicate(self, base, layout, r, pool, fix):
+        if not layout.attrs:
+            return self._insert(base, layout, r, pool, fix)
+        start, _, end = layout.attrs[r[0] % len(layout.attrs)]
+        if fix["header"] and len(base) + end - start > self.max_size:
+            return self._reorder(base, layout, r, pool, fix)
+        attrs = layout.attrs
+        at = attrs[r[1] % len(attrs)][2]
+        return self._splice(base, layout, at, at, base[start:end], fix)
+
+    def _reorder(self, base, layout, r, pool, fix):
+        attrs = layout.attrs
+        if len(attrs) < 2:
+            return self._insert(base, layout, r, pool, fix)
+        i = r[0] % len(attrs)
+        j = (i + 1 + r[1] % (len(attrs) - 1)) % len(attrs)
+        i, j = min(i, j), max(i, j)
+        a, b = attrs[i], attrs[j]
+        middle = base[a[2] : b[0]]
+        swapped = base[b[0] : b[2]] + middle + base[a[0] : a[2]]
+        return base[: a[0]] + swapped + base[b[2] :]
+
+    def _corrupt(self, base, layout, r, pool, fix):
+        attrs = [a for a in layout.attrs if a[2] > a[0] + a[1]]
+        if not attrs:
+            return self._insert(base, layout, r, pool, fix)
+        start, hdr, end = attrs[r[0] % len(attrs)]
+        msg = bytearray(base)
+        pos = start + hdr + r[1] % (end - start - hdr)
+        if r[2] & 1:
+            msg[pos] ^= 1 << (r[2] >> 1 & 7)
+        else:
+            msg[pos] = pool[r[3] % len(pool)]
+        return bytes(msg)
+
+    def _resize(self, base, layout, r, pool, fix):
+        if not layout.attrs:
+            return self._insert(base, layout, r, pool, fix)
+        start, hdr, end = layout.attrs[r[0] % len(layout.attrs)]
+        flags, code = base[start], base[start + 1]
+        value = base[start + hdr : end]
+        delta = 1 + r[1] % RESIZE_MAX
+        if r[2] & 1 and value:
+            value = value[: max(0, len(value) - delta)]
+        else:
+            value = value + pool[r[3] % 256 : r[3] % 256 + delta]
+        if (
+            fix["header"]
+            and len(base) + len(value) - (end - start - hdr) > self.max_size
+        ):
+            return self._corrupt(base, layout, r, pool, fix)
+        if len(value) > 0xFF:
+            flags |= codec.ATTR_EXTENDED_LENGTH
+        length = None if fix["attr"] else end - start - hdr
+        return self._splice(
+            base, layout, start, end, encode_attr(flags, code, value, length), fix
+        )
+
+    def _flags(self, base, layout, r, pool, fix):
+        if not layout.attrs:
+            return self._insert(base, layout, r, pool, fix)
+        start, hdr, end = layout.attrs[r[0] % len(layout.attrs)]
+        flags = base[start] ^ (0x10 << (r[1] % 4))
+        if not fix["attr"] or (flags ^ base[start]) != codec.ATTR_EXTENDED_LENGTH:
+            # same header layout, or a length field deliberately misread
+            msg = bytearray(base)
+            msg[start] = flags
+            return bytes(msg)
+        # the length field changes width with the extended length flag
+        value = base[start + hdr : end]
+        if not flags & codec.ATTR_EXTENDED_LENGTH and len(value) > 0xFF:
+            flags |= codec.ATTR_EXTENDED_LENGTH
+        attr = encode_attr(flags, base[start + 1], value)
+        return self._splice(base, layout, start, end, attr, fix)
+
+    # Length fixups ------------------------------------------------------------
+
+    def _splice(self, base, layout, start, end, data, fix):
+        """Replace base[start:end] with data and patch the enclosing lengths."""
+        msg = bytearray(base[:start])
+        msg += data
+        msg += base[end:]
+        delta = len(data) - (end - start)
+        if delta:
+            if fix["total"]:
+                total = layout.end - layout.start + delta
+                LENGTH16.pack_into(msg, layout.total_offset, total & 0xFFFF)
+            if fix["header"]:
+                LENGTH16.pack_into(msg, len(codec.MARKER), len(msg) & 0xFFFF)
+        return bytes(msg)
+
+
+def _skew(r):
+    """A small nonzero offset for a deliberately wrong length."""
+    delta = 1 + (r >> 4) % 3
+    return delta if r & 1 else -delta
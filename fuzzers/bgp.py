@@ -15,110 +15,455 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import Counter
+from fuzzers.attrs import ATTR_STRATEGIES, AttrMutator
+from fuzzers.feedback import Corpus, Reaction, ACCEPTED, DROP, NOTIFICATION, SILENCE
 from fuzzers.fuzz import FuzzerMixin
+from fuzzers.mutate import Mutator
+from fuzzers.plan import compile_spec
+from fuzzers.seen import SeenFilter
+from protos.aio import AsyncioTransport
+from protos import codec
 from protos.bgp import BGP
+from scapy.contrib.bgp import BGPHeader
+import numpy as np
+import time
 
 
-class BGPFuzzer(BGP, FuzzerMixin):
-    """
-    BGP protocol fuzzer.
+def default_fuzzspec():
     """
+    Build the default BGPFuzzer fuzzspec, with every field disabled.
 
-    def __init__(self, neighbor=None, my_as=0, bgp_id=None, fuzzspec=None):
-        # initialize the protocol
-        super().__init__(neighbor=neighbor, my_as=my_as, bgp_id=bgp_id)
-        self.fuzzspec = fuzzspec or {
-            "BGPOpen": {
-                "header": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
-                "version": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
-                "my_as": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
-                "hold_time": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
-                "bgp_id": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
-                "opt_param_len": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
-                "opt_params": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
+    :rtype: dict
+    """
+    return {
+        "BGPOpen": {
+            "header": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
+            },
+            "version": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
+            },
+            "my_as": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
+            },
+            "hold_time": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
+            },
+            "bgp_id": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
+            },
+            "opt_param_len": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
+            },
+            "opt_params": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
+            },
+        },
+        "BGPKeepalive": {
+            "header": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
+            }
+        },
+        "BGPUpdate": {
+            "withdrawn_routes_len": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
+            },
+            "withdrawn_routes": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
+            },
+            "path_attr_len": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
+            },
+            "path_attr": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
+                "inconsistent": [],
             },
-            "BGPKeepalive": {
-                "header": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                }
+            "nlri": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
             },
-            "BGPUpdate": {
-                "withdrawn_routes_len": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
-                "withdrawn_routes": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
-                "path_attr_len": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
-                "path_attr": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
-                "nlri": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
+        },
+        "BGPNotification": {
+            "error_code": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
             },
-            "BGPNotification": {
-                "error_code": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
-                "error_subcode": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
-                "data": {
-                    "fuzz": False,
-                    "value": "default",
-                    "strategies": ["bitflip", "increment"],
-                },
+            "error_subcode": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
             },
-        }
+            "data": {
+                "fuzz": False,
+                "value": "default",
+                "strategies": ["bitflip", "increment"],
+            },
+        },
+    }
+
+
+class BGPFuzzer(BGP, FuzzerMixin):
+    """
+    BGP protocol fuzzer.
+    """
+
+    # fuzzspec message names for each message builder
+    specnames = {
+        "OPEN": "BGPOpen",
+        "KEEPALIVE": "BGPKeepalive",
+        "UPDATE": "BGPUpdate",
+        "NOTIFICATION": "BGPNotification",
+    }
+
+    # Scapy layer names for each fuzzspec message name, where they differ
+    layernames = {"BGPKeepalive": "BGPKeepAlive"}
+
+    def __init__(
+        self,
+        neighbor=None,
+        my_as=0,
+        bgp_id=None,
+        fuzzspec=None,
+        batch_size=1024,
+        feedback=True,
+        store=None,
+        dedup=None,
+        **kwargs
+    ):
+        # initialize the protocol
+        super().__init__(neighbor=neighbor, my_as=my_as, bgp_id=bgp_id, **kwargs)
+        self.mutator = Mutator()
+        self.attr_mutator = AttrMutator(self.mutator.rng)
+        self.batch_size = batch_size
+        # message type -> (base message, batch of variants, next variant)
+        self.batches = {}
+        # cases that drew new reactions, mutated ahead of the base message
+        self.corpus = Corpus(store=store) if feedback else None
+        # cases already sent, which later batches are filtered against; may
+        # be shared between sessions
+        if dedup is True:
+            dedup = SeenFilter()
+        elif isinstance(dedup, dict):
+            dedup = SeenFilter(**dedup)
+        elif dedup is False:
+            dedup = None
+        self.seen = dedup
+        # message type of the last case, and whether it awaits a reaction
+        self.last_type = None
+        self.pending = False
+        # monotonic time the last case was made
+        self.case_time = None
+        # liveness probes whose answer is still due; a KEEPALIVE answering
+        # one says nothing about the last case
+        self.probes = 0
+        # send base messages unmutated, e.g. while a failure is captured
+        self.paused = False
+        # fuzzers.oracle.LivenessOracle watching the target, if any
+        self.oracle = None
+        # fuzzspec message name -> (message length, compiled plan)
+        self.plans = {}
+        # fuzzspec message name -> {field: (offset, size)} of the last compile
+        self.layouts = {}
+        # cases sent and bytes they contained
+        self.stats = Counter()
+        self.last_case = None
+        # cases that preceded a failure to reach the target
+        self.findings = []
+        self.fuzzspec = fuzzspec or default_fuzzspec()
 
     def make_pkt(self, pktcls, *args, **kwargs):
         msg = super().make_pkt(pktcls, *args, **kwargs)
         # perform fuzzing routines
         return msg
+
+    def make_bytes(self, pktcls, *args, **kwargs):
+        msg = super().make_bytes(pktcls, *args, **kwargs)
+        if self.paused:
+            return msg
+        plan = self.fuzz_plan(pktcls, msg)
+        attrs = self.attr_strategies(pktcls)
+        if not len(plan) and not attrs:
+            return msg
+
+        base, batch, i = self.batches.get(pktcls, (None, None, 0))
+        if base != msg or i >= len(batch):
+            batch = self.next_batch(pktcls, msg, plan, attrs)
+            i = 0
+        self.batches[pktcls] = (msg, batch, i + 1)
+        case = batch[i]
+        if not isinstance(case, bytes):
+            case = case.tobytes()
+        self.stats["cases"] += 1
+        self.stats["bytes"] += len(case)
+        self.last_case = case
+        self.last_type = pktcls
+        self.pending = True
+        self.case_time = time.monotonic()
+        return case
+
+    def next_batch(self, pktcls, msg, plan, attrs, tries=8):
+        """
+        Generate the next batch of cases for a message type.
+
+        With a seen-input filter, cases sent before are dropped from the
+        batch. If ``tries`` batches in a row hold nothing new, the mutation
+        space is about exhausted and the last batch is sent as it is.
+
+        :param pktcls: message type, as accepted by :meth:`make_pkt`
+        :param msg: serialized base message
+        :param plan: array of ``PLAN_DTYPE`` entries
+        :param attrs: attribute strategy names
+        :return: list of serialized messages, or array of one per row
+        """
+        for _ in range(tries):
+            seed = None
+            if self.corpus is not None:
+                # attribute strategies take UPDATEs of any length; the plan
+                # only fits cases laid out like the base message
+                seed = self.corpus.choose(pktcls, None if attrs else len(msg))
+            if attrs:
+                batch = self.mixed_batch(msg, plan, attrs, self.batch_size, seed)
+            else:
+                batch = self.mutator.mutate_plan(seed or msg, plan, self.batch_size)
+            if self.seen is None:
+                return batch
+            fresh = self.seen.filter(batch)
+            self.stats["duplicates"] += len(batch) - len(fresh)
+            if len(fresh):
+                return fresh
+        return batch
+
+    def react(self, reaction):
+        """
+        Attribute a reaction of the target to the last case sent.
+
+        Only the first reaction after a case counts, and its delay is
+        recorded in the session metrics. If it is one the corpus hasn't seen
+        for this message type, the case is added to it.
+
+        :type reaction: fuzzers.feedback.Reaction
+        :return: the new corpus entry, if any
+        """
+        if not self.pending:
+            return None
+        self.pending = False
+        self.metrics.reaction.record(time.monotonic() - self.case_time)
+        if self.corpus is None:
+            return None
+        entry = self.corpus.add(
+            self.last_type,
+            self.last_case,
+            reaction,
+            self.mutated_field(self.last_type, self.last_case),
+        )
+        if entry is not None:
+            self.stats["signatures"] += 1
+            self.log.info("[!] New reaction to {}: {}".format(self.last_type, reaction))
+        return entry
+
+    def recv_bgp_msg(self, msgtype, msglen, msg):
+        if msgtype == codec.NOTIFICATION and msglen >= codec.HEADER_SIZE + 2:
+            self.react(Reaction(NOTIFICATION, msg[19], msg[20]))
+        elif msgtype == codec.KEEPALIVE and self.probes:
+            self.probes -= 1
+        elif msgtype in (codec.KEEPALIVE, codec.UPDATE):
+            self.react(Reaction(ACCEPTED))
+        super().recv_bgp_msg(msgtype, msglen, msg)
+
+    def on_HoldTimer_Expires(self):
+        self.react(Reaction(SILENCE))
+        super().on_HoldTimer_Expires()
+
+    def send_probe(self):
+        """
+        Send a KEEPALIVE to check that the target is alive.
+
+        Anything corked is written along with it. The KEEPALIVE the target
+        answers it with isn't taken as a reaction to the last case.
+        """
+        # a probe is only sent once the target answered the one before, so
+        # at most one answer is due
+        self.probes = 1
+        self.send_bytes(self.render_KEEPALIVE())
+        self.flush()
+
+    def connectionLost(self, reason):
+        self.probes = 0
+        try:
+            self.react(Reaction(DROP))
+            if self.oracle is not None:
+                self.oracle.lost(
+                    reason.getErrorMessage()
+                    if reason is not None
+                    else "connection closed"
+                )
+        finally:
+            # the FSM must see the loss whatever the oracle does
+            super().connectionLost(reason)
+
+    def _connect_failed(self, failure):
+        if self.oracle is not None:
+            self.oracle.lost(failure.getErrorMessage())
+        elif self.last_case is not None:
+            self.findings.append(
+                {"case": self.last_case, "reason": failure.getErrorMessage()}
+            )
+            self.last_case = None
+        super()._connect_failed(failure)
+
+    def mutate_batch(self, pktcls, n, *args, **kwargs):
+        """
+        Generate a batch of mutated messages.
+
+        :param pktcls: message type, as accepted by :meth:`make_pkt`
+        :param n: number of messages
+        :return: array of shape (n, message length), one message per row
+        :rtype: numpy.ndarray
+        """
+        msg = BGP.make_bytes(self, pktcls, *args, **kwargs)
+        return self.mutator.mutate_plan(msg, self.fuzz_plan(pktcls, msg), n)
+
+    def attr_strategies(self, pktcls):
+        """
+        Get the enabled attribute strategies for a message type.
+
+        Only UPDATEs have path attributes to mutate.
+
+        :return: names from :data:`fuzzers.attrs.ATTR_STRATEGIES`
+        :rtype: list
+        """
+        if pktcls != "UPDATE":
+            return []
+        fspec = self.fuzzspec.get("BGPUpdate", {}).get("path_attr")
+        if not fspec or not fspec["fuzz"]:
+            return []
+        return [s for s in fspec["strategies"] if s in ATTR_STRATEGIES]
+
+    def mixed_batch(self, msg, plan, attrs, n, seed=None):
+        """
+        Generate a batch of UPDATEs from both a mutation plan and attribute
+        strategies, in proportion to their number of entries.
+
+        :param msg: serialized UPDATE the plan was compiled against
+        :param plan: array of ``PLAN_DTYPE`` entries
+        :param attrs: attribute strategy names
+        :param n: number of messages
+        :param seed: corpus case to mutate instead of ``msg``; the plan is
+            only applied to it if it is as long as ``msg``, and attribute
+            strategies fall back to ``msg`` if it doesn't parse
+        :return: list of serialized messages, in random order
+        :rtype: list
+        """
+        inconsistent = self.fuzzspec["BGPUpdate"]["path_attr"].get("inconsistent", ())
+        k = n * len(attrs) // (len(attrs) + len(plan))
+        try:
+            batch = self.attr_mutator.mutate(seed or msg, attrs, k, inconsistent)
+        except ValueError:
+            batch = self.attr_mutator.mutate(msg, attrs, k, inconsistent)
+        if len(plan):
+            base = seed if seed is not None and len(seed) == len(msg) else msg
+            rows = self.mutator.mutate_plan(base, plan, n - k)
+            batch.extend(row.tobytes() for row in rows)
+        return [batch[j] for j in self.mutator.rng.permutation(len(batch))]
+
+    def fuzz_plan(self, pktcls, msg):
+        """
+        Get the compiled mutation plan for a message type.
+
+        Plans are compiled on first use and whenever the layout of the
+        message changes; see :meth:`recompile` for changes to the fuzzspec.
+
+        :param pktcls: message type, as accepted by :meth:`make_pkt`
+        :param msg: serialized message
+        :return: array of ``PLAN_DTYPE`` entries
+        :rtype: numpy.ndarray
+        """
+        specname = self.specnames.get(pktcls)
+        compiled = self.plans.get(specname)
+        if compiled is None or compiled[0] != len(msg):
+            compiled = (len(msg), self.compile(specname, msg))
+            self.plans[specname] = compiled
+            self.batches.pop(pktcls, None)
+        return compiled[1]
+
+    def compile(self, specname, msg):
+        """
+        Compile the fuzzspec for one message against a serialized instance
+        of it.
+
+        :param specname: fuzzspec message name
+        :param msg: serialized message
+        :return: array of ``PLAN_DTYPE`` entries
+        :rtype: numpy.ndarray
+        """
+        spec = self.fuzzspec.get(specname, {})
+        layer = self.layernames.get(specname, specname)
+        layout = self.field_layout(BGPHeader(msg))
+        fields = {}
+        for field in spec:
+            if field == "header":
+                fields[field] = layout.get("BGPHeader") or layout[layer]
+            else:
+                fields[field] = layout[layer + "." + field]
+        self.layouts[specname] = fields
+        return compile_spec(spec, fields)
+
+    def mutated_field(self, pktcls, case):
+        """
+        Name the first fuzzed field in which a case differs from its base
+        message.
+
+        :param pktcls: message type the case was sent as
+        :param case: serialized case
+        :return: ``Spec.field`` name, or None if no fuzzed field differs
+        :rtype: str
+        """
+        base = self.batches.get(pktcls, (None,))[0]
+        specname = self.specnames.get(pktcls)
+        if base is None:
+            return None
+        if len(base) != len(case):
+            # only attribute strategies change the length
+            return specname + ".path_attr" if self.attr_strategies(pktcls) else None
+        diff = np.flatnonzero(
+            np.frombuffer(base, np.uint8) != np.frombuffer(case, np.uint8)
+        )
+        spec = self.fuzzspec.get(specname, {})
+        for offset in diff:
+            for field, (start, size) in self.layouts.get(specname, {}).items():
+                if spec[field]["fuzz"] and start <= offset < start + size:
+                    return specname + "." + field
+        return None
+
+
+class AsyncioBGPFuzzer(AsyncioTransport, BGPFuzzer):
+    """BGP protocol fuzzer driven by asyncio."""
+
+    pass
@@ -0,0 +1,447 @@
+# Multi-process fuzz campaigns.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import Counter
+from ipaddress import IPv4Address
+from protos.metrics import collect
+from queue import Empty
+import multiprocessing
+import numpy as np
+import logging
+import os
+import time
+
+
+class Campaign(object):
+    """
+    BGPFuzzer campaign sharded across worker processes.
+
+    Each worker runs its own reactor with its own set of fuzzer sessions, and
+    draws mutations from its own random stream derived from the campaign
+    seed. The streams are statistically independent, not a partition of the
+    mutation space, so shards may occasionally send the same case. Once all
+    workers finish, their counters and findings are aggregated.
+    """
+
+    def __init__(
+        self,
+        neighbor,
+        port=179,
+        workers=None,
+        sessions=1,
+        msgtype="KEEPALIVE",
+        fuzz=None,
+        fuzzspec=None,
+        iterations=None,
+        duration=None,
+        setup_timeout=None,
+        burst=1,
+        rate=None,
+        seed=None,
+        first_as=1,
+        first_id="10.0.0.1",
+        metrics_port=None,
+        oracle=None,
+        dedup=None,
+        fast=False,
+        pool=0,
+    ):
+        """
+        Create a new Campaign.
+
+        :param neighbor: ipv4 address of the target
+        :param port: tcp port of the target
+        :param workers: number of worker processes; defaults to one per core
+        :param sessions: number of sessions per worker
+        :param msgtype: message type to send once Established
+        :param fuzz: fuzzspec fields to enable, see :meth:`FuzzerMixin.fuzz`
+        :param fuzzspec: fuzzspec to start from, or None for the default
+        :param iterations: total number of messages to send, fuzzed or not
+        :param duration: maximum run time, in seconds
+        :param setup_timeout: seconds a worker waits for its first session
+            to reach Established before giving up on the target
+        :param burst: cases sent per Established session per reactor tick
+        :param rate: maximum cases per second, across all workers
+        :param seed: campaign seed, for reproducible runs
+        :param first_as: ASN of the first session
+        :param first_id: BGP ID of the first session
+        :param metrics_port: if given, each worker exports its sessions'
+            metrics in the Prometheus text format on this port plus its
+            shard index
+        :param oracle: options for a :class:`fuzzers.oracle.LivenessOracle`
+            watching each session; failures it detects become findings
+        :param dedup: options for a :class:`fuzzers.seen.SeenFilter` shared
+            by the sessions of each worker, so that no worker sends the same
+            case twice
+        :param fast: bring sessions up in fast mode, see
+            :meth:`protos.bgp.BGP.fast_setup`
+        :param pool: with ``fast``, connections each worker keeps open
+            ahead of its sessions reconnecting
+
+        :type neighbor: str
+        :type port: int
+        :type workers: int
+        :type sessions: int
+        :type msgtype: str
+        :type fuzz: list
+        :type fuzzspec: dict
+        :type iterations: int
+        :type duration: float
+        :type setup_timeout: float
+        :type burst: int
+        :type rate: float
+        :type seed: int
+        :type first_as: int
+        :type first_id: str
+        :type metrics_port: int
+        :type oracle: dict
+        :type dedup: dict
+        :type fast: bool
+        :type pool: int
+        """
+        if iterations is None and duration is None:
+            raise ValueError("Campaign needs an iteration count or a duration")
+
+        self.workers = workers or os.cpu_count()
+        self.seed = seed if seed is not None else np.random.SeedSequence().entropy
+        self.iterations = iterations
+        self.config = {
+            "neighbor": neighbor,
+            "port": port,
+            "sessions": sessions,
+            "msgtype": msgtype,
+            "fuzz": list(fuzz or []),
+            "fuzzspec": fuzzspec,
+            "duration": duration,
+            "setup_timeout": setup_timeout,
+            "burst": burst,
+            "rate": rate / self.workers if rate else None,
+            "first_as": first_as,
+            "first_id": first_id,
+            "metrics_port": metrics_port,
+            "oracle": oracle,
+            "dedup": dedup,
+            "fast": fast,
+            "pool": pool,
+        }
+
+    def shards(self):
+        """
+        Split the campaign into per-worker shards.
+
+        :return: list of (config, shard index, iterations, seed) tuples
+        :rtype: list
+        """
+        seeds = np.random.SeedSequence(self.seed).spawn(self.workers)
+        shards = []
+        for i in range(self.workers):
+            iterations = None
+            if self.iterations is not None:
+                iterations = self.iterations // self.workers
+                iterations += i < self.iterations % self.workers
+            shards.append((self.config, i, iterations, seeds[i]))
+        return shards
+
+    def run(self, progress=None, interval=1.0):
+        """
+        Run the campaign to completion.
+
+        :param progress: called every ``interval`` seconds while the
+            campaign runs, and once at the end, with the campaign's status
+            and the findings made since the last call; see :meth:`watch`
+        :param interval: seconds between progress calls
+        :return: aggregated results; see :func:`aggregate`
+        :rtype: dict
+        """
+        start = time.monotonic()
+        # A reactor cannot be restarted, so every shard gets a fresh process
+        ctx = multiprocessing.get_context("spawn")
+        manager = queue = None
+        if progress is not None:
+            manager = ctx.Manager()
+            queue = manager.Queue()
+        pool = ctx.Pool(
+            self.workers,
+            _init_shard,
+            (queue, interval),
+            maxtasksperchild=1,
+        )
+        try:
+            if progress is None:
+                results = pool.starmap(run_shard, self.shards(), chunksize=1)
+            else:
+                pending = pool.starmap_async(run_shard, self.shards(), chunksize=1)
+                self.watch(pending, queue, progress, interval, start)
+                results = pending.get()
+        finally:
+            pool.close()
+            pool.join()
+            if manager is not None:
+                manager.shutdown()
+        return aggregate(results, time.monotonic() - start)
+
+    def watch(self, pending, queue, progress, interval, start):
+        """
+        Relay the progress reports of running shards until they finish.
+
+        The status passed to ``progress`` holds the campaign's elapsed time,
+        cases sent, throughput since the last call, Established sessions and
+        findings so far, summed over the latest report of each shard.
+        """
+        latest = {}
+        new = []
+        total = 0
+        last, last_cases = start, 0
+        while True:
+            finished = pending.ready()
+            try:
+                report = queue.get(timeout=0.05)
+            except Empty:
+                report = None
+            if report is not None:
+                latest[report["shard"]] = report
+                new += report["findings"]
+                total += len(report["findings"])
+            now = time.monotonic()
+            done = report is None and finished
+            if done or now - last >= interval:
+                cases = sum(r["cases"] for r in latest.values())
+                span = now - last
+                status = {
+                    "elapsed": now - start,
+                    "cases": cases,
+                    "throughput": (cases - last_cases) / span if span else 0.0,
+                    "established": sum(r["established"] for r in latest.values()),
+                    "findings": total,
+                }
+                progress(status, new)
+                new = []
+                last, last_cases = now, cases
+            if done:
+                return
+
+
+def aggregate(results, elapsed):
+    """
+    Combine per-shard results.
+
+    :param results: list of results returned by :func:`run_shard`
+    :param elapsed: campaign wall time, in seconds
+    :return: totals, per-shard results, findings, overall throughput and
+        merged session metrics
+    :rtype: dict
+    """
+    totals = Counter()
+    findings = []
+    for result in results:
+        totals.update(result["stats"])
+        findings += result["findings"]
+    return {
+        "metrics": collect(result["metrics"] for result in results),
+        "elapsed": elapsed,
+        "totals": dict(totals),
+        "throughput": totals["sent"] / elapsed if elapsed else 0.0,
+        "shards": results,
+        "findings": findings,
+    }
+
+
+# Queue shards report progress on, and seconds between reports
+_progress = None
+_interval = 1.0
+
+
+def _init_shard(queue, interval):
+    global _progress, _interval
+    _progress = queue
+    _interval = interval
+
+
+def run_shard(config, shard, iterations, seed):
+    """
+    Run one shard of a campaign in the current process.
+
+    This runs the reactor, so it must be called in a fresh process.
+
+    :param config: campaign configuration
+    :param shard: shard index
+    :param iterations: messages to send, or None to run for the duration
+    :param seed: random stream for this shard
+    :return: shard statistics and findings
+    :rtype: dict
+    """
+    from twisted.internet import reactor
+    from fuzzers.bgp import BGPFuzzer
+    from fuzzers.mutate import Mutator
+    from protos.manager import SessionManager
+    from protos.metrics import Exporter
+    from fuzzers.oracle import LivenessOracle
+    from fuzzers.seen import SeenFilter
+    from protos.pool import ConnectionPool
+
+    count = config["sessions"]
+    seen = None
+    if config.get("dedup") is not None:
+        seen = SeenFilter(**config["dedup"])
+    manager = SessionManager()
+    manager.spawn(
+        count,
+        config["neighbor"],
+        cls=BGPFuzzer,
+        port=config["port"],
+        first_as=config["first_as"] + shard * count,
+        first_id=str(IPv4Address(config["first_id"]) + shard * count),
+        fuzzspec=config["fuzzspec"],
+        dedup=seen,
+    )
+    pool = None
+    if config.get("fast") and config.get("pool"):
+        pool = ConnectionPool(config["neighbor"], config["port"], config["pool"])
+    for session, sseed in zip(manager.sessions.values(), seed.spawn(count)):
+        session.mutator = Mutator(sseed)
+        if config.get("fast"):
+            session.fast_setup(pool=pool)
+        if config["fuzz"]:
+            session.fuzz(config["fuzz"])
+        if config.get("oracle") is not None:
+            LivenessOracle(session, **config["oracle"]).attach()
+    logging.getLogger("BGP").setLevel(logging.WARNING)
+    exporter = None
+    if config.get("metrics_port") is not None:
+        exporter = Exporter(port=config["metrics_port"] + shard).start()
+
+    msgtype = config["msgtype"]
+    burst = config["burst"]
+    rate = config.get("rate")
+    duration = config["duration"]
+    setup_timeout = config.get("setup_timeout")
+    start = time.monotonic()
+    # session id -> findings already reported
+    reported = {}
+    # messages sent by tick(); fuzzer stats only count mutated cases, and a
+    # campaign without fuzzed fields sends none
+    sent = Counter()
+    # whether any session has been Established
+    up = []
+
+    def cases():
+        return sent["messages"]
+
+    def report():
+        findings = []
+        for session in manager.sessions.values():
+            n = reported.get(session.sid, 0)
+            findings += [
+                dict(f, shard=shard, sid=session.sid) for f in session.findings[n:]
+            ]
+            reported[session.sid] = len(session.findings)
+        _progress.put(
+            {
+                "shard": shard,
+                "cases": cases(),
+                "established": len(manager.in_state("Established")),
+                "findings": findings,
+            }
+        )
+
+    def progress():
+        report()
+        reactor.callLater(_interval, progress)
+
+    # exception that ended the shard, if any
+    errors = []
+
+    def stop():
+        manager.stop()
+        if pool is not None:
+            pool.close()
+        reactor.callLater(0, reactor.stop)
+
+    def tick():
+        try:
+            step()
+        except Exception as e:
+            # a failed tick would otherwise leave the reactor running idle
+            errors.append(e)
+            reactor.callLater(0, reactor.stop)
+            manager.stop()
+
+    def step():
+        elapsed = time.monotonic() - start
+        unreachable = not up and setup_timeout is not None and elapsed >= setup_timeout
+        if unreachable:
+            logging.getLogger("Campaign").warning(
+                "No session Established within %ss; giving up", setup_timeout
+            )
+            sent["unreachable"] = 1
+        if (
+            unreachable
+            or (iterations is not None and cases() >= iterations)
+            or (duration is not None and elapsed >= duration)
+        ):
+            stop()
+            return
+        if rate is not None:
+            # seconds until the rate allows another case
+            wait = (cases() + 1) / rate - (time.monotonic() - start)
+            if wait > 0:
+                reactor.callLater(wait, tick)
+                return
+        established = manager.in_state("Established")
+        if established and not up:
+            up.append(True)
+        for session in established:
+            session.send_burst([session.make_bytes(msgtype) for _ in range(burst)])
+        sent["messages"] += burst * len(established)
+        reactor.callLater(0 if established else 0.01, tick)
+
+    reactor.callWhenRunning(manager.start)
+    reactor.callWhenRunning(tick)
+    if _progress is not None:
+        reactor.callWhenRunning(progress)
+    reactor.run(installSignalHandlers=False)
+    if exporter is not None and errors:
+        exporter.stop()
+    if errors:
+        raise errors[0]
+    if _progress is not None:
+        report()
+
+    elapsed = time.monotonic() - start
+    stats = Counter()
+    findings = []
+    for session in manager.sessions.values():
+        stats.update(session.stats)
+        stats["ConnectRetryCounter"] += session.sattrs["ConnectRetryCounter"]
+        if session.corpus is not None:
+            stats["corpus"] += len(session.corpus)
+        findings += [dict(f, shard=shard, sid=session.sid) for f in session.findings]
+    stats["transitions"] = manager.transitions
+    stats["sent"] = cases()
+    stats["unreachable"] = sent["unreachable"]
+    if exporter is not None:
+        exporter.stop()
+    return {
+        "metrics": manager.metrics(),
+        "shard": shard,
+        "pid": os.getpid(),
+        "elapsed": elapsed,
+        "stats": dict(stats),
+        "throughput": stats["sent"] / elapsed if elapsed else 0.0,
+        "findings": findings,
+        "dedup": seen.report() if seen is not None else None,
+    }
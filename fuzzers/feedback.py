@@ -0,0 +1,180 @@
+# Response feedback for fuzzers.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# A fuzzer is blind unless it looks at how the target reacts. Each case sent
+# is classified by the first reaction it draws -- a NOTIFICATION with a given
+# code and subcode, a dropped connection, silence until the hold timer fires,
+# or an ordinary reply -- and cases whose reaction signature hasn't been seen
+# before are kept in a corpus to be mutated ahead of the base message.
+
+from collections import Counter, namedtuple
+import hashlib
+import heapq
+
+# Reaction kinds
+ACCEPTED = "accepted"
+NOTIFICATION = "notification"
+DROP = "drop"
+SILENCE = "silence"
+
+Reaction = namedtuple("Reaction", ["kind", "error_code", "error_subcode"])
+"""How the target reacted to a case; codes are None except for NOTIFICATION"""
+Reaction.__new__.__defaults__ = (None, None)
+
+Entry = namedtuple("Entry", ["digest", "msgtype", "case", "reaction"])
+"""A corpus entry"""
+
+
+def digest(case):
+    """
+    Hash a case for deduplication.
+
+    :rtype: bytes
+    """
+    return hashlib.blake2b(case, digest_size=16).digest()
+
+
+class Corpus(object):
+    """
+    Cases that drew a reaction signature no earlier case did.
+
+    A signature is a message type together with the reaction to it. Every
+    signature is represented by the first case that produced it, and
+    identical cases are stored once. Entries are handed out for mutation
+    least-used first, so new entries are mutated before older ones, until
+    each has been handed out ``energy`` times.
+    """
+
+    def __init__(self, energy=8, store=None):
+        """
+        Create a new Corpus.
+
+        :param energy: times each entry is handed out for mutation
+        :param store: on-disk store to also append new entries to
+        :type store: fuzzers.store.CorpusStore
+        """
+        self.energy = energy
+        self.store = store
+        # digest -> Entry
+        self.entries = {}
+        # (message type, reaction) -> digest of the entry that found it
+        self.signatures = {}
+        # message type -> heap of [times chosen, sequence number, digest]
+        self.queues = {}
+        self.stats = Counter()
+        self._seq = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, case):
+        return digest(case) in self.entries
+
+    def add(self, msgtype, case, reaction, field=None):
+        """
+        Record the reaction to a case, keeping the case if it was new.
+
+        :param msgtype: message type the case was sent as
+        :param case: serialized case
+        :param reaction: reaction drawn by the case
+        :param field: name of the field that was mutated, if known
+        :type reaction: Reaction
+        :return: the new entry, or None if nothing new was learned
+        """
+        self.stats["reactions"] += 1
+        self.stats[reaction.kind] += 1
+        signature = (msgtype, reaction)
+        if signature in self.signatures:
+            return None
+        key = digest(case)
+        if key in self.entries:
+            self.stats["duplicates"] += 1
+            return None
+
+        entry = Entry(key, msgtype, bytes(case), reaction)
+        self.entries[key] = entry
+        self.signatures[signature] = key
+        heapq.heappush(self.queues.setdefault(msgtype, []), [0, self._seq, key])
+        self._seq += 1
+        self.stats["signatures"] += 1
+        if self.store is not None:
+            self.store.append(entry.case, msgtype, field, reaction)
+        return entry
+
+    def load(self, store):
+        """
+        Add the entries of an on-disk store, e.g. to resume a campaign.
+
+        Messages without a recorded reaction are skipped.
+
+        :type store: fuzzers.store.CorpusStore
+        :return: number of entries added
+        :rtype: int
+        """
+        from fuzzers.store import MSGTYPES
+
+        names = {code: name for name, code in MSGTYPES.items()}
+        saved, self.store = self.store, None
+        added = 0
+        try:
+            for i, case in enumerate(store.messages()):
+                reaction = store.reaction(i)
+                msgtype = store.columns["msgtype"][i]
+                if reaction is None:
+                    continue
+                if self.add(names.get(msgtype, msgtype), case, reaction):
+                    added += 1
+        finally:
+            self.store = saved
+        return added
+
+    def choose(self, msgtype, length=None):
+        """
+        Pick an entry to mutate next.
+
+        :param msgtype: message type to pick a case for
+        :param length: only consider cases of this length
+        :return: the least used case, or None if every case has used up its
+            energy
+        :rtype: bytes
+        """
+        queue = self.queues.get(msgtype)
+        if not queue or queue[0][0] >= self.energy:
+            return None
+        skipped = []
+        case = None
+        while queue:
+            item = heapq.heappop(queue)
+            skipped.append(item)
+            entry = self.entries[item[2]]
+            if item[0] >= self.energy:
+                break
+            if length is None or len(entry.case) == length:
+                item[0] += 1
+                case = entry.case
+                break
+        for item in skipped:
+            heapq.heappush(queue, item)
+        return case
+
+    def signatures_for(self, msgtype):
+        """
+        List the reactions seen for a message type.
+
+        :rtype: list of Reaction
+        """
+        return [r for (t, r) in self.signatures if t == msgtype]
@@ -15,9 +15,33 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from scapy.packet import NoPayload
 import pprint
 
 
+def spec_fields(fuzzspec):
+    """
+    Name the fields of a fuzzspec.
+
+    :return: ``<message>.<field>`` names, as accepted by
+        :meth:`FuzzerMixin.fuzz`
+    :rtype: list
+    """
+    return [msg + "." + field for msg, fields in fuzzspec.items() for field in fields]
+
+
+def check_fields(fuzzspec, names):
+    """
+    Check that fields are part of a fuzzspec.
+
+    :raises ValueError: naming the fields that aren't
+    """
+    known = set(spec_fields(fuzzspec))
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise ValueError("Unknown fuzzspec fields: {}".format(", ".join(unknown)))
+
+
 class FuzzerMixin(object):
     """
     Mixin inteded to extend Protocol subclasses.
@@ -33,11 +57,62 @@ class FuzzerMixin(object):
         super().__init__(*args, **kwargs)
 
     def fuzzables(self):
-        names = []
-        pp = pprint.PrettyPrinter(indent=4)
-        for cls in self.packets:
-            names += [cls.__name__ + "." + field.name for field in cls.fields_desc]
-        pp.pprint(names)
+        """List the fields of the fuzzspec that can be fuzzed."""
+        pprint.PrettyPrinter(indent=4).pprint(spec_fields(self.fuzzspec))
 
     def fuzz(self, fields):
-        fuzzlist += fields
+        """
+        Enable fuzzing of the given fields.
+
+        :param fields: field names, as listed by :meth:`fuzzables`
+        :type fields: list
+        :raises ValueError: if a field is not part of the fuzzspec
+        """
+        check_fields(self.fuzzspec, fields)
+        self.fuzzlist = self.fuzzlist + list(fields)
+        changed = set()
+        for name in fields:
+            cls, field = name.split(".", 1)
+            self.fuzzspec[cls][field]["fuzz"] = True
+            changed.add(cls)
+        self.recompile(changed)
+
+    def recompile(self, names=None):
+        """
+        Discard compiled mutation plans so they are rebuilt from the fuzzspec
+        on next use.
+
+        Call this after editing the fuzzspec directly.
+
+        :param names: fuzzspec message names to recompile, or None for all
+        :type names: iterable
+        """
+        if names is None:
+            self.plans.clear()
+        for name in names or []:
+            self.plans.pop(name, None)
+
+    @staticmethod
+    def field_layout(pkt):
+        """
+        Find where each field of a packet lives in its serialized form.
+
+        Each layer is keyed by its class name and each field by
+        ``<layer>.<field>``.
+
+        :param pkt: dissected Scapy packet
+        :return: mapping of name to (offset, size)
+        :rtype: dict
+        """
+        layout = {}
+        offset = 0
+        layer = pkt
+        while not isinstance(layer, NoPayload):
+            start = offset
+            for field in layer.fields_desc:
+                size = len(field.addfield(layer, b"", layer.getfieldval(field.name)))
+                layout[type(layer).__name__ + "." + field.name] = (offset, size)
+                offset += size
+            layout[type(layer).__name__] = (start, offset - start)
+            layer = layer.payload
+        return layout
@@ -0,0 +1,232 @@
+# Headless campaign runner.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Usage: python3 -m fuzzers.headless <campaign .json> [--interval SECONDS]
+#            [--iterations N] [--duration SECONDS] [--rate N]
+#            [--setup-timeout SECONDS]
+#
+# Runs a campaign unattended, for fuzz farms, and streams its progress to
+# stdout as JSON lines, one object per line with an "event" of:
+#
+#   start     the campaign configuration
+#   progress  elapsed time, cases sent, throughput, Established sessions
+#             and findings so far
+#   finding   one finding, as soon as its shard reports it; bytes are hex
+#   done      totals, throughput and number of findings
+#   error     why the campaign couldn't run, or failed
+#
+# The campaign file is a JSON object of fuzzers.campaign.Campaign options,
+# with the target given as "target": "host[:port]" or as "neighbor" and
+# "port", and "fuzzspec" either inline or as the path of a JSON file.
+# Options given on the command line override the file. Logging goes to
+# stderr, warnings only. The exit code reflects the outcome:
+#
+#   0    no findings
+#   2    bad campaign file or options
+#   3    no message could be sent: no session reached Established in time
+#   4    the campaign failed with an error of its own
+#   5    the target failed at least once
+#   130  interrupted
+#
+# 1 is left to Python, which exits with it on an uncaught exception.
+
+from fuzzers.bgp import default_fuzzspec
+from fuzzers.campaign import Campaign
+from fuzzers.fuzz import check_fields
+import inspect
+import json
+import logging
+import sys
+import time
+
+# Exit codes
+EXIT_CLEAN = 0
+"""No findings"""
+EXIT_CONFIG = 2
+"""Bad campaign file or options"""
+EXIT_UNREACHABLE = 3
+"""No message could be sent: no session reached Established in time"""
+EXIT_ERROR = 4
+"""The campaign failed with an error of its own"""
+EXIT_FINDINGS = 5
+"""The target failed at least once"""
+EXIT_INTERRUPTED = 130
+
+# Seconds a worker waits for a first Established session, unless configured
+SETUP_TIMEOUT = 30.0
+
+
+def load(path, overrides=None):
+    """
+    Read a campaign file into Campaign options.
+
+    :param path: path of the campaign .json
+    :param overrides: options replacing those of the file, where not None
+    :return: keyword arguments for :class:`fuzzers.campaign.Campaign`
+    :rtype: dict
+    :raises ValueError: if the file isn't a valid campaign
+    """
+    with open(path) as f:
+        config = json.load(f)
+    if not isinstance(config, dict):
+        raise ValueError("Campaign file must hold a JSON object")
+    config.update({k: v for k, v in (overrides or {}).items() if v is not None})
+
+    target = config.pop("target", None)
+    if target is not None:
+        host, _, port = str(target).partition(":")
+        config["neighbor"] = host
+        if port:
+            config["port"] = int(port)
+    if isinstance(config.get("fuzzspec"), str):
+        with open(config["fuzzspec"]) as f:
+            config["fuzzspec"] = json.load(f)
+
+    known = set(inspect.signature(Campaign).parameters)
+    unknown = sorted(set(config) - known)
+    if unknown:
+        raise ValueError("Unknown campaign options: {}".format(", ".join(unknown)))
+    if "neighbor" not in config:
+        raise ValueError("Campaign needs a target")
+    fuzzspec = config.get("fuzzspec")
+    if fuzzspec is not None and not (
+        isinstance(fuzzspec, dict)
+        and all(
+            isinstance(fields, dict)
+            and all(isinstance(spec, dict) for spec in fields.values())
+            for fields in fuzzspec.values()
+        )
+    ):
+        raise ValueError(
+            "fuzzspec must map messages to fields to their specs, "
+            "or be the path of a JSON file that does"
+        )
+    fuzz = config.get("fuzz", [])
+    if not isinstance(fuzz, list) or not all(isinstance(name, str) for name in fuzz):
+        raise ValueError("fuzz must be a list of <message>.<field> names")
+    check_fields(fuzzspec or default_fuzzspec(), fuzz)
+    config.setdefault("setup_timeout", SETUP_TIMEOUT)
+    return config
+
+
+def jsonable(value):
+    """Make a finding or result encodable as JSON, with bytes as hex."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if isinstance(value, dict):
+        return {str(k): jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [jsonable(v) for v in value]
+    return value
+
+
+def emit(event, out=None, **fields):
+    """Write one JSON line to stdout, right away."""
+    out = out or sys.stdout
+    line = {"event": event, "time": time.time()}
+    line.update(fields)
+    out.write(json.dumps(jsonable(line)) + "\n")
+    out.flush()
+
+
+def run(config, interval=1.0, out=None):
+    """
+    Run a campaign, streaming its progress.
+
+    :param config: Campaign options, as from :func:`load`
+    :param interval: seconds between progress lines
+    :param out: stream to write JSON lines to; defaults to stdout
+    :return: exit code
+    :rtype: int
+    """
+    try:
+        campaign = Campaign(**config)
+    except (TypeError, ValueError) as e:
+        emit("error", out, reason=str(e))
+        return EXIT_CONFIG
+    emit("start", out, config=config, workers=campaign.workers, seed=campaign.seed)
+
+    def progress(status, findings):
+        for finding in findings:
+            emit("finding", out, **finding)
+        emit("progress", out, **status)
+
+    try:
+        result = campaign.run(progress=progress, interval=interval)
+    except Exception as e:
+        logging.getLogger("Campaign").exception("Campaign failed")
+        emit("error", out, reason="{}: {}".format(type(e).__name__, e))
+        return EXIT_ERROR
+    totals = result["totals"]
+    emit(
+        "done",
+        out,
+        elapsed=result["elapsed"],
+        totals=totals,
+        throughput=result["throughput"],
+        findings=len(result["findings"]),
+    )
+    if result["findings"]:
+        return EXIT_FINDINGS
+    if not totals.get("sent"):
+        return EXIT_UNREACHABLE
+    return EXIT_CLEAN
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a fuzz campaign unattended.")
+    parser.add_argument("campaign", help="campaign .json")
+    parser.add_argument("--interval", type=float, default=1.0, help="progress period")
+    parser.add_argument("--iterations", type=int, help="total messages to send")
+    parser.add_argument("--duration", type=float, help="time budget, in seconds")
+    parser.add_argument("--rate", type=float, help="maximum cases per second")
+    parser.add_argument(
+        "--setup-timeout", type=float, help="seconds to reach Established"
+    )
+    parser.add_argument("--workers", type=int, help="worker processes")
+    parser.add_argument("--seed", type=int, help="campaign seed")
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        stream=sys.stderr,
+        level=logging.WARNING,
+        format="%(asctime)s %(levelname)-4s %(message)s",
+    )
+
+    overrides = {
+        "iterations": args.iterations,
+        "duration": args.duration,
+        "rate": args.rate,
+        "workers": args.workers,
+        "seed": args.seed,
+        "setup_timeout": args.setup_timeout,
+    }
+    try:
+        config = load(args.campaign, overrides)
+    except (OSError, ValueError) as e:
+        emit("error", reason=str(e))
+        return EXIT_CONFIG
+    try:
+        return run(config, args.interval)
+    except KeyboardInterrupt:
+        emit("error", reason="interrupted")
+        return EXIT_INTERRUPTED
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,649 @@
+# Parallel test case minimization.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Usage: python3 -m fuzzers.minimize <finding .json or .cap> [--target CMD]
+#            [--kind crash|hang|drop] [--workers N] [--output PATH]
+#
+# Shrinks the messages a failure was attributed to down to a small sequence
+# that still reproduces it, by delta debugging (ddmin): first over whole
+# messages, then over the parts of each remaining message.
+#
+# Every candidate is tested on a fresh session with a target of its own.
+# Each worker process starts one target from a command line, where
+# ``{port}`` stands for a free port, or a stand-in peer if no command is
+# given, and restarts it whenever a test reproduces the failure or leaves it
+# dead. The candidates of a ddmin step are tested in waves of one per
+# worker, and the first that reproduces the failure is kept.
+#
+# Within a message, prefixes, path attributes, optional parameters and then
+# single bytes of attribute values, parameter values and message data are
+# removed. Each removal subtracts the bytes removed from every length field
+# enclosing them, so lengths that were valid stay valid, and lengths a
+# case got deliberately wrong stay wrong by the same amount.
+
+from fuzzers.attrs import Layout
+from fuzzers.oracle import CRASH, HANG
+from protos import codec
+from protos.capture import OUT, Capture, Recorder
+import json
+import logging
+import multiprocessing
+import multiprocessing.util
+import os
+import select
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+# The target closes the session; stand-ins do this on malformed input
+DROP = "drop"
+
+KINDS = [CRASH, HANG, DROP]
+
+# Command line of the stand-in peer
+STANDIN = [sys.executable, "-m", "protos.responder", "--port", "{port}"]
+
+# Message header length field, as (offset, width)
+HEADER_LENGTH = (16, 2)
+
+
+# Targets ----------------------------------------------------------------------
+
+
+def free_port(host="127.0.0.1"):
+    """A TCP port that nothing listens on, at the time of asking."""
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def connects(address, timeout=0.5):
+    """Whether a TCP connection to an address succeeds."""
+    try:
+        socket.create_connection(address, timeout=timeout).close()
+        return True
+    except OSError:
+        return False
+
+
+class Target(object):
+    """A target process listening on a port of its own."""
+
+    def __init__(self, command=None, host="127.0.0.1", ready=10.0):
+        """
+        Create a new Target.
+
+        :param command: argument list; ``{port}`` in any argument is
+            replaced by the port to listen on. Defaults to a stand-in peer.
+        :param host: address the target listens on
+        :param ready: seconds the target has to start accepting connections
+        """
+        self.command = list(command or STANDIN)
+        self.host = host
+        self.ready = ready
+        self.proc = None
+        self.address = None
+
+    def start(self):
+        """
+        Start the target and wait until it accepts connections.
+
+        :raises RuntimeError: if it exits or doesn't listen in time
+        """
+        port = free_port(self.host)
+        argv = [arg.format(port=port) for arg in self.command]
+        self.proc = subprocess.Popen(
+            argv,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        self.address = (self.host, port)
+        deadline = time.monotonic() + self.ready
+        while not connects(self.address, 0.1):
+            if self.proc.poll() is not None:
+                raise RuntimeError("Target exited with {}".format(self.proc.returncode))
+            if time.monotonic() >= deadline:
+                self.stop()
+                raise RuntimeError("Target didn't listen on {}".format(port))
+            time.sleep(0.01)
+        return self
+
+    def running(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def alive(self):
+        """Whether the target runs and accepts connections."""
+        return self.running() and connects(self.address)
+
+    def stop(self):
+        if self.proc is None:
+            return
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.proc.wait()
+        self.proc = None
+
+
+# Running a case ---------------------------------------------------------------
+
+
+def _await(sock, types, timeout):
+    """
+    Read messages until one of the given types arrives.
+
+    :param types: message type codes, or None for any message
+    :return: whether one arrived before the session closed or timed out
+    """
+    deadline = time.monotonic() + timeout
+    buf = b""
+    while True:
+        while len(buf) >= codec.HEADER_SIZE:
+            length = int.from_bytes(buf[16:18], "big")
+            if types is None or buf[18] in types:
+                return True
+            if buf[18] == codec.NOTIFICATION or length < codec.HEADER_SIZE:
+                return False
+            if len(buf) < length:
+                break
+            buf = buf[length:]
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+            return False
+        try:
+            data = sock.recv(65536)
+        except OSError:
+            return False
+        if not data:
+            return False
+        buf += data
+
+
+def _drain(sock):
+    """Discard whatever has been received; return False if the session closed."""
+    while select.select([sock], [], [], 0)[0]:
+        try:
+            if not sock.recv(65536):
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def run_case(target, messages, kind, handshake=None, wait=1.0):
+    """
+    Send messages on a new session with a target and see if it fails.
+
+    :param target: running target
+    :type target: Target
+    :param messages: serialized messages
+    :param kind: failure to look for, from KINDS
+    :param handshake: bytes that bring the session up, answered by a
+        KEEPALIVE; the messages are sent right away if None
+    :param wait: seconds the target has to fail, or to answer
+    :return: whether the failure was reproduced
+    :rtype: bool
+    """
+    sock = socket.create_connection(target.address, timeout=wait)
+    try:
+        if handshake is not None:
+            sock.sendall(handshake)
+            if not _await(sock, (codec.KEEPALIVE,), wait):
+                # the session didn't come up, which says nothing either way
+                return False
+        closed = False
+        for msg in messages:
+            try:
+                sock.sendall(msg)
+            except OSError:
+                closed = True
+                break
+        return _failed(target, sock, kind, closed, handshake, wait)
+    finally:
+        sock.close()
+
+
+def _failed(target, sock, kind, closed, handshake, wait):
+    deadline = time.monotonic() + wait
+    if kind == CRASH:
+        while time.monotonic() < deadline:
+            if not target.running():
+                return True
+            time.sleep(0.01)
+        return not target.alive()
+    if kind == DROP:
+        if closed:
+            return True
+        while time.monotonic() < deadline:
+            if not _drain(sock):
+                return True
+            select.select([sock], [], [], max(0, deadline - time.monotonic()))
+        return not _drain(sock)
+    # a hang: the target runs, but doesn't answer
+    if not target.running():
+        return False
+    if not closed and _drain(sock):
+        try:
+            sock.sendall(codec.encode_keepalive())
+            return not _await(sock, None, wait)
+        except OSError:
+            pass
+    try:
+        with socket.create_connection(target.address, timeout=wait) as probe:
+            probe.sendall(handshake or codec.encode_keepalive())
+            return not _await(probe, None, wait)
+    except OSError:
+        return True
+
+
+# Worker processes -------------------------------------------------------------
+
+
+class Worker(object):
+    """Runs cases against a target of its own."""
+
+    def __init__(self, config):
+        self.config = config
+        self.target = Target(config["command"], ready=config["ready"])
+
+    def test(self, messages):
+        config = self.config
+        if config["fresh"] or not self.target.alive():
+            self.target.stop()
+            self.target.start()
+        failed = run_case(
+            self.target, messages, config["kind"], config["handshake"], config["wait"]
+        )
+        if failed:
+            self.target.stop()
+        return failed
+
+    def stop(self):
+        self.target.stop()
+
+
+_worker = None
+
+
+def _init_worker(config):
+    global _worker
+    _worker = Worker(config)
+    multiprocessing.util.Finalize(None, _worker.stop, exitpriority=10)
+
+
+def _test(messages):
+    return _worker.test(messages)
+
+
+# Message parts ----------------------------------------------------------------
+
+
+def _prefixes(msg, pos, end, fields):
+    units = []
+    while pos < end:
+        stop = min(pos + 1 + (msg[pos] + 7) // 8, end)
+        units.append((pos, stop, fields))
+        pos = stop
+    return units
+
+
+def parts(msg):
+    """
+    Removable parts of a message: withdrawn routes, path attributes and NLRI
+    of an UPDATE, or optional parameters of an OPEN.
+
+    :return: list of (start, end, length fields) tuples, where the length
+        fields enclosing a part are (offset, width) pairs
+    :rtype: list
+    """
+    if len(msg) < codec.HEADER_SIZE:
+        return []
+    header = (HEADER_LENGTH,)
+    msgtype = msg[18]
+    if msgtype == codec.UPDATE:
+        try:
+            layout = Layout(msg)
+        except ValueError:
+            return []
+        total = ((layout.total_offset, 2),) + header
+        units = _prefixes(msg, 21, layout.total_offset, ((19, 2),) + header)
+        units += [(start, end, total) for start, _, end in layout.attrs]
+        return units + _prefixes(msg, layout.end, len(msg), header)
+    if msgtype == codec.OPEN and len(msg) >= 29:
+        units = []
+        pos, end = 29, min(29 + msg[28], len(msg))
+        while pos + 2 <= end:
+            stop = min(pos + 2 + msg[pos + 1], end)
+            units.append((pos, stop, ((28, 1),) + header))
+            pos = stop
+        return units
+    return []
+
+
+def value_bytes(msg):
+    """
+    Removable single bytes of a message: those of attribute and parameter
+    values, notification data, or the body of any other message.
+
+    :return: list of (start, end, length fields) tuples, as from
+        :func:`parts`
+    :rtype: list
+    """
+    if len(msg) < codec.HEADER_SIZE:
+        return []
+    header = (HEADER_LENGTH,)
+    msgtype = msg[18]
+    units = []
+    if msgtype == codec.UPDATE:
+        try:
+            layout = Layout(msg)
+        except ValueError:
+            return []
+        for start, hdr, end in layout.attrs:
+            fields = ((start + 2, hdr - 2), (layout.total_offset, 2)) + header
+            units += [(pos, pos + 1, fields) for pos in range(start + hdr, end)]
+    elif msgtype == codec.OPEN:
+        for start, end, fields in parts(msg):
+            fields = ((start + 1, 1),) + fields
+            units += [(pos, pos + 1, fields) for pos in range(start + 2, end)]
+    else:
+        first = 21 if msgtype == codec.NOTIFICATION else codec.HEADER_SIZE
+        units = [(pos, pos + 1, header) for pos in range(first, len(msg))]
+    return units
+
+
+def remove(msg, units, keep):
+    """
+    Remove parts of a message, adjusting the length fields enclosing them.
+
+    :param units: parts, as from :func:`parts` or :func:`value_bytes`
+    :param keep: indexes of the parts to keep
+    :rtype: bytes
+    """
+    keep = set(keep)
+    removed = [unit for i, unit in enumerate(units) if i not in keep]
+    buf = bytearray(msg)
+    for start, end, fields in removed:
+        for offset, width in fields:
+            value = int.from_bytes(buf[offset : offset + width], "big") - (end - start)
+            buf[offset : offset + width] = (value % (1 << 8 * width)).to_bytes(
+                width, "big"
+            )
+    for start, end, _ in sorted(removed, reverse=True):
+        del buf[start:end]
+    return bytes(buf)
+
+
+# Minimization -----------------------------------------------------------------
+
+
+class Minimizer(object):
+    """Delta-debugging minimizer for message sequences that make a target fail."""
+
+    def __init__(
+        self,
+        messages,
+        kind=CRASH,
+        command=None,
+        workers=None,
+        wait=1.0,
+        ready=10.0,
+        fresh=False,
+        handshake=True,
+        my_as=1,
+        bgp_id="10.0.0.1",
+        hold_time=90,
+        bytewise=True,
+    ):
+        """
+        Create a new Minimizer.
+
+        :param messages: serialized messages that reproduce the failure
+        :param kind: failure to reproduce, from KINDS
+        :param command: target command line, see :class:`Target`
+        :param workers: number of worker processes, each with its own
+            target; defaults to one per core
+        :param wait: seconds a target has to fail after a case
+        :param ready: seconds a target has to start listening
+        :param fresh: restart the target before every case, not only after
+            failures
+        :param handshake: bring each session up with an OPEN and KEEPALIVE
+            of our own before sending the case
+        :param my_as: ASN of the OPEN
+        :param bgp_id: BGP ID of the OPEN
+        :param hold_time: hold time of the OPEN
+        :param bytewise: minimize within messages too
+
+        :type messages: list
+        :type kind: str
+        :type command: list
+        :type workers: int
+        """
+        if kind not in KINDS:
+            raise ValueError("Unknown failure kind: {}".format(kind))
+        self.messages = [bytes(m) for m in messages]
+        self.kind = kind
+        self.workers = workers or os.cpu_count()
+        self.bytewise = bytewise
+        if handshake:
+            handshake = codec.encode_open(my_as, hold_time, bgp_id)
+            handshake += codec.encode_keepalive()
+        self.config = {
+            "command": command,
+            "kind": kind,
+            "wait": wait,
+            "ready": ready,
+            "fresh": fresh,
+            "handshake": handshake or None,
+        }
+        self.pool = None
+        # message sequence -> whether it reproduced the failure
+        self.results = {}
+        self.tests = 0
+        self.log = logging.getLogger("Minimizer")
+
+    @classmethod
+    def from_finding(cls, finding, **kwargs):
+        """
+        Create a Minimizer for a finding of a
+        :class:`fuzzers.oracle.LivenessOracle`.
+
+        :param finding: finding dict, or the path of its .json description
+            or of its .cap capture
+        :param kwargs: passed to the constructor; the finding's kind is
+            used unless given
+        """
+        if isinstance(finding, str):
+            if finding.endswith(".cap"):
+                with Capture(finding) as capture:
+                    return cls(list(capture.chunks(OUT)), **kwargs)
+            with open(finding) as f:
+                meta = json.load(f)
+            kwargs.setdefault("kind", meta["kind"])
+            with Capture(meta["files"]["inputs"]) as capture:
+                return cls(list(capture.chunks(OUT)), **kwargs)
+        kwargs.setdefault("kind", finding["kind"])
+        return cls(finding["inputs"], **kwargs)
+
+    def run(self):
+        """
+        Minimize the sequence.
+
+        :return: the minimized messages, the number of messages and bytes
+            before and after, cases tested, and seconds taken
+        :rtype: dict
+        :raises ValueError: if the sequence doesn't reproduce the failure
+        """
+        start = time.monotonic()
+        ctx = multiprocessing.get_context("spawn")
+        self.pool = ctx.Pool(self.workers, _init_worker, (self.config,))
+        try:
+            messages = self.messages
+            if not self.test([messages])[0]:
+                raise ValueError("The sequence doesn't reproduce a " + self.kind)
+            keep = self.ddmin(list(range(len(messages))), lambda k: _pick(messages, k))
+            messages = _pick(messages, keep)
+            self.log.info("[+] %d of %d messages needed", len(messages), len(self.messages))
+            if self.bytewise:
+                for i in range(len(messages)):
+                    for split in (parts, value_bytes):
+                        messages[i] = self.shrink(messages, i, split)
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.result = messages
+        return {
+            "kind": self.kind,
+            "messages": messages,
+            "original": (len(self.messages), sum(map(len, self.messages))),
+            "minimized": (len(messages), sum(map(len, messages))),
+            "tests": self.tests,
+            "elapsed": time.monotonic() - start,
+        }
+
+    def shrink(self, messages, i, split):
+        """Minimize the parts of one message of a sequence."""
+        msg = messages[i]
+        units = split(msg)
+        if not units:
+            return msg
+
+        def build(keep):
+            return messages[:i] + [remove(msg, units, keep)] + messages[i + 1 :]
+
+        keep = self.ddmin(list(range(len(units))), build)
+        return remove(msg, units, keep)
+
+    def ddmin(self, items, build):
+        """
+        Find a 1-minimal subset of items whose sequence reproduces the
+        failure.
+
+        :param items: units the full sequence is built from
+        :param build: builds a message sequence from a list of items
+        :return: the items kept
+        :rtype: list
+        """
+        n = 2
+        while len(items) >= 2:
+            n = min(n, len(items))
+            chunks = [items[len(items) * j // n : len(items) * (j + 1) // n] for j in range(n)]
+            candidates = list(chunks)
+            if n > 2:
+                candidates += [
+                    [x for c in chunks[:j] + chunks[j + 1 :] for x in c] for j in range(n)
+                ]
+            found = self.first(candidates, build)
+            if found is None:
+                if n == len(items):
+                    break
+                n = min(2 * n, len(items))
+            elif found < n:
+                items, n = candidates[found], 2
+            else:
+                items, n = candidates[found], max(n - 1, 2)
+        if len(items) == 1 and self.test([build([])])[0]:
+            return []
+        return items
+
+    def first(self, candidates, build):
+        """
+        Test candidates in waves of one per worker.
+
+        :return: index of the first candidate that reproduces the failure,
+            or None
+        """
+        for start in range(0, len(candidates), self.workers):
+            wave = candidates[start : start + self.workers]
+            for j, failed in enumerate(self.test([build(c) for c in wave])):
+                if failed:
+                    return start + j
+        return None
+
+    def test(self, sequences):
+        """
+        Test message sequences in parallel, each on a target of its own.
+
+        :return: whether each reproduced the failure
+        :rtype: list
+        """
+        keys = [tuple(s) for s in sequences]
+        todo = list({k for k in keys if k not in self.results})
+        if todo:
+            for key, failed in zip(todo, self.pool.map(_test, todo, chunksize=1)):
+                self.results[key] = failed
+            self.tests += len(todo)
+        return [self.results[k] for k in keys]
+
+    def save(self, path):
+        """Write the minimized messages as a capture protos.capture.replay can send."""
+        with Recorder(path) as rec:
+            for msg in self.result:
+                rec.record(OUT, msg)
+
+
+def _pick(messages, keep):
+    return [messages[i] for i in keep]
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Minimize a failing BGP sequence.")
+    parser.add_argument("input", help="finding .json or capture .cap")
+    parser.add_argument(
+        "--target", help="target command line, {port} for its port; default stand-in"
+    )
+    parser.add_argument("--kind", choices=KINDS, help="failure to reproduce")
+    parser.add_argument("--workers", type=int, help="parallel targets")
+    parser.add_argument("--wait", type=float, default=1.0, help="seconds to fail")
+    parser.add_argument("--fresh", action="store_true", help="restart every case")
+    parser.add_argument("--no-bytes", action="store_true", help="keep messages whole")
+    parser.add_argument("--output", "-o", help="capture to write the result to")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    kwargs = {
+        "command": shlex.split(args.target) if args.target else None,
+        "workers": args.workers,
+        "wait": args.wait,
+        "fresh": args.fresh,
+        "bytewise": not args.no_bytes,
+    }
+    if args.kind:
+        kwargs["kind"] = args.kind
+    minimizer = Minimizer.from_finding(args.input, **kwargs)
+    result = minimizer.run()
+    print("kind:      {}".format(result["kind"]))
+    print("original:  {} messages, {} bytes".format(*result["original"]))
+    print("minimized: {} messages, {} bytes".format(*result["minimized"]))
+    print("tests:     {} in {:.1f}s".format(result["tests"], result["elapsed"]))
+    for msg in result["messages"]:
+        print(msg.hex())
+    if args.output:
+        minimizer.save(args.output)
+
+
+if __name__ == "__main__":
+    main()
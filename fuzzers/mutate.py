@@ -0,0 +1,224 @@
+# Batched mutation engine.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+# Strategy ids
+BITFLIP = 0
+INCREMENT = 1
+INTERESTING = 2
+
+STRATEGIES = {"bitflip": BITFLIP, "increment": INCREMENT, "interesting": INTERESTING}
+
+# Pseudo-strategy for plan entries that pin a field to a fixed value
+FIXED = 255
+
+# One entry of a compiled mutation plan
+PLAN_DTYPE = np.dtype(
+    [
+        ("offset", np.uint32),
+        ("width", np.uint32),
+        ("strategy", np.uint8),
+        ("value", np.uint64),
+    ]
+)
+
+# Largest delta applied by the increment strategy, in either direction
+ARITH_MAX = 35
+
+# Boundary values that tend to trip up length and range checks
+INTERESTING_VALUES = {
+    1: [0x00, 0x01, 0x10, 0x20, 0x40, 0x64, 0x7F, 0x80, 0xFF],
+    2: [
+        0x0000,
+        0x0001,
+        0x0080,
+        0x00FF,
+        0x0100,
+        0x0200,
+        0x03E8,
+        0x0400,
+        0x1000,
+        0x7FFF,
+        0x8000,
+        0xFFFF,
+    ],
+    4: [
+        0x00000000,
+        0x00000001,
+        0x0000FFFF,
+        0x00010000,
+        0x7FFFFFFF,
+        0x80000000,
+        0xFA0000FA,
+        0xFFFFFFFF,
+    ],
+}
+
+
+class Mutator(object):
+    """
+    Generates batches of mutated messages.
+
+    Every call to :meth:`mutate` produces N variants of a serialized base
+    message as the rows of a 2-D ``uint8`` array. Each variant receives one
+    mutation, applied to one of the given field byte ranges using one of
+    that range's strategies. All variants sharing a range and strategy are
+    mutated together with vectorized array operations.
+
+    Fields up to 8 bytes wide are treated as big-endian integers by the
+    increment and interesting strategies. Wider fields are treated as opaque
+    blobs, and have a single randomly chosen byte mutated instead.
+    """
+
+    def __init__(self, seed=None):
+        """
+        Create a new Mutator.
+
+        :param seed: random seed, for reproducible batches
+        :type seed: int
+        """
+        self.rng = np.random.default_rng(seed)
+
+    def mutate(self, base, ranges, n):
+        """
+        Generate mutated variants of a message.
+
+        :param base: serialized message
+        :param ranges: list of (offset, size, strategy ids) to mutate
+        :param n: number of variants to generate
+        :return: array of shape (n, len(base)), one variant per row
+
+        :type base: bytes
+        :type ranges: list
+        :type n: int
+        :rtype: numpy.ndarray
+        """
+        plan = [(o, s * 8, st, 0) for o, s, strategies in ranges for st in strategies]
+        return self.mutate_plan(base, np.array(plan, dtype=PLAN_DTYPE), n)
+
+    def mutate_plan(self, base, plan, n):
+        """
+        Generate mutated variants of a message from a compiled plan.
+
+        Entries with the ``FIXED`` strategy are applied to every variant.
+        Each variant then receives one of the remaining entries, chosen
+        uniformly.
+
+        :param base: serialized message
+        :param plan: array of ``PLAN_DTYPE`` entries
+        :param n: number of variants to generate
+        :return: array of shape (n, len(base)), one variant per row
+
+        :type base: bytes
+        :type plan: numpy.ndarray
+        :type n: int
+        :rtype: numpy.ndarray
+        """
+        base = np.frombuffer(base, dtype=np.uint8)
+        out = np.tile(base, (n, 1))
+        if not n:
+            return out
+
+        allrows = np.arange(n)
+        for offset, width, _, value in plan[plan["strategy"] == FIXED].tolist():
+            values = np.full(n, value, dtype=np.uint64)
+            self._write(out, allrows, offset, width // 8, values)
+
+        plan = plan[(plan["strategy"] != FIXED) & (plan["width"] > 0)]
+        if not len(plan):
+            return out
+
+        choice = self.rng.integers(len(plan), size=n)
+        order = np.argsort(choice, kind="stable")
+        bounds = np.searchsorted(choice[order], np.arange(len(plan) + 1))
+        for i, (offset, width, strategy, _) in enumerate(plan.tolist()):
+            rows = order[bounds[i] : bounds[i + 1]]
+            if len(rows):
+                self.apply(out, rows, offset, width // 8, strategy)
+
+        return out
+
+    def apply(self, out, rows, offset, size, strategy):
+        """
+        Apply one strategy to a byte range of the selected rows, in place.
+
+        :param out: batch of messages
+        :param rows: indices of the rows to mutate
+        :param offset: offset of the field
+        :param size: size of the field, in bytes
+        :param strategy: strategy id
+
+        :type out: numpy.ndarray
+        :type rows: numpy.ndarray
+        :type offset: int
+        :type size: int
+        :type strategy: int
+        """
+        if strategy == BITFLIP:
+            self._bitflip(out, rows, offset, size)
+        elif strategy == INCREMENT:
+            self._increment(out, rows, offset, size)
+        elif strategy == INTERESTING:
+            self._interesting(out, rows, offset, size)
+        else:
+            raise ValueError("Unknown strategy {}".format(strategy))
+
+    def _bitflip(self, out, rows, offset, size):
+        bits = self.rng.integers(size * 8, size=len(rows))
+        cols = offset + bits // 8
+        masks = (1 << (7 - bits % 8)).astype(np.uint8)
+        out[rows, cols] ^= masks
+
+    def _deltas(self, count):
+        deltas = self.rng.integers(1, ARITH_MAX + 1, size=count)
+        return np.where(self.rng.integers(2, size=count) == 1, deltas, -deltas)
+
+    def _increment(self, out, rows, offset, size):
+        deltas = self._deltas(len(rows))
+        if size > 8:
+            cols = offset + self.rng.integers(size, size=len(rows))
+            out[rows, cols] = (out[rows, cols].astype(np.int64) + deltas) & 0xFF
+            return
+        values = self._read(out, rows, offset, size)
+        values += deltas.astype(np.uint64)
+        self._write(out, rows, offset, size, values)
+
+    def _interesting(self, out, rows, offset, size):
+        width = size if size in INTERESTING_VALUES else 1
+        table = np.array(INTERESTING_VALUES[width], dtype=np.uint64)
+        values = table[self.rng.integers(len(table), size=len(rows))]
+        if width != size:
+            offset = offset + self.rng.integers(size, size=len(rows))
+            out[rows, offset] = values.astype(np.uint8)
+            return
+        self._write(out, rows, offset, size, values)
+
+    @staticmethod
+    def _read(out, rows, offset, size):
+        """Read a big-endian integer field from the selected rows."""
+        values = np.zeros(len(rows), dtype=np.uint64)
+        for i in range(size):
+            values = (values << np.uint64(8)) | out[rows, offset + i]
+        return values
+
+    @staticmethod
+    def _write(out, rows, offset, size, values):
+        """Write a big-endian integer field to the selected rows."""
+        for i in range(size - 1, -1, -1):
+            out[rows, offset + i] = (values & np.uint64(0xFF)).astype(np.uint8)
+            values = values >> np.uint64(8)
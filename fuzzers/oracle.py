@@ -0,0 +1,370 @@
+# Target liveness oracle.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Without an oracle, a hung target is only noticed when the HoldTimer
+# expires, 90 seconds by default. The oracle probes the target every
+# ``interval`` seconds instead:
+#
+#   keepalive  send a KEEPALIVE on the session; the target must answer with
+#              anything within ``timeout``. The stand-in peer echoes
+#              KEEPALIVEs; real speakers generally don't, so use this with
+#              a stand-in or a target instrumented to answer.
+#   tcp        open a side-channel TCP connection to the target's port.
+#
+# A session dropped by the target, or a connection attempt that fails, only
+# makes the target a suspect, since targets legitimately reset sessions in
+# response to malformed messages. A side-channel connection settles it: if
+# the port no longer accepts connections, the target crashed.
+#
+# Every input sent on the session is kept in a ring of the last ``history``
+# messages, and a failure is attributed to them. The fuzzer is then paused
+# (crash-capture mode), the inputs are written as a capture that
+# protos.capture.replay can resend, and probing continues until the target
+# comes back.
+
+from collections import deque
+from protos.capture import IN, OUT, Recorder
+import errno
+import json
+import logging
+import os
+import select
+import socket
+import time
+
+# Oracle modes
+FUZZING = "fuzzing"
+CAPTURE = "capture"
+
+# Failure kinds
+CRASH = "crash"
+HANG = "hang"
+
+
+class TcpProbe(object):
+    """
+    Non-blocking TCP connection check.
+
+    Polls the connecting socket through ``call_later``, so it runs on any
+    event loop. The socket is polled with poll(2), since select(2) can't
+    watch the descriptors above 1023 that sessions of a large campaign get.
+    """
+
+    def __init__(self, call_later, address, timeout, done, step=0.005):
+        """
+        Create a new TcpProbe.
+
+        :param call_later: schedules a call, as ``call_later(delay, fn)``
+        :param address: (host, port) to connect to
+        :param timeout: seconds to wait for the connection
+        :param done: called with whether the connection succeeded, and a
+            description of the result
+        :param step: polling interval, in seconds
+        """
+        self.call_later = call_later
+        self.address = address
+        self.timeout = timeout
+        self.done = done
+        self.step = step
+        self.sock = None
+        self.poller = None
+        self.deadline = None
+
+    def start(self):
+        self.deadline = time.monotonic() + self.timeout
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setblocking(False)
+        err = self.sock.connect_ex(self.address)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            return self._finish(False, os.strerror(err))
+        self.poller = select.poll()
+        self.poller.register(self.sock, select.POLLOUT)
+        self._poll()
+
+    def _poll(self):
+        # POLLERR and POLLHUP are always reported; SO_ERROR tells them apart
+        if self.poller.poll(0):
+            err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            return self._finish(not err, os.strerror(err) if err else "connected")
+        if time.monotonic() >= self.deadline:
+            return self._finish(False, "connection timed out")
+        self.call_later(self.step, self._poll)
+
+    def _finish(self, ok, result):
+        self.sock.close()
+        self.sock = None
+        self.poller = None
+        self.done(ok, result)
+
+
+class LivenessOracle(object):
+    """
+    Watches the target of a fuzzer session and detects failures quickly.
+
+    The oracle sees the session's traffic by standing in as its
+    ``recorder``, forwarding to any recorder already set.
+    """
+
+    def __init__(
+        self,
+        session,
+        interval=0.25,
+        timeout=1.0,
+        probe="keepalive",
+        history=16,
+        capture_dir=None,
+        resume=False,
+        on_failure=None,
+    ):
+        """
+        Create a new LivenessOracle.
+
+        :param session: fuzzer session to watch
+        :type session: fuzzers.bgp.BGPFuzzer
+        :param interval: seconds between probes
+        :param timeout: seconds the target has to answer a probe
+        :param probe: "keepalive" or "tcp"
+        :param history: number of recent inputs a failure is attributed to
+        :param capture_dir: directory to write crash captures to, if any
+        :param resume: resume fuzzing once the target is back
+        :param on_failure: called with the session and each finding
+        """
+        if probe not in ("keepalive", "tcp"):
+            raise ValueError("Unknown probe: {}".format(probe))
+        self.session = session
+        self.interval = interval
+        self.timeout = timeout
+        self.probe = probe
+        self.inputs = deque(maxlen=history)
+        self.capture_dir = capture_dir
+        self.resume = resume
+        self.on_failure = on_failure
+        self.mode = FUZZING
+        self.upstream = None
+        self.running = False
+        # monotonic time the target was last heard from, and the pending
+        # KEEPALIVE probe was sent
+        self.heard = time.monotonic()
+        self.probe_sent = None
+        # a side-channel check is in progress
+        self.checking = False
+        # (deadline, reason) while a dropped session is being checked
+        self.suspect = None
+        # (kind, monotonic time) of the last failure
+        self.failed = None
+        self.failures = 0
+        self.log = logging.getLogger("LivenessOracle")
+
+    # Control ------------------------------------------------------------------
+
+    def attach(self):
+        """Start watching the session."""
+        session = self.session
+        self.upstream = session.recorder
+        session.recorder = self
+        session.oracle = self
+        self.running = True
+        session.call_later(self.interval, self._tick)
+        return self
+
+    def detach(self):
+        """Stop watching the session."""
+        self.running = False
+        if self.session.recorder is self:
+            self.session.recorder = self.upstream
+        self.session.oracle = None
+
+    # Recorder interface -------------------------------------------------------
+
+    def record(self, direction, data, stamp=None):
+        if self.upstream is not None:
+            self.upstream.record(direction, data, stamp)
+        if direction == IN:
+            self.heard = time.monotonic()
+        else:
+            self.inputs.append((stamp or time.monotonic_ns(), bytes(data)))
+
+    def tap(self, direction, chunks):
+        for chunk in chunks:
+            self.record(direction, chunk)
+            yield chunk
+
+    def flush(self):
+        if self.upstream is not None:
+            self.upstream.flush()
+
+    def close(self):
+        if self.upstream is not None:
+            self.upstream.close()
+
+    # Detection ----------------------------------------------------------------
+
+    def lost(self, reason):
+        """
+        Note that the session was dropped or could not connect.
+
+        Called by the session. The target stays a suspect for ``timeout``
+        seconds, during which it is checked on a side channel every tick: a
+        dying process can keep its listening socket open for a while, e.g.
+        while it dumps core.
+        """
+        self.probe_sent = None
+        if self.running and self.mode == FUZZING:
+            self.suspect = (time.monotonic() + self.timeout, reason)
+            self._check(reason)
+
+    def _tick(self):
+        if not self.running:
+            return
+        session = self.session
+        now = time.monotonic()
+        if self.suspect is not None and now >= self.suspect[0]:
+            self.suspect = None
+        if self.mode == CAPTURE:
+            self._probe_recovery(now)
+        elif self.suspect is not None:
+            self._check(self.suspect[1])
+        elif self.probe == "tcp":
+            self._check(None)
+        elif session.state == "Established":
+            self._probe_keepalive(now)
+        session.call_later(self.interval, self._tick)
+
+    def _probe_keepalive(self, now):
+        if self.probe_sent is None or self.heard >= self.probe_sent:
+            self.probe_sent = now
+            self.session.send_probe()
+        elif now - self.probe_sent >= self.timeout:
+            self.probe_sent = None
+            self.fail(HANG, "no answer to probe in {:.3g}s".format(self.timeout))
+
+    def _probe_recovery(self, now):
+        if self.failed[0] == CRASH:
+            # back once it accepts connections again
+            self._check(None)
+        elif self.heard > self.failed[1]:
+            # a hung target accepts connections all along; it is back once
+            # it says something
+            self.recovered()
+        elif self.session.state == "Established":
+            self.session.send_probe()
+
+    def _check(self, reason):
+        if self.checking:
+            return
+        self.checking = True
+        session = self.session
+        address = (session.neighbor, session.port)
+
+        def done(ok, result):
+            self.checking = False
+            if not self.running:
+                return
+            if self.mode == CAPTURE:
+                if ok and self.failed[0] == CRASH:
+                    self.recovered()
+            elif not ok:
+                self.fail(CRASH, "{}; {}".format(reason, result) if reason else result)
+
+        try:
+            TcpProbe(session.call_later, address, self.timeout, done).start()
+        except OSError as e:
+            # out of descriptors or the like; says nothing about the target
+            self.checking = False
+            self.log.warning("[!] Probe failed to start: %s", e)
+
+    # Failures -----------------------------------------------------------------
+
+    def fail(self, kind, reason):
+        """
+        Record a target failure and switch to crash-capture mode.
+
+        :param kind: CRASH or HANG
+        :param reason: description of what was detected
+        :return: the finding
+        :rtype: dict
+        """
+        inputs = list(self.inputs)
+        now = time.monotonic_ns()
+        finding = {
+            "kind": kind,
+            "reason": reason,
+            "time": time.time(),
+            "detected_in": (now - inputs[-1][0]) / 1e9 if inputs else None,
+            "case": inputs[-1][1] if inputs else None,
+            "inputs": [data for _, data in inputs],
+        }
+        self.failures += 1
+        self.log.warning("[!] Target %s: %s", kind, reason)
+        if self.capture_dir is not None:
+            finding["files"] = self.capture(finding, inputs)
+        self.session.findings.append(finding)
+        self.mode = CAPTURE
+        self.failed = (kind, time.monotonic())
+        self.suspect = None
+        self.session.paused = True
+        if self.on_failure is not None:
+            self.on_failure(self.session, finding)
+        return finding
+
+    def capture(self, finding, inputs):
+        """
+        Write the inputs a failure is attributed to, the session trace and a
+        description of the failure.
+
+        :return: paths of the files written
+        :rtype: dict
+        """
+        os.makedirs(self.capture_dir, exist_ok=True)
+        prefix = os.path.join(
+            self.capture_dir,
+            "{}-{}-{}".format(finding["kind"], self.session.bgp_id, self.failures),
+        )
+        files = {"inputs": prefix + ".cap", "meta": prefix + ".json"}
+        with Recorder(files["inputs"]) as rec:
+            for stamp, data in inputs:
+                rec.record(OUT, data, stamp)
+        tracer = getattr(self.session, "tracer", None)
+        if tracer is not None:
+            files["trace"] = prefix + ".trace"
+            tracer.dump(files["trace"])
+        meta = {k: v for k, v in finding.items() if k not in ("case", "inputs")}
+        meta["inputs"] = len(inputs)
+        meta["files"] = files
+        with open(files["meta"], "w") as f:
+            json.dump(meta, f, indent=2)
+        return files
+
+    def recovered(self):
+        """Note that the target is reachable again after a failure."""
+        self.log.warning("[!] Target is back")
+        self.heard = time.monotonic()
+        self.inputs.clear()
+        if self.resume:
+            self.rearm()
+        else:
+            # stay paused until rearmed
+            self.running = False
+
+    def rearm(self):
+        """Resume fuzzing and probing after a failure."""
+        self.mode = FUZZING
+        self.probe_sent = None
+        self.session.paused = False
+        if not self.running:
+            self.running = True
+            self.session.call_later(self.interval, self._tick)
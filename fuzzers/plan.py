@@ -0,0 +1,66 @@
+# Fuzzspec compilation.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from fuzzers.attrs import ATTR_STRATEGIES
+from fuzzers.mutate import FIXED, PLAN_DTYPE, STRATEGIES
+import numpy as np
+
+
+def compile_spec(spec, fields):
+    """
+    Compile the fuzzspec of one message type into a flat mutation plan.
+
+    Every enabled field contributes one entry per strategy. Fields with a
+    value other than ``"default"`` also contribute a ``FIXED`` entry that
+    pins the field to that value in every variant. Attribute strategies
+    don't fit a fixed-length plan and are left to
+    :class:`fuzzers.attrs.AttrMutator`.
+
+    :param spec: fuzzspec entries for the message type, keyed by field name
+    :param fields: mapping of field name to (offset, size) in the message
+    :return: array of ``PLAN_DTYPE`` entries
+    :raises KeyError: if the spec names an unknown field or strategy
+    :raises ValueError: if a fixed value does not fit its field
+
+    :type spec: dict
+    :type fields: dict
+    :rtype: numpy.ndarray
+    """
+    entries = []
+    for name, fspec in spec.items():
+        offset, size = fields[name]
+        value = fspec.get("value", "default")
+        if value != "default":
+            entries.append((offset, size * 8, FIXED, _fixed_value(name, value, size)))
+        if fspec["fuzz"]:
+            for strategy in fspec["strategies"]:
+                if strategy in ATTR_STRATEGIES:
+                    continue
+                entries.append((offset, size * 8, STRATEGIES[strategy], 0))
+    return np.array(entries, dtype=PLAN_DTYPE)
+
+
+def _fixed_value(name, value, size):
+    if size > 8:
+        raise ValueError("{} is too wide to pin to a fixed value".format(name))
+    if isinstance(value, (bytes, bytearray)):
+        if len(value) != size:
+            raise ValueError("{} must be {} bytes".format(name, size))
+        value = int.from_bytes(value, "big")
+    if value < 0 or value >= 1 << (size * 8):
+        raise ValueError("{} does not fit in {} bytes".format(name, size))
+    return value
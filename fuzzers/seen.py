@@ -0,0 +1,156 @@
+# Seen-input filter.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Different mutation paths often produce the same bytes: a bitflip and an
+# increment of the same field land on the same value, and corpus entries are
+# mutated into what the base message already gave. Over a long campaign
+# every such duplicate is a wasted send.
+#
+# The filter is a Bloom filter over case digests, sized once from the
+# number of cases it should hold and the false-positive rate wanted there,
+# optionally capped to a memory budget. Memory never grows past that; once
+# more cases than its capacity have been added, the false-positive rate
+# rises, and with it the share of fresh cases wrongly dropped.
+#
+# Cases are checked a whole batch at a time. Each case is hashed once to
+# 128 bits, and its k bit positions are derived from the two halves by
+# double hashing, so that the probing runs in NumPy rather than per case.
+
+from collections import Counter
+from fuzzers.feedback import digest
+import math
+import numpy as np
+
+
+class SeenFilter(object):
+    """
+    Fixed-memory probabilistic set of the cases already sent.
+
+    A case the filter has seen is always reported as seen; one it hasn't is
+    reported as seen with a probability of about ``error`` while no more
+    than ``capacity`` cases have been added.
+    """
+
+    def __init__(self, capacity=10 ** 7, error=0.001, max_bytes=None):
+        """
+        Create a new SeenFilter.
+
+        :param capacity: number of cases the false-positive rate holds for
+        :param error: false-positive rate at capacity
+        :param max_bytes: memory budget for the bit array; if the size
+            derived from ``capacity`` and ``error`` exceeds it, the filter
+            is shrunk to fit and its rate at capacity rises accordingly
+
+        :type capacity: int
+        :type error: float
+        :type max_bytes: int
+        """
+        if capacity < 1:
+            raise ValueError("Capacity must be positive")
+        if not 0 < error < 1:
+            raise ValueError("False-positive rate must be between 0 and 1")
+        size = math.ceil(-capacity * math.log(error) / math.log(2) ** 2)
+        if max_bytes is not None:
+            size = min(size, max_bytes * 8)
+        self.size = max(size, 64)
+        self.capacity = capacity
+        self.error = error
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, np.uint8)
+        self._probes = np.arange(self.hashes, dtype=np.uint64)
+        # cases added
+        self.count = 0
+        self.stats = Counter()
+
+    def __len__(self):
+        return self.count
+
+    def fresh(self, batch):
+        """
+        Find the cases of a batch not seen before, and add them.
+
+        Of cases repeated within the batch, only the first is fresh.
+
+        :param batch: serialized cases, or a 2-D ``uint8`` array with one
+            case per row
+        :return: indexes of the fresh cases, in batch order
+        :rtype: numpy.ndarray
+        """
+        n = len(batch)
+        if not n:
+            return np.zeros(0, np.intp)
+        digests = np.frombuffer(b"".join(digest(case) for case in batch), np.uint64)
+        digests = digests.reshape(n, 2)
+        _, first = np.unique(
+            digests.view(np.dtype((np.void, 16))).ravel(), return_index=True
+        )
+        first.sort()
+        h1, h2 = digests[first, 0], digests[first, 1]
+        # uint64 arithmetic wraps, which is what double hashing wants
+        pos = (h1[:, None] + self._probes * h2[:, None]) % np.uint64(self.size)
+        byte = pos >> np.uint64(3)
+        mask = np.left_shift(np.uint64(1), pos & np.uint64(7)).astype(np.uint8)
+        new = ~np.all(self.bits[byte] & mask, axis=1)
+        np.bitwise_or.at(self.bits, byte[new].ravel(), mask[new].ravel())
+        fresh = first[new]
+        self.count += len(fresh)
+        self.stats["misses"] += len(fresh)
+        self.stats["hits"] += n - len(fresh)
+        return fresh
+
+    def filter(self, batch):
+        """
+        Drop the cases of a batch seen before, and add the rest.
+
+        :param batch: list of serialized cases, or a 2-D ``uint8`` array
+        :return: the fresh cases, as the same kind of batch
+        """
+        keep = self.fresh(batch)
+        if isinstance(batch, np.ndarray):
+            return batch[keep]
+        return [batch[j] for j in keep]
+
+    def false_positive_rate(self):
+        """
+        Estimate the current false-positive rate, from the number of cases
+        added.
+
+        :rtype: float
+        """
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    def clear(self):
+        self.bits[:] = 0
+        self.count = 0
+
+    def report(self):
+        """
+        Summarize the filter's size, fill and hit statistics.
+
+        :rtype: dict
+        """
+        checked = self.stats["hits"] + self.stats["misses"]
+        return {
+            "bytes": self.bits.nbytes,
+            "hashes": self.hashes,
+            "capacity": self.capacity,
+            "count": self.count,
+            "hits": self.stats["hits"],
+            "misses": self.stats["misses"],
+            "hit_rate": self.stats["hits"] / checked if checked else 0.0,
+            "false_positive_rate": self.false_positive_rate(),
+        }
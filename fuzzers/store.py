@@ -0,0 +1,286 @@
+# On-disk fuzz corpus.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# A store is three files sharing a path prefix:
+#
+#   <path>         append-only data; each message prefixed by its length as a
+#                  little-endian u32
+#   <path>.idx     one fixed-size INDEX_DTYPE record per message, holding its
+#                  data offset and metadata columns
+#   <path>.fields  names of mutated fields, one per line; the index refers to
+#                  them by line number, starting from 1
+#
+# Both the data and the index are read through mmap, so any number of worker
+# processes can open the same store read-only without copying it.
+
+from fuzzers.feedback import Reaction, ACCEPTED, NOTIFICATION, DROP, SILENCE
+import mmap
+import numpy as np
+import os
+import struct
+
+LENGTH = struct.Struct("<I")
+
+INDEX_DTYPE = np.dtype(
+    [
+        ("offset", "<u8"),
+        ("length", "<u4"),
+        ("msgtype", "u1"),
+        ("reaction", "u1"),
+        ("error_code", "u1"),
+        ("error_subcode", "u1"),
+        ("field", "<u2"),
+    ]
+)
+
+# Message type codes for the message names used by BGP.send_bgp_msg
+MSGTYPES = {"OPEN": 1, "UPDATE": 2, "NOTIFICATION": 3, "KEEPALIVE": 4}
+
+# Reaction kind codes; 0 means no reaction was recorded
+REACTIONS = [None, ACCEPTED, NOTIFICATION, DROP, SILENCE]
+
+
+class CorpusStore(object):
+    """
+    Append-only store of BGP messages with an index of metadata columns.
+
+    Messages are returned as memoryviews into the mapped data file; copy them
+    with ``bytes()`` if they need to outlive the store.
+    """
+
+    def __init__(self, path, readonly=False):
+        """
+        Open a store, creating it if it doesn't exist.
+
+        :param path: path of the data file; the index and field names are
+            kept next to it
+        :param readonly: open without write access
+        """
+        self.path = path
+        self.readonly = readonly
+        mode = "rb" if readonly else "a+b"
+        self.data = open(path, mode)
+        self.index = open(path + ".idx", mode)
+        self.fields = [None]
+        if os.path.exists(path + ".fields"):
+            with open(path + ".fields") as f:
+                self.fields += f.read().splitlines()
+        self.fieldids = {name: i for i, name in enumerate(self.fields) if i}
+        self._data_map = None
+        self._index_map = None
+        self._columns = None
+        self._size = os.fstat(self.data.fileno()).st_size
+        self._count = os.fstat(self.index.fileno()).st_size // INDEX_DTYPE.itemsize
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        columns = self.columns
+        if i < 0:
+            i += len(columns)
+        offset = int(columns["offset"][i])
+        return self._data()[offset : offset + int(columns["length"][i])]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, msg, msgtype=None, field=None, reaction=None):
+        """
+        Append a message.
+
+        :param msg: serialized message
+        :param msgtype: message type code or name; defaults to the type in the
+            message header
+        :param field: name of the field that was mutated
+        :param reaction: reaction the message drew
+        :type reaction: fuzzers.feedback.Reaction
+        :return: index of the new message
+        :rtype: int
+        """
+        if self.readonly:
+            raise IOError("Corpus store is open read-only")
+        if msgtype is None:
+            msgtype = msg[18] if len(msg) > 18 else 0
+        record = np.zeros(1, INDEX_DTYPE)
+        record["offset"] = self._size + LENGTH.size
+        record["length"] = len(msg)
+        record["msgtype"] = MSGTYPES.get(msgtype, msgtype)
+        record["field"] = self._fieldid(field)
+        if reaction is not None:
+            record["reaction"] = REACTIONS.index(reaction.kind)
+            record["error_code"] = reaction.error_code or 0
+            record["error_subcode"] = reaction.error_subcode or 0
+
+        self.data.write(LENGTH.pack(len(msg)))
+        self.data.write(msg)
+        self.index.write(record.tobytes())
+        self._size += LENGTH.size + len(msg)
+        self._count += 1
+        self._columns = None
+        return self._count - 1
+
+    def extend(self, msgs, **metadata):
+        """Append several messages with the same metadata."""
+        for msg in msgs:
+            self.append(msg, **metadata)
+
+    def flush(self):
+        if not self.readonly:
+            self.data.flush()
+            self.index.flush()
+
+    def close(self):
+        self.flush()
+        self._columns = None
+        for m in (self._data_map, self._index_map):
+            if m is not None:
+                try:
+                    m.close()
+                except BufferError:
+                    pass
+        self._data_map = self._index_map = None
+        self.data.close()
+        self.index.close()
+
+    @property
+    def columns(self):
+        """
+        The index, as a structured array over the mapped index file.
+
+        :rtype: numpy.ndarray of INDEX_DTYPE
+        """
+        if self._columns is None:
+            self.flush()
+            size = self._count * INDEX_DTYPE.itemsize
+            if not size:
+                return np.zeros(0, INDEX_DTYPE)
+            self._index_map = self._remap(self._index_map, self.index, size)
+            self._columns = np.frombuffer(
+                self._index_map, INDEX_DTYPE, count=self._count
+            )
+        return self._columns
+
+    def reaction(self, i):
+        """
+        Get the reaction recorded for a message.
+
+        :rtype: fuzzers.feedback.Reaction
+        """
+        record = self.columns[i]
+        kind = REACTIONS[record["reaction"]]
+        if kind is None:
+            return None
+        if kind != NOTIFICATION:
+            return Reaction(kind)
+        return Reaction(kind, int(record["error_code"]), int(record["error_subcode"]))
+
+    def field(self, i):
+        """Get the name of the field mutated in a message, if recorded."""
+        return self.fields[self.columns["field"][i]]
+
+    def select(self, msgtype=None, field=None, reaction=None):
+        """
+        Find messages by metadata.
+
+        :param msgtype: message type code or name
+        :param field: name of the mutated field
+        :param reaction: reaction kind, or a Reaction to also match its codes
+        :return: indexes of matching messages
+        :rtype: numpy.ndarray
+        """
+        columns = self.columns
+        mask = np.ones(len(columns), bool)
+        if msgtype is not None:
+            mask &= columns["msgtype"] == MSGTYPES.get(msgtype, msgtype)
+        if field is not None:
+            mask &= columns["field"] == self.fieldids.get(field, -1)
+        if isinstance(reaction, Reaction):
+            mask &= columns["reaction"] == REACTIONS.index(reaction.kind)
+            if reaction.kind == NOTIFICATION:
+                mask &= columns["error_code"] == (reaction.error_code or 0)
+                mask &= columns["error_subcode"] == (reaction.error_subcode or 0)
+        elif reaction is not None:
+            mask &= columns["reaction"] == REACTIONS.index(reaction)
+        return np.flatnonzero(mask)
+
+    def messages(self, indexes=None):
+        """
+        Generate stored messages.
+
+        :param indexes: indexes of the messages, or None for all of them
+        :return: generator of bytes
+        """
+        data = self._data()
+        columns = self.columns
+        if indexes is None:
+            indexes = range(len(columns))
+        offsets = columns["offset"]
+        lengths = columns["length"]
+        for i in indexes:
+            offset = int(offsets[i])
+            yield bytes(data[offset : offset + int(lengths[i])])
+
+    def replay(self, session, indexes=None, done=None):
+        """
+        Stream stored messages to a session's peer.
+
+        Messages are written as fast as the transport drains them.
+
+        :param session: connected protocol instance
+        :param indexes: indexes of the messages, or None for all of them
+        :param done: called with the number of messages sent when finished
+        :rtype: protos.updates.UpdateProducer
+        """
+        return session.send_messages(self.messages(indexes), done=done)
+
+    def _fieldid(self, field):
+        if field is None:
+            return 0
+        fieldid = self.fieldids.get(field)
+        if fieldid is None:
+            fieldid = len(self.fields)
+            self.fields.append(field)
+            self.fieldids[field] = fieldid
+            with open(self.path + ".fields", "a") as f:
+                f.write(field + "\n")
+        return fieldid
+
+    def _data(self):
+        self.flush()
+        if not self._size:
+            return memoryview(b"")
+        self._data_map = self._remap(self._data_map, self.data, self._size)
+        return memoryview(self._data_map)
+
+    def _remap(self, current, f, size):
+        if current is not None and len(current) >= size:
+            return current
+        if current is not None:
+            try:
+                current.close()
+            except BufferError:
+                # still referenced by a view handed out earlier
+                pass
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
@@ -17,11 +17,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import code
 import pprint
 import protos as ps
 import fuzzers as fz
-from protos import *
-from fuzzers import *
 import logging
 
 version = "0.0.1"
@@ -60,6 +59,23 @@ def protocols():
 basics = [fuzzers, protocols]
 
 
+class Namespace(dict):
+    """
+    Console namespace that binds protocol and fuzzer exports on first use.
+
+    Names of the protos and fuzzers registries are resolved through the
+    packages' lazy ``__getattr__`` the first time they are looked up, so the
+    prompt comes up before Scapy, Twisted and NumPy are imported.
+    """
+
+    def __missing__(self, name):
+        for pkg in (ps, fz):
+            if name in pkg.registry:
+                value = self[name] = getattr(pkg, name)
+                return value
+        raise KeyError(name)
+
+
 if __name__ == "__main__":
     logging.basicConfig(
         format="%(asctime)s %(levelname)-4s %(message)s",
@@ -72,3 +88,16 @@ if __name__ == "__main__":
     print("\nBasic commands:")
     for fn in basics:
         print("- {}(): {}".format(fn.__name__, fn.__doc__))
+
+    # Protocols and fuzzers load on first use; the namespace only knows their
+    # names until then.
+    namespace = Namespace(globals())
+    try:
+        import readline
+        import rlcompleter
+
+        readline.set_completer(rlcompleter.Completer(namespace).complete)
+        readline.parse_and_bind("tab: complete")
+    except ImportError:
+        pass
+    code.interact(banner="", local=namespace, exitmsg="")
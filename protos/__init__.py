@@ -14,9 +14,40 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Exports are imported on first access, so that importing the package does
+# not pull in Scapy, Twisted and friends until a protocol is actually used.
+
+import importlib
+
+registry = {
+    "BGP": "protos.bgp",
+    "AsyncioBGP": "protos.aio",
+    "SessionManager": "protos.manager",
+    "Tracer": "protos.trace",
+    "Exporter": "protos.metrics",
+    "ConnectionPool": "protos.pool",
+}
+"""Module defining each export"""
+
+protocols = ["BGP"]
+
+__all__ = protocols + [
+    "AsyncioBGP",
+    "SessionManager",
+    "Tracer",
+    "Exporter",
+    "ConnectionPool",
+]
+
 
-from protos.bgp import BGP
+def __getattr__(name):
+    if name not in registry:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module(registry[name]), name)
+    globals()[name] = value
+    return value
 
-protocols = [BGP.__name__]
 
-__all__ = protocols + []
+def __dir__():
+    return sorted(set(globals()) | set(registry))
@@ -0,0 +1,196 @@
+# asyncio backend for neph protocols.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from twisted.python.failure import Failure
+from protos.bgp import BGP
+from protos.protocol import NephTimer
+from protos.wheel import TimerWheel
+import asyncio
+import socket
+import weakref
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+def new_event_loop(use_uvloop=None):
+    """
+    Create an event loop for asyncio sessions.
+
+    :param use_uvloop: True to require uvloop, False to use the default asyncio
+        loop, None to use uvloop if it is installed
+    :rtype: asyncio.AbstractEventLoop
+    """
+    if use_uvloop and uvloop is None:
+        raise ImportError("uvloop is not installed")
+    if uvloop is not None and use_uvloop is not False:
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+# event loop -> TimerWheel
+_wheels = weakref.WeakKeyDictionary()
+
+
+def loop_wheel(loop):
+    """The wheel shared by all timers on an event loop."""
+    wheel = _wheels.get(loop)
+    if wheel is None:
+        wheel = _wheels[loop] = TimerWheel(loop.call_later, clock=loop.time)
+    return wheel
+
+
+class AsyncioTransport(asyncio.Protocol):
+    """
+    Mixin that drives a neph protocol from an asyncio event loop.
+
+    Place it before the protocol class in the bases of a new class, e.g.::
+
+        class AsyncioBGP(AsyncioTransport, BGP):
+            pass
+
+    The protocol's Twisted callbacks and FSM handlers are reused unchanged;
+    this mixin translates asyncio's transport and protocol interfaces into
+    Twisted's.
+    """
+
+    def __init__(self, *args, loop=None, **kwargs):
+        self.loop = loop or asyncio.get_event_loop_policy().get_event_loop()
+        super().__init__(*args, **kwargs)
+
+    def connect(self):
+        if self.pool is not None and self.pool.hand_to(self):
+            return
+        bind = (self.bind, 0) if self.bind else None
+        coro = self.loop.create_connection(
+            lambda: self, self.neighbor, self.port, local_addr=bind
+        )
+        self.loop.create_task(coro).add_done_callback(self._connect_done)
+
+    def _connect_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self._connect_failed(Failure(task.exception()))
+
+    def make_timer(self, time, name, handler):
+        return NephTimer(time, name, handler, wheel=loop_wheel(self.loop))
+
+    def call_later(self, delay, fn, *args):
+        return self.loop.call_later(delay, fn, *args)
+
+    def run(self):
+        self._event("ManualStart")
+        self.loop.run_forever()
+        self._event("ManualStop")
+
+    # asyncio ------------------------------------------------------------------
+
+    def connection_made(self, transport):
+        self.transport = TransportAdapter(transport, self.loop)
+        self.connectionMade()
+
+    def data_received(self, data):
+        self.dataReceived(data)
+
+    def pause_writing(self):
+        self.transport.pause()
+
+    def resume_writing(self):
+        self.transport.resume()
+
+    def connection_lost(self, exc):
+        self.transport.stop()
+        self.connectionLost(Failure(exc) if exc else None)
+
+
+class TransportAdapter(object):
+    """
+    Presents an asyncio transport through the Twisted ITransport calls.
+
+    Producers are supported as in Twisted: pull producers are asked for more
+    data on each loop iteration while the transport isn't over its high water
+    mark, and push producers are paused and resumed with the transport.
+    """
+
+    def __init__(self, transport, loop):
+        self.transport = transport
+        self.loop = loop
+        self.write = transport.write
+        self.writeSequence = transport.writelines
+        self.producer = None
+        self.streaming = False
+        self.paused = False
+
+    def registerProducer(self, producer, streaming):
+        if self.producer is not None:
+            raise RuntimeError("A producer is already registered")
+        self.producer = producer
+        self.streaming = streaming
+        if not streaming:
+            self.loop.call_soon(self._pull)
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def _pull(self):
+        if self.producer is None or self.paused:
+            return
+        self.producer.resumeProducing()
+        if self.producer is not None and not self.paused:
+            self.loop.call_soon(self._pull)
+
+    def pause(self):
+        self.paused = True
+        if self.producer is not None and self.streaming:
+            self.producer.pauseProducing()
+
+    def resume(self):
+        self.paused = False
+        if self.producer is None:
+            return
+        if self.streaming:
+            self.producer.resumeProducing()
+        else:
+            self._pull()
+
+    def stop(self):
+        producer, self.producer = self.producer, None
+        if producer is not None:
+            producer.stopProducing()
+
+    def loseConnection(self):
+        self.transport.close()
+
+    def abortConnection(self):
+        self.transport.abort()
+
+    def setTcpNoDelay(self, enabled):
+        sock = self.transport.get_extra_info("socket")
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(enabled))
+
+    def getPeer(self):
+        return self.transport.get_extra_info("peername")
+
+    def getHost(self):
+        return self.transport.get_extra_info("sockname")
+
+
+class AsyncioBGP(AsyncioTransport, BGP):
+    """BGP protocol implementation driven by asyncio."""
+
+    pass
@@ -15,19 +15,31 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from io import BytesIO
-from socket import socket
-from scapy.config import conf
-from scapy.all import *
-from scapy.contrib.bgp import *
-from scapy.automaton import *
-from transitions import Machine
+from socket import socket, inet_aton
+from scapy.contrib.bgp import (
+    BGPHeader,
+    BGPKeepAlive,
+    BGPNotification,
+    BGPOpen,
+    BGPUpdate,
+)
 from twisted.internet import reactor, task
 from twisted.internet.protocol import Protocol
 from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
 from functools import partial
 from protos.protocol import *
+from protos.framing import Framer
+from protos import codec
+from protos.templates import Template, TemplateCache
+from protos.updates import UpdateProducer, pack_updates
+from protos.capture import IN, OUT
+from protos.wheel import reactor_wheel
+from protos.writer import SegmentWriter, WriteBuffer
+from protos import metrics, trace
 import logging
+import math
+import time
+import weakref
 
 
 class BGP(Protocol, NephProtocol):
@@ -58,21 +70,68 @@ class BGP(Protocol, NephProtocol):
     HEADER_SIZE = 19
     MARKER_SIZE = 16
     MARKER = b"\xff" * 16
-    MESSAGE_TYPES = {
-        0: "NONE",
-        1: "OPEN",
-        2: "UPDATE",
-        3: "NOTIFICATION",
-        4: "KEEPALIVE",
-        5: "ROUTE-REFRESH",
-    }
+    MESSAGE_TYPES = codec.MESSAGE_NAMES
+
+    # FSM event for a malformed message of each type
+    MESSAGE_ERRORS = {codec.OPEN: "BGPOpenMsgErr", codec.UPDATE: "UpdateMsgErr"}
 
     # FSM states
     states = ["Idle", "Connect", "Active", "OpenSent", "OpenConfirm", "Established"]
+    IDLE, CONNECT, ACTIVE, OPENSENT, OPENCONFIRM, ESTABLISHED = range(len(states))
+
+    # FSM actions, as (states, event, action name). Events without an action
+    # in the current state are ignored; the table is compiled into
+    # ``dispatch``, keyed by (state id, event), which all sessions share.
+    actions = [
+        # 8.1.2.  Administrative Events
+        (["Idle"], "ManualStart", "on_ManualStart"),
+        (["Idle", "Active"], "ManualStop", "on_ManualStop"),
+        (["Connect"], "ManualStop", "on_ManualStop_Connect"),
+        (
+            ["OpenSent", "OpenConfirm", "Established"],
+            "ManualStop",
+            "on_ManualStop_Open",
+        ),
+        # 8.1.3.  Timer Events
+        (["Idle"], "ConnectRetryTimer_Expires", "on_ConnectRetryTimer_Expires"),
+        (
+            ["OpenSent", "OpenConfirm", "Established"],
+            "HoldTimer_Expires",
+            "on_HoldTimer_Expires",
+        ),
+        (["Established"], "KeepaliveTimer_Expires", "on_KeepaliveTimer_Expires"),
+        # 8.1.4.  TCP Connection-Based Events
+        (["Connect"], "Tcp_CR_Acked", "on_TcpConnectionConfirmed"),
+        (["Connect"], "TcpConnectionConfirmed", "on_TcpConnectionConfirmed"),
+        (
+            ["Idle", "Active", "Established"],
+            "TcpConnectionFails",
+            "on_TcpConnectionFails",
+        ),
+        (
+            ["Connect", "OpenSent", "OpenConfirm"],
+            "TcpConnectionFails",
+            "on_TcpConnectionFails_Connecting",
+        ),
+        # 8.1.5.  BGP Message-Based Events
+        (["OpenSent"], "BGPOpen", "on_BGPOpen"),
+        ([], "BGPHeaderErr", None),
+        ([], "BGPOpenMsgErr", None),
+        ([], "NotifMsgVerErr", None),
+        (["Established"], "NotifMsg", "on_NotifMsg"),
+        (["OpenSent"], "NotifMsg", "on_NotifMsg_OpenSent"),
+        (["OpenConfirm"], "KeepAliveMsg", "on_KeepAliveMsg_OpenConfirm"),
+        (["Established"], "KeepAliveMsg", "on_KeepAliveMsg"),
+        (["Established"], "UpdateMsg", "on_UpdateMsg"),
+        ([], "UpdateMsgErr", None),
+    ]
+
+    # Serialized message templates, shared by all sessions
+    templates = TemplateCache()
 
     # Public methods -----------------------------------------------------------
 
-    def __init__(self, neighbor, my_as, bgp_id, attrs=None):
+    def __init__(self, neighbor, my_as, bgp_id, attrs=None, port=179, bind=None):
         """
         Create a new BGP.
 
@@ -80,41 +139,21 @@ class BGP(Protocol, NephProtocol):
         :param my_as: local autonomous system number
         :param bgp_id: bgp identifier
         :param attrs: session attributes, see :rfc:`4271`
+        :param port: tcp port of bgp peer
+        :param bind: local ipv4 address to connect from
 
         :type neighbor: str
         :type my_as: int
         :type bgp_id: str
         :type timers: dict
+        :type port: int
+        :type bind: str
         """
-        self.fsm = Machine(model=self, states=BGP.states, initial="Idle")
-        logging.getLogger("transitions").setLevel(level=logging.INFO)
+        self.stateid = BGP.IDLE
 
         self.log = logging.getLogger("BGP")
         self.log.setLevel(level=logging.INFO)
 
-        self.events = {
-            # 8.1.2.  Administrative Events
-            "ManualStart": self.on_ManualStart,
-            "ManualStop": self.on_ManualStop,
-            # 8.1.3.  Timer Events
-            "ConnectRetryTimer_Expires": self.on_ConnectRetryTimer_Expires,
-            "HoldTimer_Expires": self.on_HoldTimer_Expires,
-            "KeepaliveTimer_Expires": self.on_KeepaliveTimer_Expires,
-            # 8.1.4.  TCP Connection-Based Events
-            "Tcp_CR_Acked": self.on_Tcp_CR_Acked,
-            "TcpConnectionConfirmed": self.on_TcpConnectionConfirmed,
-            "TcpConnectionFails": self.on_TcpConnectionFails,
-            # 8.1.5.  BGP Message-Based Events
-            "BGPOpen": self.on_BGPOpen,
-            "BGPHeaderErr": self.on_BGPHeaderErr,
-            "BGPOpenMsgErr": self.on_BGPOpenMsgErr,
-            "NotifMsgVerErr": self.on_NotifMsgVerErr,
-            "NotifMsg": self.on_NotifMsg,
-            "KeepAliveMsg": self.on_KeepAliveMsg,
-            "UpdateMsg": self.on_UpdateMsg,
-            "UpdateMsgErr": self.on_UpdateMsgErr,
-        }
-
         self.msgbuilders = {
             "OPEN": self.make_OPEN,
             "KEEPALIVE": self.make_KEEPALIVE,
@@ -122,6 +161,13 @@ class BGP(Protocol, NephProtocol):
             "NOTIFICATION": self.make_NOTIFICATION,
         }
 
+        self.msgrenderers = {
+            "OPEN": self.render_OPEN,
+            "KEEPALIVE": self.render_KEEPALIVE,
+            "NOTIFICATION": self.render_NOTIFICATION,
+            "UPDATE": self.render_UPDATE,
+        }
+
         self.sattrs = {"ConnectRetryCounter": 0}
 
         kat = self.defaults["KeepaliveTime"]
@@ -132,254 +178,429 @@ class BGP(Protocol, NephProtocol):
         hltex = partial(self._event, "HoldTimer_Expires")
 
         self.sattrs["timers"] = {
-            "KeepaliveTimer": NephTimer(kat, "KeepaliveTimer", katex),
-            "ConnectRetryTimer": NephTimer(crt, "ConnectRetryTimer", crtex),
-            "HoldTimer": NephTimer(hlt, "HoldTimer", hltex),
+            "KeepaliveTimer": self.make_timer(kat, "KeepaliveTimer", katex),
+            "ConnectRetryTimer": self.make_timer(crt, "ConnectRetryTimer", crtex),
+            "HoldTimer": self.make_timer(hlt, "HoldTimer", hltex),
         }
 
         self.neighbor = neighbor
         self.my_as = int(my_as)
         self.bgp_id = bgp_id
+        self.port = port
+        self.bind = bind
+
+        # Called with this session after every state change
+        self.observer = None
+
+        # Whether the session is administratively started
+        self.running = False
+
+        # protos.capture.Recorder for the byte streams, if capturing
+        self.recorder = None
+
+        # protos.writer.WriteBuffer holding back writes while corked
+        self.outbuf = None
+
+        # Fast session setup; see fast_setup()
+        self.fast = False
+        self.pool = None
+        self.handshake = None
+        # whether a KEEPALIVE went out with the OPEN on this connection
+        self.pipelined = False
+        # connection attempts in a row that failed, or were lost before
+        # reaching Established
+        self.failed_connects = 0
+
+        # protos.trace.Tracer recording this session's events
+        self.tracer = None
+        self.trace_to(trace.tracer())
+
+        # Counters and histograms, also exported through protos.metrics
+        self.metrics = metrics.SessionMetrics(
+            BGP.states, {"session": str(bgp_id), "peer": "{}:{}".format(neighbor, port)}
+        )
+        self.metrics.refresh = self._refresh_metrics
+        metrics.registry().add(self.metrics)
 
         # Twisted
-        self.point = TCP4ClientEndpoint(reactor, neighbor, 179)
-        self.inbuf = BytesIO()
+        self.point = None
+        self.inbuf = Framer(
+            BGP.HEADER_SIZE,
+            BGP.MARKER_SIZE,
+            max_size=BGP.MAXIMUM_MESSAGE_SIZE,
+            marker=BGP.MARKER,
+        )
 
     def run(self):
         self._event("ManualStart")
         reactor.run()
         self._event("ManualStop")
 
-    # FSM event handlers -------------------------------------------------------
+    def trace_to(self, tracer):
+        """
+        Record this session's events in a tracer.
+
+        Per-message events are recorded there instead of being logged; see
+        :mod:`protos.trace` for decoding them.
+
+        :type tracer: protos.trace.Tracer
+        """
+        if self.tracer is not None:
+            self.untrace()
+        self.tracer = tracer
+        label = "{}:{}".format(self.neighbor, self.port)
+        self.traceid = tracer.session(label, BGP.states)
+        # give the id back once this session is garbage collected
+        self.untrace = weakref.finalize(self, tracer.release, self.traceid)
+
+    def fast_setup(self, enabled=True, pool=None):
+        """
+        Bring sessions up as fast as the peer allows.
+
+        In fast mode the OPEN and KEEPALIVE are sent back to back as soon as
+        the connection is made, from bytes rendered once, instead of waiting
+        for the peer's OPEN before sending the KEEPALIVE. This relies on the
+        peer processing messages in order, as RFC 4271 speakers do. A lost
+        session reconnects right away rather than after ConnectRetryTime;
+        only connection attempts that keep failing back off, up to
+        ConnectRetryTime. A connection lost before Established counts as a
+        failed attempt, so a peer that accepts and then resets connections
+        isn't redialed in a tight loop.
+
+        The handshake is never fuzzed in this mode; fuzz OPENs with it off.
+
+        :param enabled: whether to use fast mode
+        :param pool: connections to take instead of dialing the peer
+        :type pool: protos.pool.ConnectionPool
+        """
+        self.fast = enabled
+        self.pool = pool
+        self.handshake = None
+        if pool is not None:
+            pool.fill()
+
+    def _refresh_metrics(self):
+        self.metrics.gauges["connect_retry_counter"] = self.sattrs[
+            "ConnectRetryCounter"
+        ]
+
+    # Event loop hooks ---------------------------------------------------------
+
+    def connect(self):
+        """Initiate a TCP connection to the peer."""
+        if self.pool is not None and self.pool.hand_to(self):
+            return
+        if self.point is None:
+            bind = (self.bind, 0) if self.bind else None
+            self.point = TCP4ClientEndpoint(
+                reactor, self.neighbor, self.port, bindAddress=bind
+            )
+        connectProtocol(self.point, self).addErrback(self._connect_failed)
+
+    def make_timer(self, time, name, handler):
+        """Create a session timer."""
+        return NephTimer(time, name, handler, wheel=reactor_wheel())
+
+    def call_later(self, delay, fn, *args):
+        """Schedule a call on the event loop driving this session."""
+        return reactor.callLater(delay, fn, *args)
+
+    # FSM ----------------------------------------------------------------------
 
     def _event(self, event, *args):
-        self.log.info("[+] Event '{}' in state '{}'".format(event, self.state))
-        self.events[event](*args)
+        tracer = self.tracer
+        tracer.record(self.traceid, tracer.intern(event), self.stateid)
+        action = self.dispatch.get((self.stateid, event))
+        if action is not None:
+            action(self, *args)
+        elif event not in self.eventnames:
+            raise KeyError(event)
+
+    @classmethod
+    def compile_fsm(cls):
+        """
+        Build the dispatch table of this class from :attr:`actions`.
+
+        Actions are looked up on the class, so subclasses can override them
+        by name. This runs automatically when a subclass is defined; call it
+        again after replacing an action on an existing class.
+        """
+        cls.dispatch = {}
+        cls.eventnames = set()
+        for states, event, action in cls.actions:
+            cls.eventnames.add(event)
+            for state in states:
+                cls.dispatch[(cls.states.index(state), event)] = getattr(cls, action)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.compile_fsm()
+
+    @property
+    def state(self):
+        """Name of the current FSM state."""
+        return BGP.states[self.stateid]
+
+    def _set_state(self, stateid):
+        m = self.metrics
+        m.transitions[self.stateid, stateid] += 1
+        if stateid == BGP.ESTABLISHED and m.open_sent is not None:
+            m.handshake.record(time.monotonic() - m.open_sent)
+            m.open_sent = None
+        self.stateid = stateid
+        self._state_changed()
+
+    def _state_changed(self):
+        if self.observer:
+            self.observer(self)
+
+    def to_Idle(self):
+        self._set_state(BGP.IDLE)
+
+    def to_Connect(self):
+        self._set_state(BGP.CONNECT)
+
+    def to_Active(self):
+        self._set_state(BGP.ACTIVE)
+
+    def to_OpenSent(self):
+        self._set_state(BGP.OPENSENT)
+
+    def to_OpenConfirm(self):
+        self._set_state(BGP.OPENCONFIRM)
+
+    def to_Established(self):
+        self.failed_connects = 0
+        self._set_state(BGP.ESTABLISHED)
+
+    # FSM actions --------------------------------------------------------------
 
     def on_ManualStart(self):
-        if self.state == "Idle":
-            # In response to a ManualStart event (Event 1) or an AutomaticStart
-            # event (Event 3), the local system:
-            #
-            # - initializes all BGP resources for the peer connection,
-            # - sets ConnectRetryCounter to zero,
-            self.sattrs["ConnectRetryCounter"] = 0
-            # - starts the ConnectRetryTimer with the initial value,
-            # self.sattrs['timers']['ConnectRetryTimer'].start()
-            # - initiates a TCP connection to the other BGP peer,
-            connectProtocol(self.point, self)
-            # - listens for a connection that may be initiated by the remote
-            #   BGP peer, and
-            # FIXME
-            # - changes its state to Connect.
-            self.to_Connect()
+        # In response to a ManualStart event (Event 1) or an AutomaticStart
+        # event (Event 3), the local system:
+        #
+        # - initializes all BGP resources for the peer connection,
+        # - sets ConnectRetryCounter to zero,
+        self.sattrs["ConnectRetryCounter"] = 0
+        self.running = True
+        # - starts the ConnectRetryTimer with the initial value,
+        # self.sattrs['timers']['ConnectRetryTimer'].start()
+        # - initiates a TCP connection to the other BGP peer,
+        self.connect()
+        # - listens for a connection that may be initiated by the remote
+        #   BGP peer, and
+        # FIXME
+        # - changes its state to Connect.
+        self.to_Connect()
 
     def on_ManualStop(self):
-        if self.state == "Connect":
-            # In response to a ManualStop event (Event 2), the local system:
-            # - drops the TCP connection,
-            if self.transport:
-                self.transport.loseConnection()
-            # - releases all BGP resources,
-            # - sets ConnectRetryCounter to zero,
-            self.sattrs["ConnectRetryCounter"] = 0
-            # - stops the ConnectRetryTimer and sets ConnectRetryTimer to zero,
-            self.sattrs["timers"]["ConnectRetryTimer"].stop()
-            # - changes its state to Idle.
-            self.to_Idle()
-        elif self.state in ["OpenSent", "OpenConfirm"]:
-            # If a ManualStop event (Event 2) is issued in the OpenSent state,
-            # the local system:
-            # - sends the NOTIFICATION with a Cease,
-            self.send_bgp_msg("NOTIFICATION", error_code=0x06)
-            # - sets the ConnectRetryTimer to zero,
-            self.sattrs["timers"]["ConnectRetryTimer"].stop()
-            # - releases all BGP resources,
-            # - drops the TCP connection,
-            self.transport.loseConnection()
-            # - sets the ConnectRetryCounter to zero, and
-            self.sattrs["ConnectRetryCounter"] = 0
-            # - changes its state to Idle.
-            self.to_Idle()
-        elif self.state == "Established":
-            # In response to a ManualStop event (initiated by an operator)
-            # (Event 2), the local system:
-            # - sends the NOTIFICATION message with a Cease,
-            self.send_bgp_msg("NOTIFICATION", error_code=0x06)
-            # - sets the ConnectRetryTimer to zero,
-            self.sattrs["timers"]["ConnectRetryTimer"].stop()
-            # - deletes all routes associated with this connection,
-            # - releases BGP resources,
-            # - drops the TCP connection,
+        self.running = False
+
+    def on_ManualStop_Connect(self):
+        self.running = False
+        # In response to a ManualStop event (Event 2), the local system:
+        # - drops the TCP connection,
+        if self.transport:
             self.transport.loseConnection()
-            # - sets the ConnectRetryCounter to zero, and
-            self.sattrs["ConnectRetryCounter"] = 0
-            # - changes its state to Idle.
-            self.to_Idle()
+        # - releases all BGP resources,
+        # - sets ConnectRetryCounter to zero,
+        self.sattrs["ConnectRetryCounter"] = 0
+        # - stops the ConnectRetryTimer and sets ConnectRetryTimer to zero,
+        self.sattrs["timers"]["ConnectRetryTimer"].stop()
+        # - changes its state to Idle.
+        self.to_Idle()
+
+    def on_ManualStop_Open(self):
+        self.running = False
+        # If a ManualStop event (Event 2) is issued in the OpenSent,
+        # OpenConfirm or Established state, the local system:
+        # - sends the NOTIFICATION with a Cease,
+        self.send_bgp_msg("NOTIFICATION", error_code=0x06)
+        # - sets the ConnectRetryTimer to zero,
+        self.sattrs["timers"]["ConnectRetryTimer"].stop()
+        # - deletes all routes associated with this connection (Established),
+        # - releases all BGP resources,
+        # - drops the TCP connection,
+        self.transport.loseConnection()
+        # - sets the ConnectRetryCounter to zero, and
+        self.sattrs["ConnectRetryCounter"] = 0
+        # - changes its state to Idle.
+        self.to_Idle()
 
     def on_ConnectRetryTimer_Expires(self):
-        if self.state == "Idle":
-            self.sattrs["timers"]["ConnectRetryTimer"].stop()
-            self._event("ManualStart")
+        self.sattrs["timers"]["ConnectRetryTimer"].stop()
+        self._event("ManualStart")
 
     def on_HoldTimer_Expires(self):
-        if self.state in ["OpenSent", "OpenConfirm", "Established"]:
-            # If the HoldTimer_Expires (Event 10), the local system:
-            # - sends a NOTIFICATION message with the error code Hold Timer
-            #   Expired,
-            self.send_bgp_msg("NOTIFICATION", error_code=0x04)
-            # - sets the ConnectRetryTimer to zero,
-            # self.sattrs['timers']['ConnectRetryTimer'].stop()
-            # - releases all BGP resources,
-            # - drops the TCP connection,
-            self.transport.loseConnection()
-            # - increments the ConnectRetryCounter,
-            self.sattrs["ConnectRetryCounter"] += 1
-            # - changes its state to Idle.
-            self.to_Idle()
+        # If the HoldTimer_Expires (Event 10), the local system:
+        # - sends a NOTIFICATION message with the error code Hold Timer
+        #   Expired,
+        self.send_bgp_msg("NOTIFICATION", error_code=0x04)
+        # - sets the ConnectRetryTimer to zero,
+        # self.sattrs['timers']['ConnectRetryTimer'].stop()
+        # - releases all BGP resources,
+        # - drops the TCP connection,
+        self.transport.loseConnection()
+        # - increments the ConnectRetryCounter,
+        self.sattrs["ConnectRetryCounter"] += 1
+        # - changes its state to Idle.
+        self.to_Idle()
 
     def on_KeepaliveTimer_Expires(self):
-        if self.state == "Established":
-            # If the KeepaliveTimer_Expires event occurs (Event 11), the local
-            # system:
-            # - sends a KEEPALIVE message
-            self.send_bgp_msg("KEEPALIVE")
-            # - restarts its KeepaliveTimer, unless the negotiated HoldTime
-            #   value is zero.
-            # FIXME
-            self.sattrs["timers"]["KeepaliveTimer"].restart()
+        # If the KeepaliveTimer_Expires event occurs (Event 11), the local
+        # system:
+        # - sends a KEEPALIVE message
+        self.send_bgp_msg("KEEPALIVE")
+        # - restarts its KeepaliveTimer, unless the negotiated HoldTime
+        #   value is zero.
+        # FIXME
+        self.sattrs["timers"]["KeepaliveTimer"].restart()
 
     def on_TcpConnectionFails(self):
         self.sattrs["timers"]["KeepaliveTimer"].stop()
         self.sattrs["timers"]["HoldTimer"].stop()
-        if self.state in ["Connect", "OpenSent", "OpenConfirm"]:
-            # If the DelayOpenTimer is not running, the local system:
-            # - stops the ConnectRetryTimer to zero,
-            # self.sattrs['timers']['ConnectRetryTimer'].restart()
-            # - drops the TCP connection,
-            self.transport.loseConnection()
-            # - releases all BGP resources, and
-            # - changes its state to Idle.
+        self.to_Idle()
+        self._retry()
 
+    def on_TcpConnectionFails_Connecting(self):
+        self.sattrs["timers"]["KeepaliveTimer"].stop()
+        self.sattrs["timers"]["HoldTimer"].stop()
+        # In the Connect, OpenSent and OpenConfirm states, if the
+        # DelayOpenTimer is not running, the local system:
+        # - stops the ConnectRetryTimer to zero,
+        # self.sattrs['timers']['ConnectRetryTimer'].restart()
+        # - drops the TCP connection,
+        if self.transport:
+            self.transport.loseConnection()
+        # - releases all BGP resources, and
+        # - changes its state to Idle.
         self.to_Idle()
-        self.sattrs["timers"]["ConnectRetryTimer"].restart()
+        self._retry()
+
+    def _retry(self):
+        if not self.running:
+            return
+        if not self.fast:
+            self.sattrs["timers"]["ConnectRetryTimer"].restart()
+            return
+        delay = 0
+        if self.failed_connects:
+            delay = min(
+                0.01 * 2 ** (self.failed_connects - 1),
+                self.sattrs["timers"]["ConnectRetryTimer"].time,
+            )
+        self.call_later(delay, self._reconnect)
+
+    def _reconnect(self):
+        if self.running and self.stateid == BGP.IDLE:
+            self._event("ManualStart")
 
     def on_TcpConnectionConfirmed(self):
-        if self.state == "Connect":
-            # the local system:
-            # - stops the ConnectRetryTimer (if running) and sets the
-            #   ConnectRetryTimer to zero,
-            # self.sattrs['timers']['ConnectRetryTimer'].stop()
-            # - completes BGP initialization
-            # - sends an OPEN message to its peer,
+        # In the Connect state, the local system:
+        # - stops the ConnectRetryTimer (if running) and sets the
+        #   ConnectRetryTimer to zero,
+        # self.sattrs['timers']['ConnectRetryTimer'].stop()
+        # - completes BGP initialization
+        # - sends an OPEN message to its peer,
+        if self.fast:
+            self.send_handshake()
+        else:
             self.send_bgp_msg("OPEN")
-            # - sets the HoldTimer to a large value, and
-            ht = self.sattrs["timers"]["HoldTimer"].start()
-            # - changes its state to OpenSent.
-            self.to_OpenSent()
-        elif self.state == "OpenSent":
-            # connection collision resolution
-            pass
-
-    def on_Tcp_CR_Acked(self):
-        self.on_TcpConnectionConfirmed()
+        # - sets the HoldTimer to a large value, and
+        self.sattrs["timers"]["HoldTimer"].start()
+        # - changes its state to OpenSent.
+        self.to_OpenSent()
 
     def on_BGPOpen(self, data):
-        if self.state == "OpenSent":
-            # When an OPEN message is received, all fields are checked for
-            # correctness.
-            # FIXME
-            # If there are no errors in the OPEN message (Event
-            # 19), the local system:
-            # - sets the BGP ConnectRetryTimer to zero,
-            # self.sattrs['timers']['ConnectRetryTimer'].stop()
-            # - sends a KEEPALIVE message, and
+        # When an OPEN message is received, all fields are checked for
+        # correctness.
+        # FIXME
+        # If there are no errors in the OPEN message (Event
+        # 19), the local system:
+        # - sets the BGP ConnectRetryTimer to zero,
+        # self.sattrs['timers']['ConnectRetryTimer'].stop()
+        # - sends a KEEPALIVE message, and
+        if self.pipelined:
+            self.pipelined = False
+        else:
             self.send_bgp_msg("KEEPALIVE")
-            # - sets a KeepaliveTimer (via the text below)
-            self.sattrs["timers"]["KeepaliveTimer"].start()
-            # - sets the HoldTimer according to the negotiated value (see
-            #   Section 4.2),
-            # FIXME: negotiate value
-            ht = self.sattrs["timers"]["HoldTimer"].restart()
-            # - changes its state to OpenConfirm.
-            self.to_OpenConfirm()
-
-    def on_BGPHeaderErr(self, data):
-        pass
-
-    def on_BGPOpenMsgErr(self, data):
-        pass
-
-    def on_NotifMsgVerErr(self, data):
-        pass
+        # - sets a KeepaliveTimer (via the text below)
+        self.sattrs["timers"]["KeepaliveTimer"].start()
+        # - sets the HoldTimer according to the negotiated value (see
+        #   Section 4.2),
+        # FIXME: negotiate value
+        self.sattrs["timers"]["HoldTimer"].restart()
+        # - changes its state to OpenConfirm.
+        self.to_OpenConfirm()
 
     def on_NotifMsg(self, data):
-        if self.state == "Established":
-            # If the local system receives a NOTIFICATION message (Event 24 or
-            # Event 25) or a TcpConnectionFails (Event 18) from the underlying
-            # TCP, the local system:
-            # - sets the ConnectRetryTimer to zero,
-            # self.sattrs['timers']['ConnectRetryTimer'].stop()
-            # - deletes all routes associated with this connection,
-            # - releases all the BGP resources,
-            # - drops the TCP connection,
-            self.transport.loseConnection()
-            # - increments the ConnectRetryCounter by 1,
-            self.sattrs["ConnectRetryCounter"] += 1
-            # - changes its state to Idle.
-            self.to_Idle()
-        if self.state == "OpenSent":
-            # In response to any other event (Events 9, 11-13, 20, 25-28), the
-            # local system:
-            # - sends the NOTIFICATION with the Error Code Finite State
-            #   Machine Error,
-            self.send_bgp_msg("NOTIFICATION", error_code=0x05)
-            # - sets the ConnectRetryTimer to zero,
-            # self.sattrs['timers']['ConnectRetryTimer'].start()
-            # - releases all BGP resources,
-            # - drops the TCP connection,
-            self.transport.loseConnection()
-            # - increments the ConnectRetryCounter by 1,
-            self.sattrs["ConnectRetryCounter"] += 1
+        # If the local system receives a NOTIFICATION message (Event 24 or
+        # Event 25) or a TcpConnectionFails (Event 18) from the underlying
+        # TCP, the local system:
+        # - sets the ConnectRetryTimer to zero,
+        # self.sattrs['timers']['ConnectRetryTimer'].stop()
+        # - deletes all routes associated with this connection,
+        # - releases all the BGP resources,
+        # - drops the TCP connection,
+        self.transport.loseConnection()
+        # - increments the ConnectRetryCounter by 1,
+        self.sattrs["ConnectRetryCounter"] += 1
+        # - changes its state to Idle.
+        self.to_Idle()
+
+    def on_NotifMsg_OpenSent(self, data):
+        # In response to any other event (Events 9, 11-13, 20, 25-28), the
+        # local system:
+        # - sends the NOTIFICATION with the Error Code Finite State
+        #   Machine Error,
+        self.send_bgp_msg("NOTIFICATION", error_code=0x05)
+        # - sets the ConnectRetryTimer to zero,
+        # self.sattrs['timers']['ConnectRetryTimer'].start()
+        # - releases all BGP resources,
+        # - drops the TCP connection,
+        self.transport.loseConnection()
+        # - increments the ConnectRetryCounter by 1,
+        self.sattrs["ConnectRetryCounter"] += 1
+
+    def on_KeepAliveMsg_OpenConfirm(self, data):
+        # If the local system receives a KEEPALIVE message (KeepAliveMsg
+        # (Event 26)), the local system:
+        # - restarts the HoldTimer
+        self.sattrs["timers"]["HoldTimer"].restart()
+        # - changes its state to Established.
+        self.to_Established()
 
     def on_KeepAliveMsg(self, data):
-        if self.state == "OpenConfirm":
-            # If the local system receives a KEEPALIVE message (KeepAliveMsg
-            # (Event 26)), the local system:
-            # - restarts the HoldTimer
-            self.sattrs["timers"]["HoldTimer"].restart()
-            # - changes its state to Established.
-            self.to_Established()
-        if self.state == "Established":
-            # If the local system receives a KEEPALIVE message (Event 26), the
-            # local system:
-            # - restarts its HoldTimer, if the negotiated HoldTime value is
-            #   non-zero
-            self.sattrs["timers"]["HoldTimer"].restart()
-            # - remains in the Established state.
+        # If the local system receives a KEEPALIVE message (Event 26), the
+        # local system:
+        # - restarts its HoldTimer, if the negotiated HoldTime value is
+        #   non-zero
+        self.sattrs["timers"]["HoldTimer"].restart()
+        # - remains in the Established state.
 
     def on_UpdateMsg(self, data):
-        if self.state == "Established":
-            # If the local system receives an UPDATE message (Event 27), the
-            # local system:
-            # - processes the message,
-            # FIXME
-            # - restarts its HoldTimer, if the negotiated HoldTime value is
-            #   non-zero
-            self.sattrs["timers"]["HoldTimer"].reset()
-            # - remains in the Established state.
-
-    def on_UpdateMsgErr(self, data):
-        pass
+        # If the local system receives an UPDATE message (Event 27), the
+        # local system:
+        # - processes the message,
+        # FIXME
+        # - restarts its HoldTimer, if the negotiated HoldTime value is
+        #   non-zero
+        self.sattrs["timers"]["HoldTimer"].reset()
+        # - remains in the Established state.
 
     # Message handling ---------------------------------------------------------
 
     def make_pkt(self, pktcls, *args, **kwargs):
-        self.log.info("Calling builder for: {}".format(pktcls))
+        tracer = self.tracer
+        tracer.record(self.traceid, trace.BUILD, self.stateid, 0, tracer.intern(pktcls))
         return self.msgbuilders[pktcls](*args, **kwargs)
 
+    def hold_time(self):
+        """Hold Time to advertise, in whole seconds."""
+        return int(math.ceil(self.sattrs["timers"]["HoldTimer"].time))
+
     def make_OPEN(self):
-        ht = self.sattrs["timers"]["HoldTimer"].time
+        ht = self.hold_time()
         bgpopen = BGPHeader() / BGPOpen(
             hold_time=ht, bgp_id=self.bgp_id, my_as=self.my_as
         )
@@ -391,83 +612,281 @@ class BGP(Protocol, NephProtocol):
     def make_KEEPALIVE(self):
         return BGPKeepAlive()
 
-    def make_UPDATE(self):
-        pass
+    def make_UPDATE(self, withdrawn_routes=(), path_attr=(), nlri=()):
+        return BGPHeader(self.render_UPDATE(withdrawn_routes, path_attr, nlri))
+
+    def make_bytes(self, pktcls, *args, **kwargs):
+        """
+        Make a serialized message of the specified class.
+
+        Messages with a cached template are rendered directly from it; all
+        others, and any the template cannot represent, are built through
+        :meth:`make_pkt` and serialized by Scapy.
+        """
+        render = self.msgrenderers.get(pktcls)
+        if render:
+            try:
+                return render(*args, **kwargs)
+            except (KeyError, ValueError, OverflowError, OSError, TypeError):
+                pass
+        return bytes(self.make_pkt(pktcls, *args, **kwargs))
+
+    # Message templates --------------------------------------------------------
+
+    @staticmethod
+    def _template_OPEN():
+        return Template(
+            bytes(BGPHeader() / BGPOpen()),
+            {"my_as": (20, 2), "hold_time": (22, 2), "bgp_id": (24, 4)},
+        )
+
+    @staticmethod
+    def _template_NOTIFICATION():
+        return Template(
+            bytes(BGPHeader() / BGPNotification(error_code=0)),
+            {"error_code": (19, 1), "error_subcode": (20, 1)},
+            length=(BGP.MARKER_SIZE, 2),
+        )
+
+    @staticmethod
+    def _template_KEEPALIVE():
+        return Template(bytes(BGPKeepAlive()))
+
+    def render_OPEN(self):
+        tmpl = BGP.templates.get("OPEN", BGP._template_OPEN)
+        return tmpl.render(
+            my_as=self.my_as,
+            hold_time=self.hold_time(),
+            bgp_id=inet_aton(self.bgp_id),
+        )
+
+    def render_NOTIFICATION(self, error_code=0x04, error_subcode=0, data=b""):
+        tmpl = BGP.templates.get("NOTIFICATION", BGP._template_NOTIFICATION)
+        return tmpl.render(
+            bytes(data), error_code=error_code, error_subcode=error_subcode
+        )
+
+    def render_KEEPALIVE(self):
+        return BGP.templates.get("KEEPALIVE", BGP._template_KEEPALIVE).render()
+
+    def render_UPDATE(self, withdrawn_routes=(), path_attr=(), nlri=()):
+        return codec.encode_update(withdrawn_routes, path_attr, nlri)
 
     def recv_bgp_msg(self, msgtype, msglen, msg):
         if msgtype not in BGP.MESSAGE_TYPES:
             msgtype = 0
         msgtypestr = BGP.MESSAGE_TYPES[msgtype]
 
-        self.log.info("[<] {}".format(msgtypestr))
-        self.log.info("    | len: {}".format(msglen))
-        self.log.info("    | type: {} ({})".format(msgtypestr, msgtype))
-
-        if msgtypestr == "OPEN":
-            self._event("BGPOpen", packet)
-        elif msgtypestr == "UPDATE":
-            self._event("Update", packet)
-        elif msgtypestr == "NOTIFICATION":
-            self._event("NotifMsg", packet)
-        elif msgtypestr == "KEEPALIVE":
-            self._event("KeepAliveMsg", packet)
-        elif msgtypestr == "ROUTE-REFRESH":
-            pass
+        self.tracer.record(self.traceid, trace.RECV, self.stateid, msgtype, msglen)
+
+        # bodies are decoded when handlers read them, and may turn out to be
+        # malformed then
+        try:
+            if msgtypestr == "OPEN":
+                self._event("BGPOpen", codec.Open(msg))
+            elif msgtypestr == "UPDATE":
+                self._event("UpdateMsg", codec.Update(msg))
+            elif msgtypestr == "NOTIFICATION":
+                self._event("NotifMsg", codec.Notification(msg))
+            elif msgtypestr == "KEEPALIVE":
+                self._event("KeepAliveMsg", codec.Keepalive(msg))
+            elif msgtypestr == "ROUTE-REFRESH":
+                pass
+        except codec.MalformedMessage as e:
+            self.log.info("[!] {}".format(e))
+            event = BGP.MESSAGE_ERRORS.get(msgtype)
+            if event is not None:
+                self._event(event, e.msg)
 
     def send_bgp_msg(self, pktcls, *args, **kwargs):
-        self.log.info("[>] {}".format(type))
-        msg = self.make_pkt(pktcls, *args, **kwargs)
-        self.transport.write(bytes(msg))
+        tracer = self.tracer
+        tracer.record(self.traceid, trace.SEND, self.stateid, 0, tracer.intern(pktcls))
+        data = self.make_bytes(pktcls, *args, **kwargs)
+        if pktcls == "OPEN":
+            self.metrics.open_sent = time.monotonic()
+        self.send_bytes(data)
+
+    def send_bytes(self, data):
+        """
+        Send one serialized message as is, counted, recorded and corked like
+        those of :meth:`send_bgp_msg`.
+        """
+        self.metrics.count_sent(data)
+        if self.recorder is not None:
+            self.recorder.record(OUT, data)
+        if self.outbuf is not None:
+            self.outbuf.write(data)
+        else:
+            self.transport.write(data)
+
+    def send_handshake(self):
+        """
+        Send the OPEN and the KEEPALIVE that answers the peer's OPEN in one
+        write, ahead of the peer's OPEN.
+        """
+        if self.handshake is None:
+            self.handshake = [self.render_OPEN(), self.render_KEEPALIVE()]
+        self.metrics.open_sent = time.monotonic()
+        self.send_burst(self.handshake)
+        self.pipelined = True
 
-    def handle_data_received(self):
+    def send_messages(self, messages, done=None):
         """
-        Parse incoming data, segment into BGP messages, and invoke the
-        appropriate message handler.
+        Stream serialized messages to the peer.
+
+        Messages are pulled from ``messages`` only as fast as the transport
+        drains them, so the stream can be arbitrarily long.
+
+        :param messages: iterable of serialized messages
+        :param done: called with the number of messages sent when finished
+        :rtype: protos.updates.UpdateProducer
         """
-        if self.inbuf.tell() < BGP.HEADER_SIZE:
-            return
+        self.flush()
+        messages = self.metrics.tap(messages)
+        if self.recorder is not None:
+            messages = self.recorder.tap(OUT, messages)
+        producer = UpdateProducer(self.transport, messages, done=done)
+        producer.start()
+        return producer
+
+    def send_burst(self, messages, segments=False, gap=0, done=None):
+        """
+        Write many serialized messages at once.
+
+        By default the whole burst is handed to the transport in a single
+        call, so it leaves in as few syscalls and segments as the kernel
+        allows. A batch from :meth:`BGPFuzzer.mutate_batch` is written
+        straight from its buffer.
+
+        :param messages: iterable of serialized messages, or an array of
+            shape (n, message length) holding one message per row
+        :param segments: write each message in its own TCP segment instead,
+            for cases where segment boundaries matter
+        :param gap: with ``segments``, seconds between messages
+        :param done: with ``segments``, called with the number of messages
+            sent when finished
+        :return: number of messages written, or with ``segments`` the
+            :class:`protos.writer.SegmentWriter` writing them
+        """
+        self.flush()
+        if hasattr(messages, "ndim"):
+            count = len(messages)
+            self.metrics.count_batch(messages)
+            if self.recorder is not None or segments:
+                messages = [row.tobytes() for row in messages]
+                if self.recorder is not None:
+                    for msg in messages:
+                        self.recorder.record(OUT, msg)
+                if not segments:
+                    self.transport.writeSequence(messages)
+            else:
+                self.transport.write(messages.tobytes())
+        else:
+            messages = list(messages)
+            count = len(messages)
+            for msg in messages:
+                self.metrics.count_sent(msg)
+                if self.recorder is not None:
+                    self.recorder.record(OUT, msg)
+            if not segments:
+                self.transport.writeSequence(messages)
+        self.tracer.record(self.traceid, trace.BURST, self.stateid, 0, count)
+        if segments:
+            return SegmentWriter(self, messages, gap, done).start()
+        return count
+
+    def cork(self, max_bytes=65536, max_delay=None):
+        """
+        Hold back messages sent with :meth:`send_bgp_msg`, and write them
+        together once ``max_bytes`` are pending, ``max_delay`` seconds have
+        passed, or :meth:`uncork` or :meth:`flush` is called.
 
-        v = self.inbuf.getbuffer()
-        header = v[0 : BGP.HEADER_SIZE]
+        :param max_bytes: bytes pending that trigger a flush
+        :param max_delay: seconds after the first pending message that
+            trigger a flush, or None to flush only on size
+        """
+        self.flush()
+        self.outbuf = WriteBuffer(self, max_bytes, max_delay)
 
-        msglen = int.from_bytes(v[16:18], byteorder="big")
-        msgtype = int(v[18])
+    def uncork(self):
+        """Write anything held back, and stop holding messages back."""
+        self.flush()
+        self.outbuf = None
 
-        # check marker
-        if header[0:16] != BGP.MARKER:
-            self._event("BGPHeaderErr", header)
-            return
+    def flush(self):
+        """Write anything held back by :meth:`cork`."""
+        if self.outbuf is not None:
+            self.outbuf.flush()
 
-        # validate length field
-        if msglen < BGP.HEADER_SIZE or msglen > BGP.MAXIMUM_MESSAGE_SIZE:
-            self._event("BGPHeaderErr", header)
-            return
+    def send_updates(self, routes, max_groups=64, done=None):
+        """
+        Stream a route set to the peer as fully packed UPDATE messages.
+
+        Tables of any size can be sent without being held in memory; see
+        :func:`protos.updates.pack_updates` for the format of ``routes``.
+
+        :param routes: iterable of (path attributes, prefix)
+        :param max_groups: maximum number of attribute sets packed at once
+        :param done: called with the number of messages sent when finished
+        :rtype: protos.updates.UpdateProducer
+        """
+        self.tracer.mark(self.traceid, trace.UPDATE_STREAM, self.stateid)
+        messages = pack_updates(routes, BGP.MAXIMUM_MESSAGE_SIZE, max_groups)
+        return self.send_messages(messages, done=done)
+
+    def handle_data_received(self):
+        """
+        Parse incoming data, segment into BGP messages, and invoke the
+        appropriate message handler for each complete message.
+        """
+        self.inbuf.drain(self._frame_received, self._frame_error)
+
+    def _frame_received(self, msg):
+        msglen = len(msg)
+        msgtype = msg[18]
+        self.metrics.received[min(msgtype, metrics.MAX_TYPE)] += 1
 
         # validate type field
         if msgtype == 0 or msgtype not in BGP.MESSAGE_TYPES:
-            self._event("BGPHeaderErr", header)
+            self._event("BGPHeaderErr", msg[0 : BGP.HEADER_SIZE])
 
-        # check that we have the amount of data specified in the length field
-        if self.inbuf.tell() < msglen:
-            return
+        self.recv_bgp_msg(msgtype, msglen, msg)
 
-        # if all these conditions check out, we have a full message
-        packet = self.inbuf.read(msglen)
-        self.inbuf = BytesIO(v[msglen:])
-        self.inbuf.seek(0, 2)
-        self.recv_bgp_msg(msgtype, msglen, packet)
+    def _frame_error(self, header):
+        # bad marker or length field
+        self._event("BGPHeaderErr", header)
 
     # Twisted ------------------------------------------------------------------
 
     def dataReceived(self, data):
-        self.log.info("[=] Twisted: Data received")
+        self.tracer.record(self.traceid, trace.DATA, self.stateid, 0, len(data))
+        self.metrics.bytes_received += len(data)
+        if self.recorder is not None:
+            self.recorder.record(IN, data)
         self.inbuf.write(data)
         self.handle_data_received()
 
+    def _connect_failed(self, failure):
+        self.log.info("[=] Twisted: Connection failed")
+        self.failed_connects += 1
+        self.tracer.mark(self.traceid, trace.CONNECT_FAILED, self.stateid)
+        self._event("TcpConnectionFails")
+
     def connectionLost(self, reason):
         self.log.info("[=] Twisted: Connection lost")
+        self.tracer.mark(self.traceid, trace.LOST, self.stateid)
+        if self.stateid != BGP.ESTABLISHED:
+            self.failed_connects += 1
+        if self.outbuf is not None:
+            self.outbuf.clear()
         self._event("TcpConnectionFails")
 
     def connectionMade(self):
         self.log.info("[=] Twisted: Connection made")
+        self.tracer.mark(self.traceid, trace.CONNECTED, self.stateid)
+        self.pipelined = False
+        self.inbuf.clear()
         self._event("TcpConnectionConfirmed")
+
+
+BGP.compile_fsm()
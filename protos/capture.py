@@ -0,0 +1,263 @@
+# Session byte stream capture and replay.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# A capture file starts with MAGIC and the wall clock time at which it was
+# started, followed by one record per chunk of data:
+#
+#   u64 monotonic timestamp, in nanoseconds
+#   u8  direction, IN or OUT
+#   u32 length
+#   ... data
+#
+# All integers are little-endian. Received data is stored one chunk per read
+# from the transport, which may hold several TCP segments or part of one.
+# Sent data is stored one chunk per message, whether the message was written
+# on its own, in a burst, or held back by cork(). The capture therefore keeps
+# the byte streams and their timing, but not how they were split into
+# segments on the wire.
+
+import mmap
+import struct
+import time
+
+MAGIC = b"NEPHCAP\x01"
+FILE_HEADER = struct.Struct("<8sd")
+RECORD = struct.Struct("<QBI")
+
+IN = 0
+OUT = 1
+
+
+class Recorder(object):
+    """
+    Writes the byte streams of a session to a capture file.
+
+    Attach one to a protocol by setting its ``recorder`` attribute.
+    """
+
+    def __init__(self, path, buffering=1 << 20):
+        """
+        Create a capture file, overwriting any existing one.
+
+        :param path: path of the capture file
+        :param buffering: size of the write buffer, in bytes
+        """
+        self.path = path
+        self.file = open(path, "wb", buffering=buffering)
+        self.file.write(FILE_HEADER.pack(MAGIC, time.time()))
+        self.records = 0
+        self.bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record(self, direction, data, stamp=None):
+        """
+        Append a chunk of data.
+
+        :param direction: IN for received data, OUT for sent data
+        :param data: bytes-like
+        :param stamp: monotonic time of the chunk, in nanoseconds; defaults
+            to now
+        """
+        if stamp is None:
+            stamp = time.monotonic_ns()
+        self.file.write(RECORD.pack(stamp, direction, len(data)))
+        self.file.write(data)
+        self.records += 1
+        self.bytes += len(data)
+
+    def tap(self, direction, chunks):
+        """
+        Record chunks as they are drawn from an iterable.
+
+        :return: generator of the same chunks
+        """
+        for chunk in chunks:
+            self.record(direction, chunk)
+            yield chunk
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Capture(object):
+    """Reads a capture file through mmap."""
+
+    def __init__(self, path):
+        """
+        Open a capture file.
+
+        :param path: path of the capture file
+        :raises ValueError: if the file isn't a capture
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < FILE_HEADER.size:
+            raise ValueError("Truncated capture file")
+        magic, self.started = FILE_HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError("Not a capture file")
+
+    def __iter__(self):
+        return self.records()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        try:
+            self.map.close()
+        except BufferError:
+            # still referenced by a chunk handed out earlier
+            pass
+
+    def records(self, direction=None):
+        """
+        Generate the records in the capture.
+
+        A record cut short by an interrupted capture ends the iteration.
+
+        :param direction: IN or OUT to only generate records of one direction
+        :return: generator of (seconds since the first record, direction,
+            data) tuples, with data as a memoryview into the capture
+        """
+        buf = memoryview(self.map)
+        end = len(buf)
+        pos = FILE_HEADER.size
+        first = None
+        while pos + RECORD.size <= end:
+            stamp, rdir, length = RECORD.unpack_from(buf, pos)
+            pos += RECORD.size
+            if pos + length > end:
+                break
+            if first is None:
+                first = stamp
+            if direction is None or rdir == direction:
+                yield (stamp - first) / 1e9, rdir, buf[pos : pos + length]
+            pos += length
+
+    def chunks(self, direction):
+        """Generate the data of each record in one direction, as bytes."""
+        for _, _, data in self.records(direction):
+            yield bytes(data)
+
+
+class NullTransport(object):
+    """Transport that discards everything written to it."""
+
+    def write(self, data):
+        pass
+
+    def writeSequence(self, data):
+        pass
+
+    def loseConnection(self):
+        pass
+
+    def abortConnection(self):
+        pass
+
+    def setTcpNoDelay(self, enabled):
+        pass
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+    def unregisterProducer(self):
+        pass
+
+
+def feed(session, capture, direction=IN):
+    """
+    Feed captured data through a session's receive path as fast as possible.
+
+    No connection is needed: if the session has no transport, anything it
+    sends in response is discarded.
+
+    :param session: protocol instance to feed
+    :param capture: capture to read from
+    :type capture: Capture
+    :param direction: which side of the capture to feed
+    :return: number of bytes fed
+    :rtype: int
+    """
+    if session.transport is None:
+        session.transport = NullTransport()
+    inbuf = session.inbuf
+    total = 0
+    for _, _, data in capture.records(direction):
+        inbuf.write(data)
+        session.handle_data_received()
+        total += len(data)
+    return total
+
+
+def replay(session, capture, direction=OUT, timing=False, done=None):
+    """
+    Send captured data to a session's peer.
+
+    :param session: connected protocol instance
+    :param capture: capture to read from
+    :type capture: Capture
+    :param direction: which side of the capture to send; OUT resends what
+        the recorded session sent
+    :param timing: keep the original spacing between chunks instead of
+        sending as fast as the transport allows
+    :param done: called with the number of chunks sent when finished
+    """
+    chunks = capture.chunks(direction)
+    if not timing:
+        return session.send_messages(chunks, done=done)
+    Pacer(session, capture.records(direction), done).next()
+
+
+class Pacer(object):
+    """Writes records at their original offsets from the start of replay."""
+
+    def __init__(self, session, records, done=None):
+        self.session = session
+        self.records = records
+        self.done = done
+        self.sent = 0
+        self.start = time.monotonic()
+
+    def next(self):
+        for offset, _, data in self.records:
+            delay = self.start + offset - time.monotonic()
+            if delay > 0:
+                self.session.call_later(delay, self.send, bytes(data))
+                return
+            self.session.transport.write(bytes(data))
+            self.sent += 1
+        if self.done:
+            self.done(self.sent)
+
+    def send(self, data):
+        self.session.transport.write(data)
+        self.sent += 1
+        self.next()
@@ -0,0 +1,386 @@
+# Lightweight BGP message codec.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Decoding is lazy: constructing a message only reads its header, and the
+# body is unpacked the first time one of its fields is read. A body too short
+# for its fields, or whose length fields overrun it, raises MalformedMessage
+# at that point. Encoding produces the same bytes Scapy's BGP layers would for
+# the same field values.
+
+from collections import namedtuple
+from socket import inet_aton, inet_ntoa
+import struct
+
+HEADER_SIZE = 19
+MARKER = b"\xff" * 16
+
+OPEN = 1
+UPDATE = 2
+NOTIFICATION = 3
+KEEPALIVE = 4
+ROUTE_REFRESH = 5
+
+MESSAGE_NAMES = {
+    0: "NONE",
+    OPEN: "OPEN",
+    UPDATE: "UPDATE",
+    NOTIFICATION: "NOTIFICATION",
+    KEEPALIVE: "KEEPALIVE",
+    ROUTE_REFRESH: "ROUTE-REFRESH",
+}
+"""Name of each message type code"""
+
+HEADER = struct.Struct("!16sHB")
+OPEN_BODY = struct.Struct("!BHH4sB")
+NOTIFICATION_BODY = struct.Struct("!BB")
+
+# Path attribute flags
+ATTR_OPTIONAL = 0x80
+ATTR_TRANSITIVE = 0x40
+ATTR_PARTIAL = 0x20
+ATTR_EXTENDED_LENGTH = 0x10
+
+PathAttribute = namedtuple("PathAttribute", ["flags", "type_code", "value"])
+"""A path attribute, with its value left undecoded"""
+
+OptParam = namedtuple("OptParam", ["type", "value"])
+"""An OPEN optional parameter, with its value left undecoded"""
+
+
+class MalformedMessage(ValueError):
+    """A message body that its fields can't be decoded from."""
+
+    def __init__(self, msg, reason):
+        super().__init__("Malformed {}: {}".format(msg.name, reason))
+        self.msg = msg
+
+
+class field(object):
+    """Message field that triggers decoding of the body on first access."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __get__(self, msg, owner):
+        if msg is None:
+            return self
+        if msg._fields is None:
+            msg._fields = msg.decode_body()
+        return msg._fields[self.index]
+
+
+class Message(object):
+    """
+    A BGP message.
+
+    Only the header is decoded on construction. Subclasses expose the body
+    fields of each message type as attributes that decode on first access.
+    """
+
+    __slots__ = ("buf", "length", "type", "_fields")
+
+    name = "NONE"
+
+    def __init__(self, buf):
+        """
+        Wrap a serialized message.
+
+        :param buf: serialized message, starting with the header
+        :type buf: bytes-like
+        """
+        self.buf = buf
+        self.length = (buf[16] << 8) | buf[17]
+        self.type = buf[18]
+        self._fields = None
+
+    def __bytes__(self):
+        return bytes(self.buf[: self.length])
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return "<{} len={}>".format(self.name, self.length)
+
+    @property
+    def marker(self):
+        return bytes(self.buf[0:16])
+
+    @property
+    def body(self):
+        return self.buf[HEADER_SIZE : self.length]
+
+    def decode_body(self):
+        """Decode every body field; returns them as a tuple."""
+        return ()
+
+
+class Open(Message):
+    __slots__ = ()
+
+    name = "OPEN"
+
+    version = field(0)
+    my_as = field(1)
+    hold_time = field(2)
+    bgp_id = field(3)
+    opt_param_len = field(4)
+    opt_params = field(5)
+
+    def decode_body(self):
+        start = HEADER_SIZE + OPEN_BODY.size
+        if self.length < start:
+            raise MalformedMessage(self, "body shorter than its fixed fields")
+        version, my_as, hold_time, bgp_id, optlen = OPEN_BODY.unpack_from(
+            self.buf, HEADER_SIZE
+        )
+        if start + optlen > self.length:
+            raise MalformedMessage(self, "optional parameters overrun the message")
+        params = []
+        buf = self.buf[start : start + optlen]
+        pos = 0
+        while pos < len(buf):
+            if pos + 2 > len(buf) or pos + 2 + buf[pos + 1] > len(buf):
+                raise MalformedMessage(self, "optional parameter overruns the others")
+            ptype, plen = buf[pos], buf[pos + 1]
+            params.append(OptParam(ptype, bytes(buf[pos + 2 : pos + 2 + plen])))
+            pos += 2 + plen
+        return (version, my_as, hold_time, inet_ntoa(bgp_id), optlen, params)
+
+
+class Update(Message):
+    __slots__ = ()
+
+    name = "UPDATE"
+
+    withdrawn_routes_len = field(0)
+    withdrawn_routes = field(1)
+    path_attr_len = field(2)
+    path_attr = field(3)
+    nlri = field(4)
+
+    def decode_body(self):
+        buf = self.buf
+        end = self.length
+        pos = HEADER_SIZE
+        if end < pos + 4:
+            raise MalformedMessage(self, "body shorter than its length fields")
+        wlen = (buf[pos] << 8) | buf[pos + 1]
+        pos += 2
+        if pos + wlen + 2 > end:
+            raise MalformedMessage(self, "withdrawn routes overrun the message")
+        try:
+            withdrawn = decode_prefixes(buf[pos : pos + wlen])
+            pos += wlen
+            alen = (buf[pos] << 8) | buf[pos + 1]
+            pos += 2
+            if pos + alen > end:
+                raise ValueError("path attributes overrun the message")
+            attrs = decode_path_attrs(buf[pos : pos + alen])
+            pos += alen
+            nlri = decode_prefixes(buf[pos:end])
+        except ValueError as e:
+            raise MalformedMessage(self, str(e))
+        return (wlen, withdrawn, alen, attrs, nlri)
+
+
+class Notification(Message):
+    __slots__ = ()
+
+    name = "NOTIFICATION"
+
+    error_code = field(0)
+    error_subcode = field(1)
+    data = field(2)
+
+    def decode_body(self):
+        if self.length < HEADER_SIZE + NOTIFICATION_BODY.size:
+            raise MalformedMessage(self, "body shorter than its error codes")
+        code, subcode = NOTIFICATION_BODY.unpack_from(self.buf, HEADER_SIZE)
+        start = HEADER_SIZE + NOTIFICATION_BODY.size
+        return (code, subcode, bytes(self.buf[start : self.length]))
+
+
+class Keepalive(Message):
+    __slots__ = ()
+
+    name = "KEEPALIVE"
+
+
+MESSAGE_CLASSES = {
+    OPEN: Open,
+    UPDATE: Update,
+    NOTIFICATION: Notification,
+    KEEPALIVE: Keepalive,
+}
+
+
+def decode(buf):
+    """
+    Wrap a serialized message in the class for its type.
+
+    :param buf: serialized message, starting with the header
+    :rtype: Message
+    """
+    return MESSAGE_CLASSES.get(buf[18], Message)(buf)
+
+
+def decode_prefixes(buf):
+    """
+    Decode a run of IPv4 prefixes.
+
+    :return: prefixes in ``a.b.c.d/len`` notation
+    :rtype: list
+    :raises ValueError: if a prefix is longer than 32 bits or overruns
+        ``buf``
+    """
+    prefixes = []
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        plen = buf[pos]
+        size = (plen + 7) // 8
+        if plen > 32:
+            raise ValueError("prefix length {} is over 32".format(plen))
+        if pos + 1 + size > end:
+            raise ValueError("prefix overruns its field")
+        addr = bytes(buf[pos + 1 : pos + 1 + size]).ljust(4, b"\x00")
+        prefixes.append("{}/{}".format(inet_ntoa(addr[:4]), plen))
+        pos += 1 + size
+    return prefixes
+
+
+def decode_path_attrs(buf):
+    """
+    Decode a run of path attributes.
+
+    :rtype: list of PathAttribute
+    :raises ValueError: if an attribute overruns ``buf``
+    """
+    attrs = []
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        flags = buf[pos]
+        hdr = 4 if flags & ATTR_EXTENDED_LENGTH else 3
+        if pos + hdr > end:
+            raise ValueError("attribute header overruns the path attributes")
+        code = buf[pos + 1]
+        if hdr == 4:
+            alen = (buf[pos + 2] << 8) | buf[pos + 3]
+        else:
+            alen = buf[pos + 2]
+        pos += hdr
+        if pos + alen > end:
+            raise ValueError("attribute overruns the path attributes")
+        attrs.append(PathAttribute(flags, code, bytes(buf[pos : pos + alen])))
+        pos += alen
+    return attrs
+
+
+# Encoding ---------------------------------------------------------------------
+
+
+def encode(msgtype, body=b""):
+    """
+    Prepend a header to a message body.
+
+    :param msgtype: message type code
+    :param body: serialized body
+    :rtype: bytes
+    """
+    return HEADER.pack(MARKER, HEADER_SIZE + len(body), msgtype) + body
+
+
+def encode_open(my_as, hold_time, bgp_id, version=4, opt_params=()):
+    """
+    Encode an OPEN message.
+
+    :param opt_params: OptParam tuples, or already serialized parameters
+    :rtype: bytes
+    """
+    if not isinstance(opt_params, (bytes, bytearray)):
+        opt_params = b"".join(
+            bytes((p.type, len(p.value))) + p.value
+            for p in map(OptParam._make, opt_params)
+        )
+    body = OPEN_BODY.pack(version, my_as, hold_time, inet_aton(bgp_id), len(opt_params))
+    return encode(OPEN, body + opt_params)
+
+
+def encode_keepalive():
+    """Encode a KEEPALIVE message."""
+    return encode(KEEPALIVE)
+
+
+def encode_notification(error_code, error_subcode=0, data=b""):
+    """Encode a NOTIFICATION message."""
+    return encode(
+        NOTIFICATION, NOTIFICATION_BODY.pack(error_code, error_subcode) + data
+    )
+
+
+def encode_update(withdrawn_routes=(), path_attr=(), nlri=()):
+    """
+    Encode an UPDATE message.
+
+    :param withdrawn_routes: prefixes in ``a.b.c.d/len`` notation
+    :param path_attr: PathAttribute tuples, or already serialized attributes
+    :param nlri: prefixes in ``a.b.c.d/len`` notation
+    :rtype: bytes
+    """
+    withdrawn = encode_prefixes(withdrawn_routes)
+    if not isinstance(path_attr, (bytes, bytearray)):
+        path_attr = encode_path_attrs(path_attr)
+    body = (
+        struct.pack("!H", len(withdrawn))
+        + withdrawn
+        + struct.pack("!H", len(path_attr))
+        + path_attr
+        + encode_prefixes(nlri)
+    )
+    return encode(UPDATE, body)
+
+
+def encode_prefix(prefix):
+    """Encode one IPv4 prefix in ``a.b.c.d/len`` notation."""
+    addr, _, plen = prefix.partition("/")
+    plen = int(plen) if plen else 32
+    return bytes((plen,)) + inet_aton(addr)[: (plen + 7) // 8]
+
+
+def encode_prefixes(prefixes):
+    """Encode a run of IPv4 prefixes."""
+    return b"".join(encode_prefix(p) for p in prefixes)
+
+
+def encode_path_attr(flags, type_code, value):
+    """
+    Encode one path attribute.
+
+    The extended length flag is set automatically for values over 255 bytes.
+    """
+    if len(value) > 0xFF:
+        flags |= ATTR_EXTENDED_LENGTH
+    if flags & ATTR_EXTENDED_LENGTH:
+        return struct.pack("!BBH", flags, type_code, len(value)) + value
+    return struct.pack("!BBB", flags, type_code, len(value)) + value
+
+
+def encode_path_attrs(attrs):
+    """Encode a run of PathAttribute tuples."""
+    return b"".join(encode_path_attr(*a) for a in attrs)
@@ -0,0 +1,139 @@
+# Receive-side message framing for neph protocols.
+# ------------------------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class Framer(object):
+    """
+    Receive buffer that segments a byte stream into length-prefixed messages.
+
+    Incoming data is appended to a single growable ``bytearray``. Complete
+    messages are handed out as ``memoryview`` slices of that buffer, so no
+    message is ever copied on the way to its handler. Consumed bytes are
+    discarded once per :meth:`drain`, which keeps the cost of segmenting a
+    backlog linear in its size instead of quadratic.
+
+    .. note::
+       Handlers may keep the views they are passed. While any view is alive
+       the buffer cannot be resized, so the framer moves on to a fresh buffer
+       instead, at the cost of one copy of the unconsumed data.
+    """
+
+    def __init__(
+        self, header_size, length_offset, length_size=2, max_size=None, marker=b""
+    ):
+        """
+        Create a new Framer.
+
+        :param header_size: size of the fixed message header
+        :param length_offset: offset of the length field within the header
+        :param length_size: size of the length field, in bytes
+        :param max_size: maximum valid message length
+        :param marker: bytes every header must begin with
+
+        :type header_size: int
+        :type length_offset: int
+        :type length_size: int
+        :type max_size: int
+        :type marker: bytes
+        """
+        self.header_size = header_size
+        self.length_offset = length_offset
+        self.length_end = length_offset + length_size
+        self.max_size = max_size
+        self.marker = marker
+        self.buf = bytearray()
+
+    def __len__(self):
+        return len(self.buf)
+
+    def write(self, data):
+        """Append received data to the buffer."""
+        try:
+            self.buf += data
+        except BufferError:
+            # A handler is still holding a view of the buffer; see _consume.
+            self.buf = self.buf + data
+
+    def clear(self):
+        """Discard all buffered data."""
+        self.buf = bytearray()
+
+    def drain(self, handler, error=None):
+        """
+        Hand every complete message in the buffer to a handler.
+
+        Segmentation stops at the first incomplete message, or at the first
+        header that fails validation. In the latter case the offending header
+        is passed to ``error`` and left in the buffer.
+
+        :param handler: called with a view of each complete message
+        :param error: called with a view of each invalid header
+        :return: number of messages handed to ``handler``
+
+        :type handler: callable
+        :type error: callable
+        :rtype: int
+        """
+        buf = self.buf
+        end = len(buf)
+        pos = 0
+        hsize = self.header_size
+        lo = self.length_offset
+        le = self.length_end
+        maxsize = self.max_size or end
+        marker = self.marker
+        count = 0
+
+        view = memoryview(buf)
+        try:
+            while end - pos >= hsize:
+                if marker and not buf.startswith(marker, pos):
+                    if error:
+                        error(view[pos : pos + hsize])
+                    break
+
+                msglen = int.from_bytes(buf[pos + lo : pos + le], "big")
+                if msglen < hsize or msglen > maxsize:
+                    if error:
+                        error(view[pos : pos + hsize])
+                    break
+
+                if end - pos < msglen:
+                    break
+
+                handler(view[pos : pos + msglen])
+                pos += msglen
+                count += 1
+        finally:
+            view.release()
+            self._consume(pos)
+
+        return count
+
+    def _consume(self, pos):
+        """Discard everything in the buffer before ``pos``."""
+        if pos == 0:
+            return
+        if pos == len(self.buf):
+            self.buf = bytearray()
+            return
+        try:
+            del self.buf[:pos]
+        except BufferError:
+            # A handler is still holding a view of the buffer; leave it to
+            # them and carry on with a fresh copy of the remainder.
+            self.buf = self.buf[pos:]
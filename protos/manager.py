@@ -0,0 +1,188 @@
+# Session management for neph protocols.
+# ---------------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import Counter
+from ipaddress import IPv4Address
+from twisted.internet import reactor
+from protos.bgp import BGP
+from protos.metrics import collect
+import logging
+
+
+class SessionManager(object):
+    """
+    Creates and supervises many protocol sessions in one reactor.
+
+    Every session gets an integer id. The manager observes each session's
+    state changes, so per-state counts and per-session states are always
+    current without polling.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        """Sessions, keyed by id"""
+
+        self.states = {}
+        """Current state of each session, keyed by id"""
+
+        self.counts = Counter()
+        """Number of sessions in each state"""
+
+        self.transitions = 0
+        """Total number of state changes across all sessions"""
+
+        self.log = logging.getLogger("SessionManager")
+        self.nextid = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def add(self, session):
+        """
+        Place a session under management.
+
+        :param session: protocol session
+        :return: session id
+        :rtype: int
+        """
+        sid = self.nextid
+        self.nextid += 1
+        session.sid = sid
+        session.observer = self._state_changed
+        self.sessions[sid] = session
+        self.states[sid] = session.state
+        self.counts[session.state] += 1
+        return sid
+
+    def remove(self, sid):
+        """
+        Release a session from management.
+
+        :param sid: session id
+        :return: the session
+        """
+        session = self.sessions.pop(sid)
+        session.observer = None
+        self.counts[self.states.pop(sid)] -= 1
+        return session
+
+    def spawn(
+        self,
+        count,
+        neighbor,
+        cls=BGP,
+        first_as=1,
+        first_id="10.0.0.1",
+        first_bind=None,
+        **kwargs
+    ):
+        """
+        Create and manage many sessions to one neighbor.
+
+        Session ``i`` uses ASN ``first_as + i`` and BGP ID ``first_id + i``.
+        If ``first_bind`` is given, it also connects from ``first_bind + i``,
+        so that each session appears to the target as a distinct peer.
+
+        :param count: number of sessions
+        :param neighbor: ipv4 address of the peer
+        :param cls: session class, e.g. BGP or BGPFuzzer
+        :param first_as: ASN of the first session
+        :param first_id: BGP ID of the first session
+        :param first_bind: local address of the first session
+        :param kwargs: passed through to ``cls``
+        :return: ids of the new sessions
+        :rtype: list
+        """
+        first_id = IPv4Address(first_id)
+        first_bind = IPv4Address(first_bind) if first_bind else None
+        sids = []
+        for i in range(count):
+            if first_bind:
+                kwargs["bind"] = str(first_bind + i)
+            session = cls(
+                neighbor=neighbor,
+                my_as=first_as + i,
+                bgp_id=str(first_id + i),
+                **kwargs
+            )
+            sids.append(self.add(session))
+        return sids
+
+    def start(self, rate=None):
+        """
+        Start all sessions.
+
+        :param rate: sessions to start per second, or None to start them all
+            at once
+        :type rate: float
+        """
+        for i, session in enumerate(list(self.sessions.values())):
+            if rate:
+                session.call_later(i / rate, session._event, "ManualStart")
+            else:
+                session._event("ManualStart")
+
+    def stop(self):
+        """Stop all sessions."""
+        for session in list(self.sessions.values()):
+            session._event("ManualStop")
+
+    def run(self, rate=None):
+        """
+        Start all sessions and run the reactor until it is stopped.
+
+        :param rate: see :meth:`start`
+        """
+        reactor.callWhenRunning(self.start, rate)
+        reactor.run()
+        self.stop()
+
+    def summary(self):
+        """
+        Summarize session states.
+
+        :return: number of sessions in each state
+        :rtype: dict
+        """
+        return {state: n for state, n in self.counts.items() if n}
+
+    def metrics(self):
+        """
+        Metrics of all sessions, merged.
+
+        :rtype: protos.metrics.SessionMetrics
+        """
+        return collect(s.metrics for s in self.sessions.values())
+
+    def in_state(self, state):
+        """
+        Find sessions in a given state.
+
+        :param state: FSM state name
+        :return: sessions currently in that state
+        :rtype: list
+        """
+        return [self.sessions[sid] for sid, s in self.states.items() if s == state]
+
+    def _state_changed(self, session):
+        sid = session.sid
+        old = self.states[sid]
+        new = session.state
+        self.counts[old] -= 1
+        self.counts[new] += 1
+        self.states[sid] = new
+        self.transitions += 1
@@ -0,0 +1,514 @@
+# Session metrics.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Every session keeps a SessionMetrics of plain counters and histograms,
+# updated inline on its send, receive and FSM paths. Nothing is aggregated
+# until someone asks: from the REPL, through snapshot() on a session, a
+# SessionManager or the registry; from Prometheus, through an Exporter
+# serving the text exposition format over HTTP.
+#
+# The exporter answers from its own thread so that it can be scraped even
+# while the event loop is saturated. It only takes copies of the counters,
+# which are consistent enough for monitoring.
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from protos.codec import MESSAGE_NAMES
+import itertools
+import threading
+import weakref
+
+# Message type codes above this are counted together, as OTHER
+MAX_TYPE = 6
+
+# Upper bounds of the exported histogram buckets, in seconds
+BOUNDS = [1e-6 * 4**k for k in range(15)]
+
+
+class Histogram(object):
+    """
+    Log-linear histogram in the style of HdrHistogram.
+
+    Values are counted in buckets whose width grows with their magnitude, so
+    that any value is known to within ``2 ** -bits`` of itself, whatever its
+    range. Recording is a few integer operations and a dict update.
+    """
+
+    __slots__ = ("unit", "bits", "counts", "count", "total", "min", "max")
+
+    def __init__(self, unit=1e-6, bits=5):
+        """
+        Create a new Histogram.
+
+        :param unit: smallest distinguishable value
+        :param bits: bits of precision of each bucket
+        """
+        self.unit = unit
+        self.bits = bits
+        self.counts = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def __len__(self):
+        return self.count
+
+    def record(self, value):
+        """Count a value."""
+        v = int(value / self.unit)
+        e = v.bit_length() - self.bits - 1
+        if e <= 0:
+            self.counts[v] += 1
+        else:
+            self.counts[((e + 1) << self.bits) + (v >> e) - (1 << self.bits)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def bucket(self, index):
+        """
+        Range of values counted in a bucket.
+
+        :return: lower and upper bounds
+        :rtype: tuple
+        """
+        size = 1 << self.bits
+        if index < 2 * size:
+            return index * self.unit, (index + 1) * self.unit
+        e = index // size - 1
+        m = index % size + size
+        return (m << e) * self.unit, ((m + 1) << e) * self.unit
+
+    def percentile(self, q):
+        """
+        Estimate a percentile.
+
+        :param q: percentile, from 0 to 100
+        :return: upper bound of the bucket holding it, or None if empty
+        """
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.bucket(index)[1], self.max)
+        return self.max
+
+    def cumulative(self, bounds=BOUNDS):
+        """
+        Count the values at or below each bound.
+
+        :rtype: list
+        """
+        counts = dict(self.counts)
+        result = []
+        for bound in bounds:
+            result.append(
+                sum(n for i, n in counts.items() if self.bucket(i)[1] <= bound + 1e-12)
+            )
+        return result
+
+    def merge(self, other):
+        """Add the counts of another histogram with the same unit and bits."""
+        self.counts.update(other.counts)
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+
+    def snapshot(self):
+        """
+        Summarize the histogram.
+
+        :return: count, sum, min, max and the 50th, 90th and 99th percentiles
+        :rtype: dict
+        """
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+class SessionMetrics(object):
+    """
+    Counters and histograms of one session, or of several merged together.
+
+    Counters by message type are lists indexed by type code, with every
+    code from MAX_TYPE up counted in the last slot.
+    """
+
+    def __init__(self, states=(), labels=None):
+        """
+        Create a new SessionMetrics.
+
+        :param states: names of the session's FSM states, by state id
+        :param labels: labels identifying the session when exported
+        :type labels: dict
+        """
+        self.states = list(states)
+        self.labels = labels or {}
+        self.sent = [0] * (MAX_TYPE + 1)
+        self.received = [0] * (MAX_TYPE + 1)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # (old state id, new state id) -> count
+        self.transitions = Counter()
+        # OPEN sent -> Established
+        self.handshake = Histogram()
+        # mutated message sent -> first reaction of the target
+        self.reaction = Histogram()
+        # monotonic time our last OPEN was sent, until Established
+        self.open_sent = None
+        self.gauges = {}
+        # called to bring the gauges up to date before they are read
+        self.refresh = None
+
+    def __getstate__(self):
+        self.update_gauges()
+        state = dict(self.__dict__)
+        state["refresh"] = None
+        return state
+
+    def update_gauges(self):
+        if self.refresh is not None:
+            self.refresh()
+
+    def count_sent(self, msg):
+        """Count a serialized message written to the peer."""
+        if len(msg) > 18:
+            self.sent[min(msg[18], MAX_TYPE)] += 1
+        self.bytes_sent += len(msg)
+
+    def count_batch(self, batch):
+        """
+        Count a batch of equal length messages written to the peer.
+
+        :param batch: array of shape (n, message length), one message per row
+        :type batch: numpy.ndarray
+        """
+        import numpy as np
+
+        if batch.shape[1] > 18:
+            types = np.minimum(batch[:, 18], MAX_TYPE)
+            for code, n in enumerate(np.bincount(types, minlength=MAX_TYPE + 1)):
+                self.sent[code] += int(n)
+        self.bytes_sent += batch.size
+
+    def tap(self, messages):
+        """
+        Count messages as they are drawn from an iterable.
+
+        :return: generator of the same messages
+        """
+        sent = self.sent
+        for msg in messages:
+            if len(msg) > 18:
+                sent[min(msg[18], MAX_TYPE)] += 1
+            self.bytes_sent += len(msg)
+            yield msg
+
+    def merge(self, other):
+        """Add another session's metrics to these."""
+        other.update_gauges()
+        if not self.states:
+            self.states = list(other.states)
+        for i, n in enumerate(other.sent):
+            self.sent[i] += n
+        for i, n in enumerate(other.received):
+            self.received[i] += n
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        self.transitions.update(other.transitions)
+        self.handshake.merge(other.handshake)
+        self.reaction.merge(other.reaction)
+        for name, value in other.gauges.items():
+            self.gauges[name] = self.gauges.get(name, 0) + value
+
+    def state_name(self, stateid):
+        return self.states[stateid] if stateid < len(self.states) else str(stateid)
+
+    def snapshot(self):
+        """
+        Current values, by name.
+
+        :rtype: dict
+        """
+        self.update_gauges()
+        return {
+            "labels": dict(self.labels),
+            "sent": _by_type(self.sent),
+            "received": _by_type(self.received),
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "transitions": {
+                "{}->{}".format(self.state_name(a), self.state_name(b)): n
+                for (a, b), n in dict(self.transitions).items()
+            },
+            "handshake": self.handshake.snapshot(),
+            "reaction": self.reaction.snapshot(),
+            "gauges": dict(self.gauges),
+        }
+
+
+def type_name(code):
+    return MESSAGE_NAMES.get(code, "OTHER")
+
+
+def _by_type(counts):
+    return {type_name(code): n for code, n in enumerate(counts) if n}
+
+
+def collect(metrics):
+    """
+    Merge the metrics of several sessions.
+
+    :param metrics: iterable of SessionMetrics
+    :rtype: SessionMetrics
+    """
+    total = SessionMetrics()
+    for m in metrics:
+        total.merge(m)
+    return total
+
+
+class Registry(object):
+    """
+    Weak collection of session metrics to export.
+
+    Sessions register themselves on creation, and drop out once they are
+    garbage collected.
+    """
+
+    def __init__(self):
+        self.members = weakref.WeakValueDictionary()
+        self.ids = itertools.count()
+
+    def __len__(self):
+        return len(self.members)
+
+    def add(self, metrics):
+        self.members[next(self.ids)] = metrics
+
+    def metrics(self):
+        """
+        Registered metrics.
+
+        Safe to call from any thread.
+
+        :rtype: list
+        """
+        return [m for m in (ref() for ref in self.members.valuerefs()) if m is not None]
+
+    def snapshot(self):
+        """
+        Totals and per-session values.
+
+        :return: ``{"total": ..., "sessions": [...]}`` of
+            :meth:`SessionMetrics.snapshot` values
+        :rtype: dict
+        """
+        metrics = self.metrics()
+        return {
+            "total": collect(metrics).snapshot(),
+            "sessions": [m.snapshot() for m in metrics],
+        }
+
+    def exposition(self, per_session=True):
+        """
+        Render the registered metrics in the Prometheus text format.
+
+        :param per_session: export a series per session; otherwise only
+            totals are exported, which scales to any number of sessions
+        :rtype: str
+        """
+        metrics = self.metrics()
+        if not per_session:
+            metrics = [collect(metrics)]
+        return exposition(metrics)
+
+
+def _labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels.items()
+    )
+    return "{" + pairs + "}"
+
+
+def exposition(metrics):
+    """
+    Render session metrics in the Prometheus text format.
+
+    :param metrics: iterable of SessionMetrics
+    :rtype: str
+    """
+    metrics = list(metrics)
+    for m in metrics:
+        m.update_gauges()
+    lines = []
+
+    def family(name, kind, helptext):
+        lines.append("# HELP {} {}".format(name, helptext))
+        lines.append("# TYPE {} {}".format(name, kind))
+
+    for name, attr, helptext in (
+        ("neph_messages_sent_total", "sent", "Messages sent, by type."),
+        ("neph_messages_received_total", "received", "Messages received, by type."),
+    ):
+        family(name, "counter", helptext)
+        for m in metrics:
+            for code, n in enumerate(list(getattr(m, attr))):
+                if n:
+                    mtype = type_name(code)
+                    lines.append(
+                        "{}{} {}".format(name, _labels(m.labels, type=mtype), n)
+                    )
+
+    for name, attr, helptext in (
+        ("neph_bytes_sent_total", "bytes_sent", "Bytes sent."),
+        ("neph_bytes_received_total", "bytes_received", "Bytes received."),
+    ):
+        family(name, "counter", helptext)
+        for m in metrics:
+            lines.append("{}{} {}".format(name, _labels(m.labels), getattr(m, attr)))
+
+    family("neph_fsm_transitions_total", "counter", "FSM state changes.")
+    for m in metrics:
+        for (a, b), n in dict(m.transitions).items():
+            labels = _labels(
+                m.labels, **{"from": m.state_name(a), "to": m.state_name(b)}
+            )
+            lines.append("neph_fsm_transitions_total{} {}".format(labels, n))
+
+    gauges = sorted({name for m in metrics for name in m.gauges})
+    for gauge in gauges:
+        name = "neph_" + gauge
+        family(name, "gauge", gauge.replace("_", " ").capitalize() + ".")
+        for m in metrics:
+            if gauge in m.gauges:
+                lines.append("{}{} {}".format(name, _labels(m.labels), m.gauges[gauge]))
+
+    for name, attr, helptext in (
+        ("neph_handshake_seconds", "handshake", "Time from OPEN to Established."),
+        (
+            "neph_reaction_seconds",
+            "reaction",
+            "Time from a mutated message to the target's reaction.",
+        ),
+    ):
+        family(name, "histogram", helptext)
+        for m in metrics:
+            hist = getattr(m, attr)
+            for bound, n in zip(BOUNDS, hist.cumulative()):
+                labels = _labels(m.labels, le="{:g}".format(bound))
+                lines.append("{}_bucket{} {}".format(name, labels, n))
+            count = hist.count
+            labels = _labels(m.labels, le="+Inf")
+            lines.append("{}_bucket{} {}".format(name, labels, count))
+            lines.append("{}_sum{} {}".format(name, _labels(m.labels), hist.total))
+            lines.append("{}_count{} {}".format(name, _labels(m.labels), count))
+
+    return "\n".join(lines) + "\n"
+
+
+class Exporter(object):
+    """Serves a registry in the Prometheus text format over HTTP."""
+
+    def __init__(self, registry=None, host="127.0.0.1", port=9464, per_session=True):
+        """
+        Create a new Exporter.
+
+        :param registry: registry to export; defaults to the shared one
+        :param host: address to listen on
+        :param port: port to listen on; 0 picks a free one
+        :param per_session: see :meth:`Registry.exposition`
+        """
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.per_session = per_session
+        self.server = None
+        self.thread = None
+
+    @property
+    def address(self):
+        """Address the exporter listens on, once started."""
+        return self.server.server_address if self.server else None
+
+    def start(self):
+        """Start serving from a background thread."""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def render(self):
+        reg = self.registry if self.registry is not None else registry()
+        return reg.exposition(self.per_session)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+_registry = None
+
+
+def registry():
+    """The registry every session adds its metrics to."""
+    global _registry
+    if _registry is None:
+        _registry = Registry()
+    return _registry
@@ -0,0 +1,210 @@
+# Pre-opened connections for neph protocols.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# When fuzz cases keep crashing or resetting sessions, the TCP handshake of
+# every reconnect sits between one case and the next. A ConnectionPool keeps
+# a few connections to the target open ahead of time; a session that
+# connects takes one whose handshake is already done, and the pool dials a
+# replacement in the background.
+#
+# A spare connection is a placeholder protocol that only buffers what the
+# target sends before the connection is taken; many speakers send their
+# OPEN as soon as they accept. Taking it swaps the session in as the
+# transport's protocol and replays the buffer.
+
+from collections import Counter
+from twisted.internet import reactor
+from twisted.internet.endpoints import TCP4ClientEndpoint, connectProtocol
+from twisted.internet.protocol import Protocol
+from twisted.python.failure import Failure
+
+
+class Spare(Protocol):
+    """A connection waiting in a pool for a session to take it."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.buffer = []
+        self.lost = False
+
+    def connectionMade(self):
+        self.pool._ready(self)
+
+    def dataReceived(self, data):
+        self.buffer.append(data)
+
+    def connectionLost(self, reason=None):
+        self.lost = True
+        self.pool._lost(self)
+
+    # asyncio ------------------------------------------------------------------
+
+    def connection_made(self, transport):
+        self.makeConnection(transport)
+
+    def data_received(self, data):
+        self.dataReceived(data)
+
+    def eof_received(self):
+        return False
+
+    def pause_writing(self):
+        pass
+
+    def resume_writing(self):
+        pass
+
+    def connection_lost(self, exc):
+        self.connectionLost(exc)
+
+    # Handoff ------------------------------------------------------------------
+
+    def hand_to(self, session):
+        """
+        Make a session the protocol of this connection.
+
+        The session sees it as a new connection, followed by anything the
+        target has sent so far.
+        """
+        if self.lost:
+            # gone while the handoff was pending; connect the usual way
+            return session.connect()
+        if self.pool.loop is None:
+            self.transport.protocol = session
+            session.makeConnection(self.transport)
+        else:
+            self.transport.set_protocol(session)
+            session.connection_made(self.transport)
+        data = b"".join(self.buffer)
+        self.buffer = []
+        if data:
+            session.dataReceived(data)
+
+    def close(self):
+        if self.pool.loop is None:
+            self.transport.loseConnection()
+        else:
+            self.transport.close()
+
+
+class ConnectionPool(object):
+    """
+    TCP connections to one target, opened before sessions need them.
+
+    Sessions given the pool take a connection from it whenever they
+    connect, and dial the target themselves only when none is ready. The
+    pool is refilled as connections are taken. Connections the target closes
+    while waiting are dropped; they are replaced on the next take, so a
+    target that refuses idle connections isn't hammered.
+
+    All sessions sharing a pool must connect from the same local address,
+    the pool's ``bind``.
+    """
+
+    def __init__(self, neighbor, port=179, size=4, bind=None, loop=None):
+        """
+        Create a new ConnectionPool.
+
+        :param neighbor: ipv4 address of the target
+        :param port: tcp port of the target
+        :param size: connections to keep ready
+        :param bind: local ipv4 address to connect from
+        :param loop: asyncio event loop of the sessions, or None for the
+            Twisted reactor
+
+        :type neighbor: str
+        :type port: int
+        :type size: int
+        :type bind: str
+        """
+        self.neighbor = neighbor
+        self.port = port
+        self.size = size
+        self.bind = bind
+        self.loop = loop
+        self.point = None
+        # connected spares, oldest first
+        self.idle = []
+        self.connecting = 0
+        self.stats = Counter()
+
+    def __len__(self):
+        return len(self.idle)
+
+    def fill(self):
+        """Open connections until ``size`` are ready or on their way."""
+        for _ in range(self.size - len(self.idle) - self.connecting):
+            self.connecting += 1
+            self.stats["opened"] += 1
+            self._open(Spare(self))
+        return self
+
+    def _open(self, spare):
+        bind = (self.bind, 0) if self.bind else None
+        if self.loop is None:
+            if self.point is None:
+                self.point = TCP4ClientEndpoint(
+                    reactor, self.neighbor, self.port, bindAddress=bind
+                )
+            connectProtocol(self.point, spare).addErrback(self._failed)
+        else:
+            coro = self.loop.create_connection(
+                lambda: spare, self.neighbor, self.port, local_addr=bind
+            )
+            self.loop.create_task(coro).add_done_callback(self._connect_done)
+
+    def _connect_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            self._failed(Failure(task.exception()))
+
+    def _failed(self, failure):
+        self.connecting -= 1
+        self.stats["failed"] += 1
+
+    def _ready(self, spare):
+        self.connecting -= 1
+        self.idle.append(spare)
+
+    def _lost(self, spare):
+        if spare in self.idle:
+            self.idle.remove(spare)
+            self.stats["lost"] += 1
+
+    def hand_to(self, session):
+        """
+        Give a session a ready connection, if there is one.
+
+        The handoff happens on the next loop iteration, once the session has
+        finished starting its connect.
+
+        :return: whether the session got a connection
+        :rtype: bool
+        """
+        spare = self.idle.pop(0) if self.idle else None
+        self.fill()
+        if spare is None:
+            self.stats["misses"] += 1
+            return False
+        self.stats["taken"] += 1
+        session.call_later(0, spare.hand_to, session)
+        return True
+
+    def close(self):
+        """Close every connection still waiting."""
+        idle, self.idle = self.idle, []
+        for spare in idle:
+            spare.close()
@@ -46,47 +46,80 @@ class NephProtocol(object):
 
 
 class NephTimer(object):
-    """Timer implementation based on Twisted."""
+    """
+    Periodic timer for protocol sessions.
+
+    Timers run on a :class:`protos.wheel.TimerWheel` when one is given, and
+    on their own Twisted ``LoopingCall`` otherwise. Values may be fractional.
+    """
 
     def errback(failure):
         """Print error traceback."""
         print(failure.getBriefTraceback())
 
-    def __init__(self, time, name=None, handler=None, logger=None):
+    def __init__(self, time, name=None, handler=None, logger=None, wheel=None):
         """
         Create a new NephTimer.
 
         .. param name:: name of this timer
-        .. param time:: value of timer
+        .. param time:: value of timer, in seconds
         .. param handler::
+        .. param wheel:: timer wheel to schedule on
         """
         self.name = name or "unnamed"
-        self.time = int(time)
+        self.time = time
         self.handler = handler
-        self.timer = task.LoopingCall(self.handler)
+        self.wheel = wheel
+        self.entry = None
+        self.timer = None if wheel is not None else task.LoopingCall(self.handler)
         self.log = logging.getLogger(logger)
 
+    @property
+    def running(self):
+        if self.wheel is not None:
+            return self.entry is not None and self.entry.active
+        return self.timer.running
+
+    def _fire(self):
+        # rearm first, so that the handler can stop or restart the timer
+        self.entry = self.wheel.add(self.time, self._fire)
+        self.handler()
+
     def start(self):
         if self.time <= 0:
-            raise ValueException("Timer value must be positive")
+            raise ValueError("Timer value must be positive")
 
-        self.log.info("[+] Starting timer {}".format(self.name))
-        self.timer.start(self.time, now=False).addErrback(self.errback)
+        self.log.info("[+] Starting timer %s", self.name)
+        if self.wheel is not None:
+            if self.entry is not None:
+                self.wheel.cancel(self.entry)
+            self.entry = self.wheel.add(self.time, self._fire)
+        else:
+            self.timer.start(self.time, now=False).addErrback(self.errback)
 
     def stop(self):
-        self.log.info("[+] Stopping timer {}".format(self.name))
-        if self.timer.running:
-            self.timer.stop()
+        self.log.info("[+] Stopping timer %s", self.name)
+        if not self.running:
+            self.log.info("[+] Timer %s already stopped", self.name)
+        elif self.wheel is not None:
+            self.wheel.cancel(self.entry)
+            self.entry = None
         else:
-            self.log.info("[+] Timer {} already stopped".format(self.name))
+            self.timer.stop()
 
     def restart(self):
+        running = self.running
         self.log.info(
-            "[+] Restarting {} timer {} ({}s)".format(
-                self.name, "running" if self.timer.running else "stopped", self.time
-            )
+            "[+] Restarting %s timer %s (%ss)",
+            self.name,
+            "running" if running else "stopped",
+            self.time,
         )
-        if self.timer.running:
+        if running and self.wheel is None:
             self.timer.reset()
         else:
             self.start()
+
+    def reset(self):
+        """Alias for :meth:`restart`."""
+        self.restart()
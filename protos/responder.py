@@ -0,0 +1,133 @@
+# Loopback BGP stand-in peer.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Usage: python3 -m protos.responder [--port PORT] [--interface ADDRESS]
+
+from collections import Counter
+from socket import inet_aton
+from twisted.internet import reactor
+from twisted.internet.protocol import Factory, Protocol
+from protos.framing import Framer
+import struct
+
+
+class BGPResponder(Protocol):
+    """
+    Minimal passive BGP speaker.
+
+    Answers an OPEN with an OPEN and a KEEPALIVE, echoes every KEEPALIVE and
+    drops the connection on NOTIFICATION. Nothing received is validated
+    beyond framing; this is a stand-in target for exercising neph itself, not
+    a BGP implementation.
+    """
+
+    HEADER_SIZE = 19
+    MARKER = b"\xff" * 16
+    KEEPALIVE = MARKER + b"\x00\x13\x04"
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.inbuf = Framer(self.HEADER_SIZE, 16, max_size=4096, marker=self.MARKER)
+
+    def connectionMade(self):
+        self.factory.stats["connections"] += 1
+
+    def connectionLost(self, reason):
+        self.factory.stats["disconnections"] += 1
+
+    def dataReceived(self, data):
+        self.inbuf.write(data)
+        self.inbuf.drain(self.msgReceived, self.headerError)
+
+    def headerError(self, header):
+        self.factory.stats["errors"] += 1
+        self.inbuf.clear()
+        self.transport.loseConnection()
+
+    def msgReceived(self, msg):
+        msgtype = msg[18]
+        stats = self.factory.stats
+        stats["received"] += 1
+        stats["type{}".format(msgtype)] += 1
+
+        if msgtype == 1:
+            self.transport.writeSequence([self.factory.open, self.KEEPALIVE])
+        elif msgtype == 4:
+            self.transport.write(self.KEEPALIVE)
+        elif msgtype == 3:
+            self.transport.loseConnection()
+
+
+class BGPResponderFactory(Factory):
+    """
+    Factory for :class:`BGPResponder` connections.
+
+    Tracks aggregate counters for all connections in ``stats``.
+    """
+
+    def __init__(self, my_as=65000, bgp_id="127.0.0.1", hold_time=90):
+        """
+        Create a new BGPResponderFactory.
+
+        :param my_as: autonomous system number sent in OPEN
+        :param bgp_id: bgp identifier sent in OPEN
+        :param hold_time: hold time sent in OPEN
+
+        :type my_as: int
+        :type bgp_id: str
+        :type hold_time: int
+        """
+        self.stats = Counter()
+        self.open = (
+            BGPResponder.MARKER
+            + struct.pack("!HBBHH", 29, 1, 4, my_as & 0xFFFF, hold_time)
+            + inet_aton(bgp_id)
+            + b"\x00"
+        )
+
+    def buildProtocol(self, addr):
+        return BGPResponder(self)
+
+
+def listen(port=0, interface="127.0.0.1", **kwargs):
+    """
+    Start a stand-in peer in the running reactor.
+
+    :param port: TCP port to listen on; 0 picks a free one
+    :param interface: address to listen on
+    :param kwargs: passed through to :class:`BGPResponderFactory`
+    :return: the listening port; ``getHost().port`` gives the port number
+    :rtype: twisted.internet.interfaces.IListeningPort
+    """
+    factory = BGPResponderFactory(**kwargs)
+    return reactor.listenTCP(port, factory, backlog=1024, interface=interface)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a stand-in BGP peer.")
+    parser.add_argument("--port", type=int, default=179, help="TCP port")
+    parser.add_argument("--interface", default="127.0.0.1", help="address")
+    parser.add_argument("--as", dest="my_as", type=int, default=65000, help="ASN")
+    args = parser.parse_args(argv)
+    listen(args.port, args.interface, my_as=args.my_as)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Pre-serialized message templates for neph protocols.
+# ----------------------------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class Template(object):
+    """
+    A serialized message with patchable fixed-width fields.
+
+    Rendering copies the serialized bytes, overwrites the requested fields and
+    optionally appends a variable-length payload, fixing up the message length
+    field to match.
+    """
+
+    def __init__(self, data, fields=None, length=None):
+        """
+        Create a new Template.
+
+        :param data: serialized message
+        :param fields: mapping of field name to (offset, size)
+        :param length: (offset, size) of the message length field, if any
+
+        :type data: bytes
+        :type fields: dict
+        :type length: tuple
+        """
+        self.data = bytes(data)
+        self.fields = fields or {}
+        self.length = length
+
+    def render(self, payload=b"", **values):
+        """
+        Render the template.
+
+        Integer values are encoded big-endian to the width of their field;
+        bytes values must match it exactly.
+
+        :param payload: bytes to append after the serialized message
+        :param values: field values to patch in
+        :return: the serialized message
+        :raises KeyError: if a field is not part of this template
+        :raises ValueError: if a value does not fit its field
+        :raises OverflowError: if an integer value does not fit its field
+
+        :rtype: bytes
+        """
+        if not values and not payload:
+            return self.data
+
+        buf = bytearray(self.data)
+        buf += payload
+        for name, value in values.items():
+            off, size = self.fields[name]
+            if isinstance(value, int):
+                value = value.to_bytes(size, "big")
+            elif len(value) != size:
+                raise ValueError("{} must be {} bytes".format(name, size))
+            buf[off : off + size] = value
+
+        if payload and self.length:
+            off, size = self.length
+            buf[off : off + size] = len(buf).to_bytes(size, "big")
+
+        return bytes(buf)
+
+
+class TemplateCache(object):
+    """
+    Cache of message templates.
+
+    Keys should identify everything about a message that affects its layout;
+    everything else belongs in the template's patchable fields.
+    """
+
+    def __init__(self):
+        self.templates = {}
+
+    def __len__(self):
+        return len(self.templates)
+
+    def get(self, key, build):
+        """
+        Look up a template, building it on first use.
+
+        :param key: cache key
+        :param build: called with no arguments to produce the Template
+        :rtype: Template
+        """
+        template = self.templates.get(key)
+        if template is None:
+            template = self.templates[key] = build()
+        return template
+
+    def clear(self):
+        """Drop all cached templates."""
+        self.templates.clear()
@@ -0,0 +1,387 @@
+# Binary session tracing.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Sessions write one fixed-size RECORD per traced event into a preallocated
+# ring buffer instead of formatting a log line:
+#
+#   u64 monotonic timestamp, in nanoseconds
+#   u32 session id
+#   u16 event id
+#   u8  session state id
+#   u8  code; the message type for message events
+#   u32 value; a length, or the id of a name
+#
+# Nothing is formatted until the trace is rendered. Event, session and state
+# names are interned in tables kept alongside the records, so a dumped trace
+# can be decoded offline:
+#
+#   python3 -m protos.trace <trace file> [--sessions]
+#
+# A trace file is MAGIC, the length of a JSON header holding the tables as a
+# u32, the header, and then the records, oldest first.
+
+from protos.codec import MESSAGE_NAMES
+import json
+import struct
+import time
+
+MAGIC = b"NEPHTRC\x01"
+RECORD = struct.Struct("<QIHBBI")
+HEADER_LENGTH = struct.Struct("<I")
+
+# Fixed events; FSM events are interned after them by name
+(
+    RECV,
+    SEND,
+    BUILD,
+    DATA,
+    CONNECTED,
+    LOST,
+    CONNECT_FAILED,
+    UPDATE_STREAM,
+    BURST,
+    SESSION,
+) = range(10)
+
+EVENTS = [
+    "recv",
+    "send",
+    "build",
+    "data",
+    "connected",
+    "lost",
+    "connect-failed",
+    "update-stream",
+    "burst",
+    "session",
+]
+EVENT_IDS = {name: i for i, name in enumerate(EVENTS)}
+
+# Matches the format neph.py configures for logging
+LOG_FORMAT = "{time} INFO {message}"
+
+
+class Tracer(object):
+    """
+    Ring buffer of binary trace records.
+
+    When the buffer is full the oldest records are overwritten.
+    """
+
+    def __init__(self, capacity=1 << 16, sample=1):
+        """
+        Create a new Tracer.
+
+        :param capacity: number of records kept, rounded up to a power of two
+        :param sample: keep one in every ``sample`` records passed to
+            :meth:`record`; records passed to :meth:`mark` are always kept
+        """
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self.capacity = size
+        self.mask = size - 1
+        self.buf = bytearray(size * RECORD.size)
+        self.sample = sample
+        self.countdown = sample
+        # total records written, including overwritten ones
+        self.count = 0
+        self.enabled = True
+        self.names = list(EVENTS)
+        self.nameids = {name: i for i, name in enumerate(self.names)}
+        self.sessions = []
+        # ids of released sessions, reused before the table grows
+        self.free = []
+        self.statesets = []
+        self.stateids = {}
+        self.started = time.time()
+        self.origin = time.monotonic_ns()
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def intern(self, name):
+        """
+        Get the id of a name, adding it to the name table if it's new.
+
+        :rtype: int
+        """
+        nameid = self.nameids.get(name)
+        if nameid is None:
+            nameid = self.nameids[name] = len(self.names)
+            self.names.append(name)
+        return nameid
+
+    def session(self, label, states=()):
+        """
+        Register a session.
+
+        Ids given back with :meth:`release` are reused, so the session table
+        only grows with the number of sessions alive at once. A SESSION record
+        is marked with the label, so records left in the buffer by an id's
+        previous owner still render under that owner's label.
+
+        :param label: name the session is rendered under
+        :param states: names of the session's states, by state id
+        :return: session id to record events under
+        :rtype: int
+        """
+        states = tuple(states)
+        stateset = self.stateids.get(states)
+        if stateset is None:
+            stateset = self.stateids[states] = len(self.statesets)
+            self.statesets.append(list(states))
+        if self.free:
+            session = self.free.pop()
+            self.sessions[session] = (label, stateset)
+        else:
+            session = len(self.sessions)
+            self.sessions.append((label, stateset))
+        self.mark(session, SESSION, 0, stateset & 0xFF, self.intern(label))
+        return session
+
+    def release(self, session):
+        """Give back the id of a session that won't record any more events."""
+        self.free.append(session)
+
+    def record(self, session, event, state, code=0, value=0):
+        """Record an event, subject to sampling."""
+        if not self.enabled:
+            return
+        if self.sample != 1:
+            self.countdown -= 1
+            if self.countdown:
+                return
+            self.countdown = self.sample
+        RECORD.pack_into(
+            self.buf,
+            (self.count & self.mask) * RECORD.size,
+            time.monotonic_ns(),
+            session,
+            event,
+            state,
+            code,
+            value,
+        )
+        self.count += 1
+
+    def mark(self, session, event, state, code=0, value=0):
+        """Record an event regardless of sampling."""
+        if not self.enabled:
+            return
+        RECORD.pack_into(
+            self.buf,
+            (self.count & self.mask) * RECORD.size,
+            time.monotonic_ns(),
+            session,
+            event,
+            state,
+            code,
+            value,
+        )
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+        self.countdown = self.sample
+
+    def records(self):
+        """
+        Generate the buffered records, oldest first.
+
+        :return: generator of (timestamp, session, event, state, code, value)
+        """
+        first = max(0, self.count - self.capacity)
+        for n in range(first, self.count):
+            yield RECORD.unpack_from(self.buf, (n & self.mask) * RECORD.size)
+
+    def header(self):
+        """Tables needed to decode the records."""
+        return {
+            "started": self.started,
+            "origin": self.origin,
+            "names": self.names,
+            "sessions": self.sessions,
+            "statesets": self.statesets,
+            "dropped": max(0, self.count - self.capacity),
+            "sample": self.sample,
+        }
+
+    def dump(self, path):
+        """
+        Write the buffered records to a trace file.
+
+        :return: number of records written
+        :rtype: int
+        """
+        header = json.dumps(self.header()).encode()
+        first = max(0, self.count - self.capacity)
+        start = (first & self.mask) * RECORD.size
+        end = (self.count & self.mask) * RECORD.size
+        with open(path, "wb") as f:
+            f.write(MAGIC)
+            f.write(HEADER_LENGTH.pack(len(header)))
+            f.write(header)
+            if self.count > self.capacity or (self.count and end <= start):
+                f.write(self.buf[start:])
+                f.write(self.buf[:end])
+            else:
+                f.write(self.buf[start:end])
+        return len(self)
+
+    def render(self, sessions=False):
+        """Render the buffered records; see :func:`render`."""
+        return render(self.header(), self.records(), sessions)
+
+
+class Trace(object):
+    """A trace file written by :meth:`Tracer.dump`."""
+
+    def __init__(self, path):
+        """
+        Read a trace file.
+
+        :raises ValueError: if the file isn't a trace
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[: len(MAGIC)] != MAGIC:
+            raise ValueError("Not a trace file")
+        pos = len(MAGIC)
+        (length,) = HEADER_LENGTH.unpack_from(data, pos)
+        pos += HEADER_LENGTH.size
+        self.header = json.loads(data[pos : pos + length].decode())
+        self.data = memoryview(data)[pos + length :]
+
+    def __len__(self):
+        return len(self.data) // RECORD.size
+
+    def records(self):
+        """Generate the records, oldest first."""
+        end = len(self) * RECORD.size
+        for pos in range(0, end, RECORD.size):
+            yield RECORD.unpack_from(self.data, pos)
+
+    def render(self, sessions=False):
+        """Render the records; see :func:`render`."""
+        return render(self.header, self.records(), sessions)
+
+
+# Decoding ---------------------------------------------------------------------
+
+
+def _messages(names, states, event, state, code, value):
+    # fixed events are matched by name, so traces stay readable when events
+    # are added
+    name = names[event]
+    event = EVENT_IDS.get(name)
+    if event == RECV:
+        msgtype = MESSAGE_NAMES.get(code, "NONE")
+        yield "[<] {}".format(msgtype)
+        yield "    | len: {}".format(value)
+        yield "    | type: {} ({})".format(msgtype, code)
+    elif event == SEND:
+        yield "[>] {}".format(names[value])
+    elif event == BUILD:
+        yield "Calling builder for: {}".format(names[value])
+    elif event == DATA:
+        yield "[=] Twisted: Data received"
+    elif event == CONNECTED:
+        yield "[=] Twisted: Connection made"
+    elif event == LOST:
+        yield "[=] Twisted: Connection lost"
+    elif event == CONNECT_FAILED:
+        yield "[=] Twisted: Connection failed"
+    elif event == UPDATE_STREAM:
+        yield "[>] UPDATE stream"
+    elif event == BURST:
+        yield "[>] Burst of {} messages".format(value)
+    elif event == SESSION:
+        return
+    else:
+        statename = states[state] if state < len(states) else state
+        yield "[+] Event '{}' in state '{}'".format(name, statename)
+
+
+def render(header, records, sessions=False):
+    """
+    Render trace records as log lines, in the format neph logs in.
+
+    :param header: tables from :meth:`Tracer.header`
+    :param records: iterable of records
+    :param sessions: prefix each message with the label of its session
+    :return: generator of lines
+    """
+    names = header["names"]
+    labels = header["sessions"]
+    statesets = header["statesets"]
+    started = header["started"]
+    origin = header["origin"]
+    # owners of reused ids, as of the record being rendered
+    owners = {}
+    session_event = names.index("session") if "session" in names else None
+    for stamp, session, event, state, code, value in records:
+        if event == session_event:
+            owners[session] = (names[value], code)
+        if session in owners:
+            label, stateset = owners[session]
+            states = statesets[stateset] if stateset < len(statesets) else ()
+        elif session < len(labels):
+            label, stateset = labels[session]
+            states = statesets[stateset]
+        else:
+            label, states = str(session), ()
+        clock = time.strftime(
+            "%H:%M:%S", time.localtime(started + (stamp - origin) / 1e9)
+        )
+        for message in _messages(names, states, event, state, code, value):
+            if sessions:
+                message = "[{}] {}".format(label, message)
+            yield LOG_FORMAT.format(time=clock, message=message)
+
+
+_tracer = None
+
+
+def tracer():
+    """The tracer shared by all sessions that aren't given their own."""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Decode a neph trace file.")
+    parser.add_argument("path", help="trace file")
+    parser.add_argument(
+        "--sessions", action="store_true", help="prefix lines with their session"
+    )
+    args = parser.parse_args(argv)
+    trace = Trace(args.path)
+    if trace.header["dropped"]:
+        print("# {} older records dropped".format(trace.header["dropped"]))
+    if trace.header["sample"] != 1:
+        print("# sampled 1 in {}".format(trace.header["sample"]))
+    for line in trace.render(args.sessions):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
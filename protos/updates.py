@@ -0,0 +1,164 @@
+# Streaming BGP UPDATE generation.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from collections import OrderedDict
+from twisted.internet.interfaces import IPullProducer
+from zope.interface import implementer
+from protos import codec
+import struct
+
+# Header, withdrawn routes length and total path attribute length
+UPDATE_OVERHEAD = codec.HEADER_SIZE + 4
+
+# Largest encoded IPv4 prefix
+MAX_PREFIX_SIZE = 5
+
+
+def prefix_range(first, count, plen):
+    """
+    Generate consecutive encoded IPv4 prefixes.
+
+    :param first: first prefix, in ``a.b.c.d/len`` notation or as an address
+    :param count: number of prefixes
+    :param plen: prefix length of each prefix
+    :return: generator of encoded prefixes
+    """
+    addr = struct.unpack("!I", codec.encode_prefix(first)[1:].ljust(4, b"\x00"))[0]
+    step = 1 << (32 - plen)
+    size = 1 + (plen + 7) // 8
+    for i in range(count):
+        yield struct.pack("!BI", plen, (addr + i * step) & 0xFFFFFFFF)[:size]
+
+
+def pack_updates(routes, max_size=4096, max_groups=64):
+    """
+    Pack a stream of routes into as few UPDATE messages as possible.
+
+    Routes sharing path attributes are grouped into the same message, and
+    each message is filled with as much NLRI as fits in ``max_size`` bytes.
+    Only up to ``max_groups`` partially filled messages are held at once;
+    when another attribute set shows up, the least recently used group is
+    sent as is. Memory use is therefore bounded regardless of table size.
+
+    :param routes: iterable of (path attributes, prefix). Path attributes are
+        either serialized bytes or a tuple of PathAttribute, and must be
+        hashable; None means the prefix is withdrawn instead. Prefixes are in
+        ``a.b.c.d/len`` notation or already encoded.
+    :param max_size: maximum message size
+    :param max_groups: maximum number of attribute sets held at once
+    :return: generator of serialized UPDATE messages
+    :raises ValueError: if a set of path attributes leaves no room for NLRI
+    """
+    # path attributes -> [serialized attributes, prefixes, room for prefixes]
+    groups = OrderedDict()
+    for attrs, prefix in routes:
+        group = groups.get(attrs)
+        if group is None:
+            if len(groups) >= max_groups:
+                oldest, (encoded, prefixes, _) = groups.popitem(last=False)
+                if prefixes:
+                    yield _update(oldest, encoded, prefixes)
+            encoded = b"" if attrs is None else attrs
+            if not isinstance(encoded, (bytes, bytearray)):
+                encoded = codec.encode_path_attrs(encoded)
+            room = max_size - UPDATE_OVERHEAD - len(encoded)
+            if room < MAX_PREFIX_SIZE:
+                raise ValueError("Path attributes too large for one message")
+            group = groups[attrs] = [encoded, bytearray(), room]
+        else:
+            groups.move_to_end(attrs)
+
+        if not isinstance(prefix, (bytes, bytearray)):
+            prefix = codec.encode_prefix(prefix)
+        if len(group[1]) + len(prefix) > group[2]:
+            yield _update(attrs, group[0], group[1])
+            group[1] = bytearray()
+        group[1] += prefix
+
+    for attrs, (encoded, prefixes, _) in groups.items():
+        if prefixes:
+            yield _update(attrs, encoded, prefixes)
+
+
+def _update(attrs, encoded, prefixes):
+    if attrs is None:
+        body = struct.pack("!H", len(prefixes)) + prefixes + b"\x00\x00"
+    else:
+        body = b"\x00\x00" + struct.pack("!H", len(encoded)) + encoded + prefixes
+    return codec.encode(codec.UPDATE, bytes(body))
+
+
+@implementer(IPullProducer)
+class UpdateProducer(object):
+    """
+    Writes a stream of serialized messages to a transport with backpressure.
+
+    Registered as a pull producer, it is asked for more data only once the
+    transport has drained what it wrote last time, so a slow peer throttles
+    generation instead of letting the send buffer grow without bound.
+    """
+
+    def __init__(self, transport, messages, chunk=65536, done=None):
+        """
+        Create a new UpdateProducer.
+
+        :param transport: transport to write to
+        :param messages: iterable of serialized messages
+        :param chunk: bytes to write each time more data is requested
+        :param done: called with the number of messages sent once the stream
+            is exhausted or stopped
+        """
+        self.transport = transport
+        self.messages = iter(messages)
+        self.chunk = chunk
+        self.done = done
+        self.sent = 0
+        self.finished = False
+
+    def start(self):
+        """Register with the transport and start writing."""
+        self.transport.registerProducer(self, False)
+
+    def resumeProducing(self):
+        written = 0
+        batch = []
+        for msg in self.messages:
+            batch.append(msg)
+            written += len(msg)
+            if written >= self.chunk:
+                break
+        else:
+            self.transport.writeSequence(batch)
+            self.sent += len(batch)
+            self.transport.unregisterProducer()
+            self._finish()
+            return
+        self.transport.writeSequence(batch)
+        self.sent += len(batch)
+
+    def stopProducing(self):
+        self._finish()
+
+    def _finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        close = getattr(self.messages, "close", None)
+        if close:
+            close()
+        if self.done:
+            self.done(self.sent)
@@ -0,0 +1,234 @@
+# Hierarchical timer wheel.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Time is divided into ticks of ``resolution`` seconds. The lowest level of
+# the wheel has one slot per tick; each slot of a higher level covers a whole
+# revolution of the level below it. A timer is placed in the lowest level
+# that can hold its deadline, and moved down a level ("cascaded") when the
+# level below comes around to it. Adding and cancelling a timer is a dict
+# insertion or deletion, whatever the number of timers.
+#
+# The wheel asks its event loop for a single wakeup at the next tick that
+# can have timers due, so thousands of session timers cost the loop one
+# scheduled call instead of one each.
+
+import logging
+import math
+import time
+
+# Slots per level, as powers of two
+LEVEL_BITS = (8, 6, 6, 6)
+
+
+class WheelTimer(object):
+    """A timer scheduled on a TimerWheel; returned by :meth:`TimerWheel.add`."""
+
+    __slots__ = ("deadline", "callback", "bucket")
+
+    def __init__(self, deadline, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.bucket = None
+
+    @property
+    def active(self):
+        return self.bucket is not None
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timer wheel.
+
+    Callbacks run no earlier than their delay, and at most one tick late.
+    """
+
+    def __init__(self, call_later, resolution=0.01, clock=time.monotonic):
+        """
+        Create a new TimerWheel.
+
+        :param call_later: schedules a call on the event loop, as
+            ``call_later(delay, fn)``; must return an object with ``cancel()``
+        :param resolution: length of a tick, in seconds
+        :param clock: monotonic clock, in seconds
+        """
+        self.call_later = call_later
+        self.resolution = resolution
+        self.clock = clock
+        self.origin = clock()
+        self.levels = [[{} for _ in range(1 << bits)] for bits in LEVEL_BITS]
+        self.shifts = []
+        shift = 0
+        for bits in LEVEL_BITS:
+            self.shifts.append(shift)
+            shift += bits
+        self.span = 1 << shift
+        # last tick processed
+        self.tick = 0
+        self.count = 0
+        # pending wakeup, and the tick it is for
+        self.wakeup = None
+        self.wakeup_tick = None
+        self.log = logging.getLogger("TimerWheel")
+
+    def __len__(self):
+        return self.count
+
+    def now(self):
+        """Current tick."""
+        # the epsilon stops a wakeup scheduled for the exact start of a tick
+        # from rounding down to the tick before it
+        return int((self.clock() - self.origin) / self.resolution + 1e-6)
+
+    def add(self, delay, callback):
+        """
+        Schedule a callback.
+
+        :param delay: seconds from now
+        :param callback: called with no arguments
+        :rtype: WheelTimer
+        """
+        if not self.count:
+            self.tick = self.now()
+        deadline = math.ceil((self.clock() - self.origin + delay) / self.resolution)
+        timer = WheelTimer(max(deadline, self.tick + 1), callback)
+        self._place(timer)
+        self.count += 1
+        if self.wakeup_tick is None or timer.deadline < self.wakeup_tick:
+            self._schedule(timer.deadline)
+        return timer
+
+    def cancel(self, timer):
+        """Cancel a timer; does nothing if it already fired or was cancelled."""
+        if timer.bucket is not None:
+            del timer.bucket[timer]
+            timer.bucket = None
+            self.count -= 1
+
+    def reschedule(self, timer, delay):
+        """
+        Move a timer to a new deadline.
+
+        :return: the timer, which is rescheduled even if it already fired
+        :rtype: WheelTimer
+        """
+        self.cancel(timer)
+        return self.add(delay, timer.callback)
+
+    def _place(self, timer):
+        deadline = timer.deadline
+        delta = deadline - self.tick
+        for level, bits in enumerate(LEVEL_BITS):
+            if delta < 1 << (self.shifts[level] + bits):
+                break
+        else:
+            # beyond the top level; park it in the slot visited last, and
+            # place it again when that slot is cascaded
+            deadline = self.tick + self.span - 1
+        slot = (deadline >> self.shifts[level]) & ((1 << bits) - 1)
+        bucket = self.levels[level][slot]
+        bucket[timer] = None
+        timer.bucket = bucket
+
+    def _schedule(self, tick):
+        if self.wakeup is not None:
+            self.wakeup.cancel()
+        self.wakeup_tick = tick
+        delay = max(0, tick * self.resolution - (self.clock() - self.origin))
+        self.wakeup = self.call_later(delay, self._run)
+
+    def _run(self):
+        self.wakeup = self.wakeup_tick = None
+        self.advance(self.now())
+        # callbacks may have added timers, and with them a wakeup that is
+        # later than timers already waiting
+        if self.count:
+            tick = self._next_tick()
+            if self.wakeup_tick is None or tick < self.wakeup_tick:
+                self._schedule(tick)
+
+    def advance(self, target):
+        """
+        Process every tick up to and including ``target``, running the
+        callbacks that are due.
+        """
+        level0 = self.levels[0]
+        mask0 = len(level0) - 1
+        while self.tick < target:
+            if not self.count:
+                self.tick = target
+                break
+            self.tick += 1
+            tick = self.tick
+            if not tick & mask0:
+                self._cascade(1)
+            slot = tick & mask0
+            bucket = level0[slot]
+            if not bucket:
+                continue
+            level0[slot] = {}
+            # callbacks may cancel other timers of this bucket
+            for timer in list(bucket):
+                if timer.bucket is not bucket:
+                    continue
+                if timer.deadline > tick:
+                    self._place(timer)
+                    continue
+                timer.bucket = None
+                self.count -= 1
+                try:
+                    timer.callback()
+                except Exception:
+                    self.log.exception("Timer callback failed")
+
+    def _cascade(self, level):
+        if level >= len(LEVEL_BITS):
+            return
+        shift = self.shifts[level]
+        mask = (1 << LEVEL_BITS[level]) - 1
+        slot = (self.tick >> shift) & mask
+        if not slot:
+            self._cascade(level + 1)
+        bucket = self.levels[level][slot]
+        if bucket:
+            self.levels[level][slot] = {}
+            for timer in bucket:
+                self._place(timer)
+
+    def _next_tick(self):
+        """Earliest tick that may have callbacks due or timers to cascade."""
+        level0 = self.levels[0]
+        mask0 = len(level0) - 1
+        tick = self.tick + 1
+        boundary = (self.tick | mask0) + 1
+        while tick < boundary:
+            if level0[tick & mask0]:
+                return tick
+            tick += 1
+        return boundary
+
+
+_reactor_wheel = None
+
+
+def reactor_wheel():
+    """The wheel shared by all timers on the Twisted reactor."""
+    global _reactor_wheel
+    if _reactor_wheel is None:
+        from twisted.internet import reactor
+
+        _reactor_wheel = TimerWheel(reactor.callLater)
+    return _reactor_wheel
@@ -0,0 +1,217 @@
+# Batched and segmented writes.
+# -----------------------------------
+# Copyright (c) 2018, Quentin Young.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Messages written one transport.write() at a time cost a call each, and
+# end up in as many send() calls and often as many TCP segments. A
+# WriteBuffer corks a session's writes and hands them to the transport in
+# one writeSequence() once enough bytes are pending or enough time has
+# passed. A SegmentWriter does the opposite, for cases whose segment
+# boundaries matter: it disables Nagle's algorithm and writes each message in
+# its own send(), once everything written before it has been acknowledged.
+# Waiting for the acknowledgement matters on Linux, which otherwise merges
+# small sends into a segment still queued ("autocorking"), Nagle or not.
+
+import fcntl
+import socket
+import struct
+import termios
+import time
+
+# ioctl for the bytes in a socket's send queue not yet acknowledged
+SIOCOUTQ = termios.TIOCOUTQ
+
+# Seconds between checks of the send queue while a SegmentWriter waits for
+# an acknowledgement, doubling from the first up to the second
+POLL_MIN = 0.001
+POLL_MAX = 0.05
+
+
+class WriteBuffer(object):
+    """Coalesces a session's writes, flushing by size or time."""
+
+    def __init__(self, session, max_bytes=65536, max_delay=None):
+        """
+        Create a new WriteBuffer.
+
+        :param session: protocol whose transport is written to on flush
+        :param max_bytes: flush once this many bytes are pending
+        :param max_delay: flush this many seconds after the first pending
+            write, if given; otherwise only size and explicit flushes do
+        """
+        self.session = session
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.chunks = []
+        self.size = 0
+        self.timer = None
+
+    def __len__(self):
+        return self.size
+
+    def write(self, data):
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.size >= self.max_bytes:
+            self.flush()
+        elif self.max_delay is not None and self.timer is None:
+            self.timer = self.session.call_later(self.max_delay, self._expired)
+
+    def writeSequence(self, chunks):
+        for chunk in chunks:
+            self.write(chunk)
+
+    def _expired(self):
+        self.timer = None
+        self.flush()
+
+    def flush(self):
+        """Write everything pending."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.chunks:
+            chunks, self.chunks, self.size = self.chunks, [], 0
+            self.session.transport.writeSequence(chunks)
+
+    def clear(self):
+        """Discard everything pending."""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.chunks = []
+        self.size = 0
+
+
+def transport_socket(transport):
+    """The socket under a Twisted or asyncio transport, or None."""
+    if hasattr(transport, "getHandle"):
+        return transport.getHandle()
+    inner = getattr(transport, "transport", transport)
+    if hasattr(inner, "get_extra_info"):
+        return inner.get_extra_info("socket")
+    return None
+
+
+def set_nodelay(transport, enabled=True):
+    """
+    Set TCP_NODELAY on a transport's socket, if it has one.
+
+    :return: whether the option could be set
+    :rtype: bool
+    """
+    if hasattr(transport, "setTcpNoDelay"):
+        transport.setTcpNoDelay(enabled)
+        return True
+    sock = transport_socket(transport)
+    if sock is None:
+        return False
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(enabled))
+    return True
+
+
+def unacked(sock):
+    """Bytes written to a socket that the peer hasn't acknowledged yet."""
+    buf = fcntl.ioctl(sock.fileno(), SIOCOUTQ, b"\0\0\0\0")
+    return struct.unpack("i", buf)[0]
+
+
+class SegmentWriter(object):
+    """
+    Writes each message in its own TCP segment.
+
+    Each message is written once the previous one has been acknowledged,
+    and the transport's own buffer has drained, so this holds for messages
+    up to the MSS. The send queue is checked every millisecond at first,
+    backing off to every POLL_MAX seconds; if a message isn't acknowledged
+    within ``timeout``, the writer gives up on the rest. Without access to
+    the socket, messages are only spaced out by event loop iterations and
+    ``gap``.
+    """
+
+    def __init__(self, session, messages, gap=0, done=None, timeout=5.0):
+        """
+        Create a new SegmentWriter.
+
+        :param session: connected protocol instance
+        :param messages: iterable of serialized messages
+        :param gap: seconds between messages
+        :param done: called with the number of messages sent when finished
+        :param timeout: seconds to wait for a message to be acknowledged
+            before stopping
+        """
+        self.session = session
+        self.messages = iter(messages)
+        self.gap = gap
+        self.done = done
+        self.timeout = timeout
+        self.sent = 0
+        self.stopped = False
+        # whether the writer stopped because a message went unacknowledged
+        self.timed_out = False
+        self.sock = None
+        # seconds until the next check, and when the current wait began
+        self.poll = POLL_MIN
+        self.waiting = None
+
+    def start(self):
+        transport = self.session.transport
+        set_nodelay(transport)
+        self.sock = transport_socket(transport)
+        self._next()
+        return self
+
+    def stop(self):
+        self.stopped = True
+
+    def _drained(self):
+        if self.sock is None:
+            return True
+        if self.sock.fileno() < 0:
+            self.stopped = True
+            return True
+        transport = self.session.transport
+        # Twisted buffers writes until the socket is writable
+        if getattr(transport, "dataBuffer", b"") or getattr(
+            transport, "_tempDataBuffer", None
+        ):
+            return False
+        # asyncio buffers writes the socket didn't take
+        inner = getattr(transport, "transport", None)
+        if inner is not None and inner.get_write_buffer_size():
+            return False
+        return not unacked(self.sock)
+
+    def _next(self):
+        if not self.stopped and not self._drained():
+            now = time.monotonic()
+            if self.waiting is None:
+                self.waiting = now
+            if now - self.waiting < self.timeout:
+                self.session.call_later(self.poll, self._next)
+                self.poll = min(self.poll * 2, POLL_MAX)
+                return
+            self.stopped = self.timed_out = True
+        self.poll = POLL_MIN
+        self.waiting = None
+        msg = None if self.stopped else next(self.messages, None)
+        if msg is None:
+            if self.done is not None:
+                self.done(self.sent)
+            return
+        self.session.transport.write(msg)
+        self.sent += 1
+        self.session.call_later(self.gap, self._next)
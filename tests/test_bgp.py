@@ -0,0 +1,76 @@
+from protos.bgp import BGP
+from protos.capture import OUT, NullTransport
+import logging
+import numpy as np
+import unittest
+
+
+class RecordingTransport(NullTransport):
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    def writeSequence(self, data):
+        self.written.append(b"".join(data))
+
+
+class ListRecorder(object):
+    def __init__(self):
+        self.chunks = []
+
+    def record(self, direction, data):
+        self.chunks.append((direction, bytes(data)))
+
+
+class BackoffTest(unittest.TestCase):
+    def setUp(self):
+        logging.getLogger("BGP").setLevel(logging.WARNING)
+        self.session = BGP("127.0.0.1", 1, "10.0.0.1")
+        self.session.fast_setup()
+        self.session.call_later = lambda delay, fn, *args: self.delays.append(delay)
+        self.session.running = True
+        self.delays = []
+
+    def accept_and_reset(self):
+        self.session.transport = NullTransport()
+        self.session.connectionMade()
+        self.session.connectionLost(None)
+
+    def test_lost_before_established_backs_off(self):
+        for _ in range(3):
+            self.accept_and_reset()
+        self.assertEqual(self.session.failed_connects, 3)
+        self.assertEqual(self.delays, [0.01, 0.02, 0.04])
+
+    def test_established_resets_backoff(self):
+        self.accept_and_reset()
+        self.session.to_Established()
+        self.session.connectionLost(None)
+        self.assertEqual(self.session.failed_connects, 0)
+        self.assertEqual(self.delays[-1], 0)
+
+
+class BurstTest(unittest.TestCase):
+    KEEPALIVE = b"\xff" * 16 + b"\x00\x13\x04"
+
+    def setUp(self):
+        logging.getLogger("BGP").setLevel(logging.WARNING)
+        self.session = BGP("127.0.0.1", 1, "10.0.0.1")
+        self.session.transport = RecordingTransport()
+        self.batch = np.frombuffer(self.KEEPALIVE * 8, np.uint8).reshape(8, -1)
+
+    def test_array_burst_is_written(self):
+        self.assertEqual(self.session.send_burst(self.batch), 8)
+        self.assertEqual(self.session.transport.written, [self.KEEPALIVE * 8])
+
+    def test_array_burst_is_written_while_recorded(self):
+        self.session.recorder = ListRecorder()
+        self.assertEqual(self.session.send_burst(self.batch), 8)
+        self.assertEqual(self.session.transport.written, [self.KEEPALIVE * 8])
+        self.assertEqual(self.session.recorder.chunks, [(OUT, self.KEEPALIVE)] * 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
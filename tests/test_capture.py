@@ -0,0 +1,73 @@
+from protos.bgp import BGP
+from protos.capture import IN, OUT, Capture, NullTransport, Recorder, feed
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+KEEPALIVE = b"\xff" * 16 + b"\x00\x13\x04"
+
+
+class CaptureTest(unittest.TestCase):
+    def setUp(self):
+        logging.getLogger("BGP").setLevel(logging.WARNING)
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "session.cap")
+
+    def test_round_trip(self):
+        with Recorder(self.path) as rec:
+            rec.record(OUT, b"abc", stamp=1000)
+            rec.record(IN, b"de", stamp=3000)
+            rec.record(OUT, b"", stamp=2000000000)
+        with Capture(self.path) as cap:
+            records = [(t, d, bytes(data)) for t, d, data in cap]
+            self.assertEqual(
+                records, [(0.0, OUT, b"abc"), (2e-6, IN, b"de"), (2.0 - 1e-6, OUT, b"")]
+            )
+            self.assertEqual(list(cap.chunks(IN)), [b"de"])
+
+    def test_truncated_record_ends_capture(self):
+        with Recorder(self.path) as rec:
+            rec.record(OUT, b"abc")
+            rec.record(OUT, b"defgh")
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 2)
+        with Capture(self.path) as cap:
+            self.assertEqual(list(cap.chunks(OUT)), [b"abc"])
+
+    def test_not_a_capture(self):
+        with open(self.path, "wb") as f:
+            f.write(b"x" * 32)
+        with self.assertRaises(ValueError):
+            Capture(self.path)
+
+    def test_sent_messages_are_one_chunk_each(self):
+        session = BGP("127.0.0.1", 1, "10.0.0.1")
+        session.transport = NullTransport()
+        with Recorder(self.path) as rec:
+            session.recorder = rec
+            session.send_burst([KEEPALIVE, KEEPALIVE])
+            session.cork()
+            session.send_bgp_msg("KEEPALIVE")
+            session.send_bgp_msg("KEEPALIVE")
+            session.uncork()
+        with Capture(self.path) as cap:
+            self.assertEqual(list(cap.chunks(OUT)), [KEEPALIVE] * 4)
+
+    def test_feed(self):
+        with Recorder(self.path) as rec:
+            rec.record(IN, KEEPALIVE * 2 + KEEPALIVE[:5])
+            rec.record(IN, KEEPALIVE[5:])
+        session = BGP("127.0.0.1", 1, "10.0.0.1")
+        session.to_Established()
+        received = []
+        session.recv_bgp_msg = lambda msgtype, msglen, msg: received.append(msgtype)
+        with Capture(self.path) as cap:
+            self.assertEqual(feed(session, cap), 3 * len(KEEPALIVE))
+        self.assertEqual(received, [4, 4, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
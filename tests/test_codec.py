@@ -0,0 +1,84 @@
+from bench.codec import check
+from protos import codec
+from protos.bgp import BGP
+import logging
+import struct
+import unittest
+
+
+def header(body, msgtype):
+    return codec.MARKER + struct.pack("!HB", codec.HEADER_SIZE + len(body), msgtype)
+
+
+class ScapyRoundTripTest(unittest.TestCase):
+    def test_matches_scapy(self):
+        self.assertEqual(check(500, seed=1), [])
+
+
+class MalformedTest(unittest.TestCase):
+    def test_short_open(self):
+        msg = codec.decode(header(b"\x04\x00", codec.OPEN) + b"\x04\x00")
+        with self.assertRaises(codec.MalformedMessage):
+            msg.hold_time
+
+    def test_open_params_overrun(self):
+        body = struct.pack("!BHH4sB", 4, 1, 90, b"\x0a\x00\x00\x01", 8) + b"\x02\x06"
+        msg = codec.decode(header(body, codec.OPEN) + body)
+        with self.assertRaises(codec.MalformedMessage):
+            msg.opt_params
+
+    def test_truncated_opens(self):
+        full = codec.encode_open(1, 90, "10.0.0.1")
+        for cut in range(codec.HEADER_SIZE, len(full)):
+            body = full[codec.HEADER_SIZE : cut]
+            msg = codec.decode(header(body, codec.OPEN) + body)
+            with self.assertRaises(codec.MalformedMessage):
+                msg.decode_body()
+
+    def test_withdrawn_overrun(self):
+        body = b"\x00\x10\x18\x0a\x00"
+        msg = codec.decode(header(body, codec.UPDATE) + body)
+        with self.assertRaises(codec.MalformedMessage):
+            msg.withdrawn_routes
+
+    def test_truncated_updates(self):
+        attrs = [codec.PathAttribute(codec.ATTR_TRANSITIVE, 1, b"\x00")]
+        full = codec.encode_update(["10.0.0.0/24"], attrs, ["10.1.0.0/16"])
+        # cut right before the NLRI, it is a valid UPDATE announcing nothing
+        nlri_start = len(full) - 3
+        for cut in range(codec.HEADER_SIZE, len(full)):
+            body = full[codec.HEADER_SIZE : cut]
+            msg = codec.decode(header(body, codec.UPDATE) + body)
+            if cut == nlri_start:
+                self.assertEqual(msg.nlri, [])
+                continue
+            with self.assertRaises(codec.MalformedMessage):
+                msg.decode_body()
+
+    def test_short_notification(self):
+        msg = codec.decode(header(b"\x06", codec.NOTIFICATION) + b"\x06")
+        with self.assertRaises(codec.MalformedMessage):
+            msg.error_code
+
+
+class MalformedEventTest(unittest.TestCase):
+    def test_handler_error_becomes_fsm_event(self):
+        logging.getLogger("BGP").setLevel(logging.WARNING)
+        session = BGP("127.0.0.1", 1, "10.0.0.1")
+        session.to_Established()
+        events = []
+        # a handler that reads the body, and one for the error event
+        session.dispatch = dict(session.dispatch)
+        session.dispatch[(BGP.ESTABLISHED, "UpdateMsg")] = lambda self, msg: msg.nlri
+        session.dispatch[(BGP.ESTABLISHED, "UpdateMsgErr")] = (
+            lambda self, msg: events.append(msg)
+        )
+        body = b"\x00\x10\x18\x0a\x00"
+        msg = header(body, codec.UPDATE) + body
+        session.recv_bgp_msg(codec.UPDATE, len(msg), msg)
+        self.assertEqual(len(events), 1)
+        self.assertIsInstance(events[0], codec.Update)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+from protos.framing import Framer
+import unittest
+
+MARKER = b"\xff" * 16
+
+
+def message(body=b"", msgtype=4):
+    return MARKER + (19 + len(body)).to_bytes(2, "big") + bytes([msgtype]) + body
+
+
+class FramerTest(unittest.TestCase):
+    def setUp(self):
+        self.framer = Framer(19, 16, max_size=4096, marker=MARKER)
+        self.received = []
+        self.errors = []
+
+    def drain(self):
+        return self.framer.drain(
+            lambda msg: self.received.append(bytes(msg)),
+            lambda hdr: self.errors.append(bytes(hdr)),
+        )
+
+    def test_drains_backlog_and_keeps_partial(self):
+        msgs = [message(), message(b"\x01\x02"), message(b"\x03" * 10)]
+        data = b"".join(msgs) + msgs[0][:7]
+        self.framer.write(data)
+        self.assertEqual(self.drain(), 3)
+        self.assertEqual(self.received, msgs)
+        self.assertEqual(len(self.framer), 7)
+        self.framer.write(msgs[0][7:])
+        self.assertEqual(self.drain(), 1)
+        self.assertEqual(len(self.framer), 0)
+
+    def test_bytes_one_at_a_time(self):
+        msg = message(b"\x05" * 4)
+        for b in msg:
+            self.framer.write(bytes([b]))
+            self.drain()
+        self.assertEqual(self.received, [msg])
+
+    def test_invalid_headers(self):
+        self.framer.write(b"\x00" * 19)
+        self.assertEqual(self.drain(), 0)
+        self.assertEqual(self.errors, [b"\x00" * 19])
+        self.framer.clear()
+        self.framer.write(MARKER + b"\x00\x05\x04")
+        self.drain()
+        self.assertEqual(len(self.errors), 2)
+
+    def test_handler_keeping_views(self):
+        kept = []
+        msgs = [message(b"\x01"), message(b"\x02")]
+        self.framer.write(msgs[0] + msgs[1] + msgs[0][:5])
+        # views kept alive pin the buffer: consuming and appending must fall
+        # back to fresh buffers instead of failing with BufferError
+        self.framer.drain(kept.append)
+        self.framer.write(msgs[0][5:])
+        self.framer.drain(kept.append)
+        self.assertEqual([bytes(v) for v in kept], msgs + msgs[:1])
+
+
+if __name__ == "__main__":
+    unittest.main()
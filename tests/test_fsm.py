@@ -0,0 +1,80 @@
+from protos.bgp import BGP
+from protos.capture import NullTransport
+import logging
+import unittest
+
+EVENTS = [
+    "ManualStart",
+    "ManualStop",
+    "ConnectRetryTimer_Expires",
+    "HoldTimer_Expires",
+    "KeepaliveTimer_Expires",
+    "Tcp_CR_Acked",
+    "TcpConnectionConfirmed",
+    "TcpConnectionFails",
+    "BGPOpen",
+    "BGPHeaderErr",
+    "BGPOpenMsgErr",
+    "NotifMsgVerErr",
+    "NotifMsg",
+    "KeepAliveMsg",
+    "UpdateMsg",
+    "UpdateMsgErr",
+]
+
+# What the transitions-based machine the dispatch table replaced did, as
+# (state, event) -> (next state, messages sent). Every other pair left the
+# state alone and sent nothing.
+EXPECTED = {
+    ("Idle", "ManualStart"): ("Connect", []),
+    ("Idle", "ConnectRetryTimer_Expires"): ("Connect", []),
+    ("Connect", "ManualStop"): ("Idle", []),
+    ("Connect", "Tcp_CR_Acked"): ("OpenSent", ["OPEN"]),
+    ("Connect", "TcpConnectionConfirmed"): ("OpenSent", ["OPEN"]),
+    ("OpenSent", "BGPOpen"): ("OpenConfirm", ["KEEPALIVE"]),
+    ("OpenSent", "NotifMsg"): ("OpenSent", ["NOTIFICATION"]),
+    ("OpenConfirm", "KeepAliveMsg"): ("Established", []),
+    ("Established", "KeepaliveTimer_Expires"): ("Established", ["KEEPALIVE"]),
+    ("Established", "NotifMsg"): ("Idle", []),
+}
+for state in ("OpenSent", "OpenConfirm", "Established"):
+    EXPECTED[(state, "ManualStop")] = ("Idle", ["NOTIFICATION"])
+    EXPECTED[(state, "HoldTimer_Expires")] = ("Idle", ["NOTIFICATION"])
+for state in BGP.states:
+    EXPECTED[(state, "TcpConnectionFails")] = ("Idle", [])
+
+
+class FsmTest(unittest.TestCase):
+    def setUp(self):
+        logging.getLogger("BGP").setLevel(logging.WARNING)
+
+    def session(self, state):
+        session = BGP("127.0.0.1", 1, "10.0.0.1")
+        session.transport = NullTransport()
+        session.connect = lambda: None
+        session.sent = []
+        session.send_bgp_msg = lambda pktcls, *a, **kw: session.sent.append(pktcls)
+        getattr(session, "to_" + state)()
+        return session
+
+    def test_matches_previous_machine(self):
+        for state in BGP.states:
+            for event in EVENTS:
+                with self.subTest(state=state, event=event):
+                    session = self.session(state)
+                    args = () if event.startswith(("Manual", "Tcp")) else (None,)
+                    if event.endswith("Expires"):
+                        args = ()
+                    session._event(event, *args)
+                    expected = EXPECTED.get((state, event), (state, []))
+                    self.assertEqual((session.state, session.sent), expected)
+                    for timer in session.sattrs["timers"].values():
+                        timer.stop()
+
+    def test_unknown_event(self):
+        with self.assertRaises(KeyError):
+            self.session("Idle")._event("NoSuchEvent")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+from fuzzers.bgp import BGPFuzzer, default_fuzzspec
+from fuzzers.feedback import Reaction
+from fuzzers.fuzz import check_fields, spec_fields
+from protos.bgp import BGP
+import logging
+import unittest
+
+
+class SpecFieldsTest(unittest.TestCase):
+    def test_names_match_fuzzspec(self):
+        names = spec_fields(default_fuzzspec())
+        self.assertIn("BGPKeepalive.header", names)
+        self.assertIn("BGPUpdate.path_attr", names)
+        check_fields(default_fuzzspec(), names)
+
+    def test_unknown_field_is_named(self):
+        with self.assertRaisesRegex(ValueError, "BGPKeepAlive.marker"):
+            check_fields(default_fuzzspec(), ["BGPKeepAlive.marker"])
+
+
+class CorpusSeedTest(unittest.TestCase):
+    def setUp(self):
+        logging.getLogger("BGP").setLevel(logging.WARNING)
+        self.fuzzer = BGPFuzzer("127.0.0.1", 1, "10.0.0.1")
+        self.fuzzer.fuzz(["BGPUpdate.path_attr", "BGPUpdate.withdrawn_routes_len"])
+        self.fuzzer.fuzzspec["BGPUpdate"]["path_attr"]["strategies"] = ["duplicate"]
+        self.msg = BGP.make_bytes(self.fuzzer, "UPDATE", nlri=["10.0.0.0/24"])
+        self.seed = BGP.make_bytes(
+            self.fuzzer, "UPDATE", nlri=["10.0.0.0/24", "10.1.0.0/24"]
+        )
+        self.fuzzer.corpus.add("UPDATE", self.seed, Reaction("notification", 3, 1))
+
+    def test_attr_strategies_take_seeds_of_any_length(self):
+        fuzzer = self.fuzzer
+        plan = fuzzer.fuzz_plan("UPDATE", self.msg)
+        batch = fuzzer.next_batch("UPDATE", self.msg, plan, ["duplicate"])
+        tails = {bytes(case[-4:]) for case in batch}
+        self.assertIn(self.seed[-4:], tails)
+        # the plan was compiled for the base message, so it still gets that
+        self.assertIn(self.msg[-4:], tails)
+
+
+if __name__ == "__main__":
+    unittest.main()
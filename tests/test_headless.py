@@ -0,0 +1,47 @@
+from fuzzers import headless
+import json
+import os
+import tempfile
+import unittest
+
+
+class LoadTest(unittest.TestCase):
+    def load(self, config):
+        fd, path = tempfile.mkstemp(suffix=".json")
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, "w") as f:
+            json.dump(config, f)
+        return headless.load(path)
+
+    def test_target_and_fields(self):
+        config = self.load({"target": "127.0.0.1:1790", "fuzz": ["BGPOpen.my_as"]})
+        self.assertEqual(config["neighbor"], "127.0.0.1")
+        self.assertEqual(config["port"], 1790)
+
+    def test_bad_types_are_config_errors(self):
+        for bad in (
+            {"fuzzspec": 5},
+            {"fuzzspec": {"BGPOpen": 3}},
+            {"fuzz": "BGPOpen.my_as"},
+            {"fuzz": [3]},
+            {"fuzz": ["BGPOpen.no_such_field"]},
+        ):
+            with self.subTest(bad=bad):
+                with self.assertRaises(ValueError):
+                    self.load(dict(bad, target="127.0.0.1:1"))
+
+    def test_findings_exit_code_is_not_a_traceback(self):
+        codes = [
+            headless.EXIT_CLEAN,
+            headless.EXIT_FINDINGS,
+            headless.EXIT_CONFIG,
+            headless.EXIT_UNREACHABLE,
+            headless.EXIT_ERROR,
+            headless.EXIT_INTERRUPTED,
+        ]
+        self.assertNotIn(1, codes)
+        self.assertEqual(len(set(codes)), len(codes))
+
+
+if __name__ == "__main__":
+    unittest.main()
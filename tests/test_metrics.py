@@ -0,0 +1,70 @@
+from protos import metrics
+import random
+import unittest
+
+
+class HistogramTest(unittest.TestCase):
+    def values(self, n=5000, seed=1):
+        rng = random.Random(seed)
+        return [rng.lognormvariate(-6, 2) for _ in range(n)]
+
+    def test_buckets_hold_their_values(self):
+        hist = metrics.Histogram()
+        for value in self.values(500):
+            hist.counts.clear()
+            hist.record(value)
+            (index,) = hist.counts
+            low, high = hist.bucket(index)
+            self.assertLessEqual(low, value + 1e-12)
+            self.assertLess(value, high + 1e-12)
+
+    def test_percentiles_within_precision(self):
+        values = self.values()
+        hist = metrics.Histogram()
+        for value in values:
+            hist.record(value)
+        ordered = sorted(values)
+        for q in (1, 25, 50, 90, 99, 99.9, 100):
+            with self.subTest(q=q):
+                exact = ordered[max(0, int(q / 100 * len(ordered)) - 1)]
+                estimate = hist.percentile(q)
+                self.assertGreaterEqual(estimate, exact)
+                self.assertLessEqual(estimate, max(exact * (1 + 2**-hist.bits), exact + 2 * hist.unit))
+
+    def test_empty(self):
+        hist = metrics.Histogram()
+        self.assertIsNone(hist.percentile(50))
+        self.assertEqual(hist.snapshot()["p99"], None)
+        self.assertEqual(hist.cumulative(), [0] * len(metrics.BOUNDS))
+
+    def test_merge(self):
+        values = self.values()
+        whole, left, right = (metrics.Histogram() for _ in range(3))
+        for n, value in enumerate(values):
+            whole.record(value)
+            (left if n % 2 else right).record(value)
+        left.merge(right)
+        merged, expected = left.snapshot(), whole.snapshot()
+        self.assertAlmostEqual(merged.pop("sum"), expected.pop("sum"))
+        self.assertEqual(merged, expected)
+        self.assertEqual(left.counts, whole.counts)
+
+    def test_cumulative(self):
+        hist = metrics.Histogram()
+        for value in (2e-6, 3e-5, 3e-5, 0.5):
+            hist.record(value)
+        counts = hist.cumulative()
+        self.assertEqual(counts, sorted(counts))
+        self.assertEqual(counts[-1], 4)
+        self.assertEqual(counts[0], 0)
+
+    def test_exposition_help(self):
+        text = metrics.exposition([metrics.SessionMetrics()])
+        self.assertIn(
+            "# HELP neph_reaction_seconds Time from a mutated message to the target's reaction.",
+            text,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+from fuzzers import minimize
+from protos import codec
+import unittest
+
+ORIGIN = codec.PathAttribute(codec.ATTR_TRANSITIVE, 1, b"\x00")
+MED = codec.PathAttribute(codec.ATTR_OPTIONAL, 4, b"\x00\x00\x00\x01")
+
+
+class LocalMinimizer(minimize.Minimizer):
+    """Tests sequences with a predicate instead of targets."""
+
+    def __init__(self, messages, fails, **kwargs):
+        super().__init__(messages, **kwargs)
+        self.fails = fails
+
+    def test(self, sequences):
+        self.tests += len(sequences)
+        return [self.fails(list(s)) for s in sequences]
+
+
+class DdminTest(unittest.TestCase):
+    def test_keeps_the_messages_needed(self):
+        messages = [bytes([n]) for n in range(16)]
+        minimizer = LocalMinimizer(
+            messages, lambda s: b"\x03" in s and b"\x0c" in s, workers=4
+        )
+        keep = minimizer.ddmin(list(range(16)), lambda k: [messages[i] for i in k])
+        self.assertEqual(keep, [3, 12])
+
+    def test_empty_sequence_reproduces(self):
+        minimizer = LocalMinimizer([b"a"], lambda s: True, workers=1)
+        self.assertEqual(minimizer.ddmin([0, 1, 2], lambda k: [b"a"] * len(k)), [])
+
+    def test_shrinks_within_a_message(self):
+        msg = codec.encode_update(
+            path_attr=[ORIGIN, MED], nlri=["10.0.0.0/8", "11.0.0.0/8", "12.0.0.0/8"]
+        )
+
+        def fails(seq):
+            try:
+                update = codec.decode(seq[0])
+            except ValueError:
+                return False
+            return "11.0.0.0/8" in update.nlri and MED in update.path_attr
+
+        minimizer = LocalMinimizer([msg], fails, workers=2)
+        shrunk = minimizer.shrink([msg], 0, minimize.parts)
+        update = codec.decode(shrunk)
+        self.assertEqual(update.nlri, ["11.0.0.0/8"])
+        self.assertEqual(update.path_attr, [MED])
+
+    def test_unknown_kind(self):
+        with self.assertRaises(ValueError):
+            minimize.Minimizer([b""], kind="boom")
+
+
+class RemoveTest(unittest.TestCase):
+    def test_parts_of_an_update(self):
+        msg = codec.encode_update(
+            withdrawn_routes=["9.0.0.0/8"], path_attr=[ORIGIN, MED], nlri=["10.0.0.0/8"]
+        )
+        units = minimize.parts(msg)
+        self.assertEqual(len(units), 4)
+        for i in range(4):
+            with self.subTest(removed=i):
+                keep = [j for j in range(4) if j != i]
+                update = codec.decode(minimize.remove(msg, units, keep))
+                self.assertEqual(
+                    len(update.withdrawn_routes) + len(update.path_attr) + len(update.nlri),
+                    3,
+                )
+
+    def test_parts_of_an_open(self):
+        params = [(2, b"\x01\x04\x00\x01\x00\x01"), (2, b"\x41\x04\x00\x00\xfd\xe8")]
+        msg = codec.encode_open(1, 90, "10.0.0.1", opt_params=params)
+        units = minimize.parts(msg)
+        self.assertEqual(len(units), 2)
+        shrunk = minimize.remove(msg, units, [1])
+        self.assertEqual(len(shrunk), len(msg) - 8)
+        self.assertEqual(codec.decode(shrunk).opt_params, [params[1]])
+
+    def test_value_bytes_adjust_the_attribute_length(self):
+        msg = codec.encode_update(path_attr=[MED], nlri=["10.0.0.0/8"])
+        units = minimize.value_bytes(msg)
+        self.assertEqual(len(units), 4)
+        update = codec.decode(minimize.remove(msg, units, [0, 3]))
+        self.assertEqual(update.path_attr[0].value, b"\x00\x01")
+
+    def test_wrong_lengths_stay_wrong(self):
+        msg = bytearray(codec.encode_update(path_attr=[ORIGIN, MED], nlri=["10.0.0.0/8"]))
+        # claim one byte more than the header says
+        msg[17] += 1
+        msg = bytes(msg)
+        shrunk = minimize.remove(msg, minimize.parts(msg), [1, 2])
+        self.assertEqual(int.from_bytes(shrunk[16:18], "big"), len(shrunk) + 1)
+
+
+class TargetTest(unittest.TestCase):
+    def test_minimizes_against_standin(self):
+        # the stand-in drops the session on a message with a bad marker
+        bad = b"\x00" * 16 + codec.encode_keepalive()[16:]
+        messages = [codec.encode_keepalive()] * 5 + [bad] + [codec.encode_keepalive()] * 5
+        minimizer = minimize.Minimizer(
+            messages, kind=minimize.DROP, workers=2, wait=0.5, bytewise=False
+        )
+        result = minimizer.run()
+        self.assertEqual(result["messages"], [bad])
+        self.assertEqual(result["original"], (11, 11 * 19))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+from fuzzers.bgp import BGPFuzzer
+from fuzzers.feedback import NOTIFICATION
+from fuzzers.oracle import TcpProbe
+from protos import codec
+from protos.capture import NullTransport
+import logging
+import os
+import resource
+import socket
+import unittest
+
+
+def run_probe(address, timeout=1.0):
+    """Run a probe to completion, with call_later calling back right away."""
+    calls = []
+    results = []
+    probe = TcpProbe(
+        lambda delay, fn: calls.append(fn),
+        address,
+        timeout,
+        lambda ok, result: results.append(ok),
+        step=0,
+    )
+    probe.start()
+    while calls:
+        calls.pop(0)()
+    return results
+
+
+class TcpProbeTest(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(8)
+        self.address = self.listener.getsockname()
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_connects(self):
+        self.assertEqual(run_probe(self.address), [True])
+
+    def test_refused(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            address = sock.getsockname()
+        self.assertEqual(run_probe(address), [False])
+
+    def test_descriptor_above_select_limit(self):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if hard != resource.RLIM_INFINITY and hard < 1200:
+            self.skipTest("descriptor limit too low")
+        resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, 1200), hard))
+        fds = []
+        try:
+            while not fds or fds[-1] < 1100:
+                fds.append(os.dup(0))
+            self.assertEqual(run_probe(self.address), [True])
+        finally:
+            for fd in fds:
+                os.close(fd)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+
+class Transport(NullTransport):
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    def writeSequence(self, data):
+        self.written.append(b"".join(data))
+
+
+class ProbeTest(unittest.TestCase):
+    KEEPALIVE = b"\xff" * 16 + b"\x00\x13\x04"
+
+    def setUp(self):
+        logging.getLogger("BGP").setLevel(logging.WARNING)
+        self.fuzzer = BGPFuzzer("127.0.0.1", 1, "10.0.0.1")
+        self.fuzzer.transport = Transport()
+        self.fuzzer.fuzz(["BGPOpen.hold_time"])
+        self.case = self.fuzzer.make_bytes("OPEN")
+
+    def receive(self, msg):
+        self.fuzzer.recv_bgp_msg(msg[18], len(msg), msg)
+
+    def test_probe_answer_is_not_a_reaction(self):
+        self.fuzzer.send_probe()
+        self.receive(self.KEEPALIVE)
+        self.assertTrue(self.fuzzer.pending)
+        self.assertEqual(len(self.fuzzer.corpus), 0)
+        notification = self.fuzzer.render_NOTIFICATION(error_code=2, error_subcode=2)
+        self.receive(notification)
+        self.assertFalse(self.fuzzer.pending)
+        [entry] = self.fuzzer.corpus.entries.values()
+        self.assertEqual(entry.case, self.case)
+        self.assertEqual(entry.reaction.kind, NOTIFICATION)
+
+    def test_probe_goes_through_cork(self):
+        self.fuzzer.cork()
+        self.fuzzer.send_bytes(self.case)
+        self.fuzzer.send_probe()
+        self.assertEqual(self.fuzzer.transport.written, [self.case + self.KEEPALIVE])
+        self.assertEqual(self.fuzzer.metrics.sent[codec.KEEPALIVE], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+from fuzzers.seen import SeenFilter
+import numpy as np
+import unittest
+
+
+def cases(n, size=19, seed=1):
+    return list(np.random.default_rng(seed).integers(0, 256, (n, size), np.uint8))
+
+
+class SeenFilterTest(unittest.TestCase):
+    def test_fresh_then_seen(self):
+        seen = SeenFilter(capacity=1000)
+        batch = [bytes(c) for c in cases(100)]
+        self.assertEqual(list(seen.fresh(batch)), list(range(100)))
+        self.assertEqual(len(seen.fresh(batch)), 0)
+        self.assertEqual(len(seen), 100)
+
+    def test_duplicates_within_a_batch(self):
+        seen = SeenFilter(capacity=1000)
+        self.assertEqual(list(seen.fresh([b"a", b"b", b"a", b"c", b"b"])), [0, 1, 3])
+        self.assertEqual(seen.filter([b"c", b"d", b"d"]), [b"d"])
+
+    def test_array_batches(self):
+        seen = SeenFilter(capacity=1000)
+        batch = np.array(cases(10))
+        seen.filter(batch[:5])
+        kept = seen.filter(batch)
+        self.assertIsInstance(kept, np.ndarray)
+        self.assertTrue((kept == batch[5:]).all())
+
+    def test_false_positive_rate(self):
+        seen = SeenFilter(capacity=20000, error=0.01)
+        seen.fresh([bytes(c) for c in cases(20000, seed=1)])
+        self.assertAlmostEqual(seen.false_positive_rate(), 0.01, delta=0.005)
+        unseen = [bytes(c) for c in cases(20000, seed=2)]
+        rate = 1 - len(seen.fresh(unseen)) / len(unseen)
+        self.assertLess(rate, 0.02)
+
+    def test_max_bytes(self):
+        seen = SeenFilter(capacity=10 ** 6, error=0.001, max_bytes=4096)
+        self.assertEqual(seen.bits.nbytes, 4096)
+        self.assertGreater(SeenFilter(capacity=10 ** 6).bits.nbytes, 4096)
+
+    def test_clear(self):
+        seen = SeenFilter(capacity=1000)
+        seen.fresh([b"a"])
+        seen.clear()
+        self.assertEqual(len(seen), 0)
+        self.assertEqual(list(seen.fresh([b"a"])), [0])
+
+    def test_report(self):
+        seen = SeenFilter(capacity=1000)
+        seen.fresh([b"a", b"b", b"a"])
+        report = seen.report()
+        self.assertEqual((report["hits"], report["misses"], report["count"]), (1, 2, 2))
+        self.assertAlmostEqual(report["hit_rate"], 1 / 3)
+
+    def test_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            SeenFilter(capacity=0)
+        with self.assertRaises(ValueError):
+            SeenFilter(error=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+from fuzzers.feedback import ACCEPTED, DROP, NOTIFICATION, Reaction
+from fuzzers.store import CorpusStore
+import os
+import shutil
+import tempfile
+import unittest
+
+KEEPALIVE = b"\xff" * 16 + b"\x00\x13\x04"
+OPEN = b"\xff" * 16 + b"\x00\x1d\x01" + bytes(10)
+
+
+class CorpusStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, "corpus")
+
+    def fill(self, store):
+        store.append(KEEPALIVE, reaction=Reaction(ACCEPTED))
+        store.append(
+            OPEN, field="BGPOpen.hold_time", reaction=Reaction(NOTIFICATION, 2, 6)
+        )
+        store.append(OPEN, "OPEN", field="BGPOpen.my_as", reaction=Reaction(DROP))
+        store.append(KEEPALIVE[:-1] + b"\x07")
+
+    def test_append_and_read(self):
+        with CorpusStore(self.path) as store:
+            self.fill(store)
+            self.assertEqual(len(store), 4)
+            self.assertEqual(bytes(store[1]), OPEN)
+            self.assertEqual(bytes(store[-1])[-1], 7)
+            self.assertEqual(list(store.messages([0, 2])), [KEEPALIVE, OPEN])
+            self.assertEqual(store.reaction(1), Reaction(NOTIFICATION, 2, 6))
+            self.assertIsNone(store.reaction(3))
+            self.assertEqual(store.field(2), "BGPOpen.my_as")
+
+    def test_select(self):
+        with CorpusStore(self.path) as store:
+            self.fill(store)
+            self.assertEqual(list(store.select(msgtype="OPEN")), [1, 2])
+            self.assertEqual(list(store.select(msgtype=7)), [3])
+            self.assertEqual(list(store.select(field="BGPOpen.my_as")), [2])
+            self.assertEqual(list(store.select(field="nonexistent")), [])
+            self.assertEqual(list(store.select(reaction=NOTIFICATION)), [1])
+            self.assertEqual(
+                list(store.select(reaction=Reaction(NOTIFICATION, 2, 5))), []
+            )
+            self.assertEqual(
+                list(store.select(msgtype="OPEN", reaction=Reaction(DROP))), [2]
+            )
+
+    def test_reopen(self):
+        with CorpusStore(self.path) as store:
+            self.fill(store)
+        with CorpusStore(self.path) as store:
+            self.assertEqual(len(store), 4)
+            # appending after reopening keeps existing field ids
+            store.append(OPEN, field="BGPOpen.my_as")
+            self.assertEqual(list(store.select(field="BGPOpen.my_as")), [2, 4])
+        with CorpusStore(self.path, readonly=True) as store:
+            self.assertEqual(len(store), 5)
+            self.assertEqual(bytes(store[4]), OPEN)
+            self.assertEqual(store.field(1), "BGPOpen.hold_time")
+            with self.assertRaises(IOError):
+                store.append(KEEPALIVE)
+
+    def test_append_after_read(self):
+        with CorpusStore(self.path) as store:
+            store.append(KEEPALIVE)
+            self.assertEqual(len(store.columns), 1)
+            store.append(OPEN)
+            self.assertEqual(bytes(store[1]), OPEN)
+            self.assertEqual(len(store.columns), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
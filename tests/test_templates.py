@@ -0,0 +1,59 @@
+from protos.bgp import BGP
+from protos.templates import Template, TemplateCache
+import logging
+import unittest
+
+
+class TemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.template = Template(
+            b"\x00" * 4 + b"\x00\x06", {"a": (0, 2), "b": (2, 2)}, length=(4, 2)
+        )
+
+    def test_render_patches_fields(self):
+        rendered = self.template.render(a=1, b=b"\xab\xcd")
+        self.assertEqual(rendered[:4], b"\x00\x01\xab\xcd")
+        self.assertIs(self.template.render(), self.template.data)
+
+    def test_payload_fixes_length(self):
+        self.assertEqual(self.template.render(b"xyz")[4:], b"\x00\x09xyz")
+
+    def test_bad_values(self):
+        with self.assertRaises(KeyError):
+            self.template.render(c=1)
+        with self.assertRaises(ValueError):
+            self.template.render(a=b"\x01")
+        with self.assertRaises(OverflowError):
+            self.template.render(a=1 << 16)
+
+    def test_cache_builds_once(self):
+        cache = TemplateCache()
+        built = []
+        build = lambda: built.append(1) or self.template
+        self.assertIs(cache.get("k", build), cache.get("k", build))
+        self.assertEqual(len(built), 1)
+
+
+class RenderTest(unittest.TestCase):
+    """Rendered messages are the bytes Scapy builds for the same values."""
+
+    def setUp(self):
+        logging.getLogger("BGP").setLevel(logging.WARNING)
+
+    def check(self, session, pktcls, **kwargs):
+        self.assertEqual(
+            session.make_bytes(pktcls, **kwargs),
+            bytes(session.make_pkt(pktcls, **kwargs)),
+        )
+
+    def test_matches_scapy(self):
+        for my_as, bgp_id in ((1, "10.0.0.1"), (65535, "192.168.255.254")):
+            session = BGP("127.0.0.1", my_as, bgp_id)
+            self.check(session, "OPEN")
+            self.check(session, "KEEPALIVE")
+            for code in (1, 4, 6):
+                self.check(session, "NOTIFICATION", error_code=code)
+
+
+if __name__ == "__main__":
+    unittest.main()
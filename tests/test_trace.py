@@ -0,0 +1,80 @@
+from protos import trace
+from protos.bgp import BGP
+import gc
+import logging
+import os
+import tempfile
+import unittest
+
+
+class TraceTest(unittest.TestCase):
+    def setUp(self):
+        logging.getLogger("BGP").setLevel(logging.WARNING)
+
+    def dump(self, tracer):
+        fd, path = tempfile.mkstemp(suffix=".trace")
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        tracer.dump(path)
+        return trace.Trace(path)
+
+    def test_round_trip(self):
+        tracer = trace.Tracer()
+        session = tracer.session("peer", ["Idle", "Connect"])
+        tracer.record(session, trace.BURST, 1, 0, 12)
+        tracer.record(session, tracer.intern("ManualStart"), 0)
+        decoded = self.dump(tracer)
+        self.assertEqual(list(decoded.records()), list(tracer.records()))
+        lines = list(decoded.render(sessions=True))
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith("[peer] [>] Burst of 12 messages"))
+        self.assertTrue(lines[1].endswith("[peer] [+] Event 'ManualStart' in state 'Idle'"))
+
+    def test_wrapped_buffer(self):
+        tracer = trace.Tracer(capacity=4)
+        session = tracer.session("peer")
+        for n in range(10):
+            tracer.mark(session, trace.BURST, 0, 0, n)
+        decoded = self.dump(tracer)
+        self.assertEqual([r[5] for r in decoded.records()], [6, 7, 8, 9])
+        self.assertEqual(decoded.header["dropped"], 7)
+
+    def test_sampling(self):
+        tracer = trace.Tracer(sample=3)
+        session = tracer.session("peer")
+        for _ in range(9):
+            tracer.record(session, trace.DATA, 0)
+        # plus the SESSION mark
+        self.assertEqual(len(tracer), 4)
+
+    def test_not_a_trace(self):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, b"garbage")
+        os.close(fd)
+        self.addCleanup(os.unlink, path)
+        with self.assertRaises(ValueError):
+            trace.Trace(path)
+
+    def test_released_ids_are_reused(self):
+        tracer = trace.Tracer()
+        first = tracer.session("first")
+        tracer.mark(first, trace.CONNECTED, 0)
+        tracer.release(first)
+        second = tracer.session("second")
+        tracer.mark(second, trace.CONNECTED, 0)
+        self.assertEqual(first, second)
+        self.assertEqual(len(tracer.sessions), 1)
+        lines = list(self.dump(tracer).render(sessions=True))
+        self.assertIn("[first]", lines[0])
+        self.assertIn("[second]", lines[1])
+
+    def test_collected_sessions_release_ids(self):
+        tracer = trace.Tracer()
+        for _ in range(50):
+            BGP("127.0.0.1", 1, "10.0.0.1").trace_to(tracer)
+            gc.collect()
+        self.assertLessEqual(len(tracer.sessions), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
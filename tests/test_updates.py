@@ -0,0 +1,61 @@
+from protos import codec
+from protos.updates import UPDATE_OVERHEAD, pack_updates, prefix_range
+import unittest
+
+ORIGIN = (codec.PathAttribute(codec.ATTR_TRANSITIVE, 1, b"\x00"),)
+MED = (codec.PathAttribute(codec.ATTR_OPTIONAL, 4, b"\x00\x00\x00\x01"),)
+
+
+def decode(msgs):
+    return [codec.decode(msg) for msg in msgs]
+
+
+class PackUpdatesTest(unittest.TestCase):
+    def test_messages_are_full(self):
+        prefixes = list(prefix_range("10.0.0.0/24", 3000, 24))
+        msgs = list(pack_updates((ORIGIN, p) for p in prefixes))
+        room = 4096 - UPDATE_OVERHEAD - len(codec.encode_path_attrs(ORIGIN))
+        # every /24 takes 4 bytes; all messages but the last are full
+        per_msg = room // 4
+        self.assertEqual(len(msgs), -(-3000 // per_msg))
+        for msg in msgs:
+            self.assertLessEqual(len(msg), 4096)
+        for msg in msgs[:-1]:
+            self.assertGreater(len(msg), 4096 - 4)
+        nlri = [p for msg in decode(msgs) for p in msg.nlri]
+        self.assertEqual(len(nlri), 3000)
+        self.assertEqual(nlri[0], "10.0.0.0/24")
+        self.assertTrue(all(msg.path_attr == list(ORIGIN) for msg in decode(msgs)))
+
+    def test_groups_by_attributes(self):
+        routes = [(ORIGIN, "10.0.0.0/8"), (MED, "11.0.0.0/8"), (ORIGIN, "12.0.0.0/8")]
+        msgs = decode(pack_updates(routes))
+        # leftover groups go out least recently used first
+        self.assertEqual(
+            [(m.path_attr, m.nlri) for m in msgs],
+            [
+                (list(MED), ["11.0.0.0/8"]),
+                (list(ORIGIN), ["10.0.0.0/8", "12.0.0.0/8"]),
+            ],
+        )
+
+    def test_withdrawals(self):
+        msgs = decode(pack_updates([(None, "10.0.0.0/8"), (None, "11.1.0.0/16")]))
+        self.assertEqual(len(msgs), 1)
+        self.assertEqual(msgs[0].withdrawn_routes, ["10.0.0.0/8", "11.1.0.0/16"])
+        self.assertEqual(msgs[0].path_attr, [])
+
+    def test_max_groups_flushes_least_recently_used(self):
+        routes = [(ORIGIN, "10.0.0.0/8"), (MED, "11.0.0.0/8"), (None, "12.0.0.0/8")]
+        msgs = decode(pack_updates(routes, max_groups=2))
+        self.assertEqual(msgs[0].nlri, ["10.0.0.0/8"])
+        self.assertEqual(len(msgs), 3)
+
+    def test_attributes_too_large(self):
+        big = (codec.PathAttribute(codec.ATTR_OPTIONAL, 99, b"\x00" * 4070),)
+        with self.assertRaises(ValueError):
+            list(pack_updates([(big, "10.0.0.0/8")]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+from protos.wheel import TimerWheel
+import unittest
+
+
+class FakeLoop(object):
+    """Manual clock whose delayed calls run only when time is moved on."""
+
+    class Call(object):
+        def __init__(self, when, fn):
+            self.when = when
+            self.fn = fn
+            self.cancelled = False
+
+        def cancel(self):
+            self.cancelled = True
+
+    def __init__(self):
+        self.time = 0.0
+        self.calls = []
+
+    def clock(self):
+        return self.time
+
+    def call_later(self, delay, fn):
+        call = FakeLoop.Call(self.time + delay, fn)
+        self.calls.append(call)
+        return call
+
+    def run_until(self, when):
+        """Run the calls due up to ``when``, in order, moving the clock."""
+        while True:
+            due = [c for c in self.calls if not c.cancelled and c.when <= when]
+            if not due:
+                break
+            call = min(due, key=lambda c: c.when)
+            self.calls.remove(call)
+            self.time = max(self.time, call.when)
+            call.fn()
+        self.time = when
+
+
+class TimerWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = FakeLoop()
+        self.wheel = TimerWheel(self.loop.call_later, clock=self.loop.clock)
+
+    def advance(self, seconds):
+        self.loop.time += seconds
+        self.wheel.advance(self.wheel.now())
+
+    def test_fires_once_due(self):
+        fired = []
+        self.wheel.add(0.05, lambda: fired.append(1))
+        self.advance(0.04)
+        self.assertEqual(fired, [])
+        self.advance(0.02)
+        self.assertEqual(fired, [1])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_callback_cancels_sibling_in_same_tick(self):
+        fired = []
+        timers = {}
+
+        def first():
+            fired.append("first")
+            self.wheel.cancel(timers["second"])
+
+        timers["first"] = self.wheel.add(0.05, first)
+        timers["second"] = self.wheel.add(0.05, lambda: fired.append("second"))
+        self.advance(0.1)
+        self.assertEqual(fired, ["first"])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_callback_reschedules_sibling_in_same_tick(self):
+        fired = []
+        timers = {}
+
+        def first():
+            fired.append("first")
+            timers["second"] = self.wheel.reschedule(timers["second"], 0.05)
+
+        timers["first"] = self.wheel.add(0.05, first)
+        timers["second"] = self.wheel.add(0.05, lambda: fired.append("second"))
+        self.advance(0.06)
+        self.assertEqual(fired, ["first"])
+        self.advance(0.06)
+        self.assertEqual(fired, ["first", "second"])
+
+    def test_timer_added_by_callback_keeps_earlier_wakeup(self):
+        fired = []
+
+        def periodic():
+            fired.append(("periodic", self.loop.time))
+            self.wheel.add(30, periodic)
+
+        self.wheel.add(0.05, periodic)
+        self.wheel.add(5, lambda: fired.append(("short", self.loop.time)))
+        self.loop.run_until(6)
+        self.assertEqual([name for name, _ in fired], ["periodic", "short"])
+        self.assertLess(fired[1][1], 5.02)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+from protos.writer import POLL_MAX, POLL_MIN, SegmentWriter
+import unittest
+
+
+class FakeSession(object):
+    """Records writes and delayed calls instead of running them."""
+
+    class Transport(object):
+        def __init__(self):
+            self.written = []
+
+        def write(self, data):
+            self.written.append(data)
+
+    def __init__(self):
+        self.transport = FakeSession.Transport()
+        self.calls = []
+
+    def call_later(self, delay, fn):
+        self.calls.append((delay, fn))
+
+    def run_next(self):
+        return self.calls.pop(0)[1]()
+
+
+class Unacked(SegmentWriter):
+    """SegmentWriter whose first message is never acknowledged."""
+
+    def _drained(self):
+        return not self.sent
+
+
+class SegmentWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.session = FakeSession()
+        self.finished = []
+
+    def writer(self, timeout):
+        writer = Unacked(
+            self.session, [b"a", b"b"], done=self.finished.append, timeout=timeout
+        )
+        writer._next()
+        return writer
+
+    def test_polls_with_backoff(self):
+        self.writer(timeout=60)
+        self.assertEqual(self.session.transport.written, [b"a"])
+        delays = []
+        for _ in range(10):
+            self.session.run_next()
+            delays.append(self.session.calls[0][0])
+        self.assertEqual(delays[:3], [POLL_MIN, POLL_MIN * 2, POLL_MIN * 4])
+        self.assertEqual(delays[-1], POLL_MAX)
+        self.assertEqual(self.session.transport.written, [b"a"])
+
+    def test_stops_when_unacknowledged(self):
+        writer = self.writer(timeout=0)
+        self.session.run_next()
+        self.assertTrue(writer.timed_out)
+        self.assertEqual(self.session.transport.written, [b"a"])
+        self.assertEqual(self.finished, [1])
+        self.assertEqual(self.session.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()